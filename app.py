@@ -1,24 +1,229 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from db.init import init_db
+from flask import Flask, render_template, request, redirect, url_for, flash, g, jsonify, Response, abort
+from flask import before_render_template, got_request_exception, template_rendered
+from db.init import create_tables, init_db
+from db.importer import import_subscribers, detect_format, IMPORT_FORMATS
+from db.migrations import migrate
+from db import querylog
+from db.utils import begin_unit_of_work, end_unit_of_work, get_db
+import jobs
+import metrics
+import ratelimit
+import session_store
 import service
 from functools import wraps
+import click
+import csv
+import io
+import itertools
+import json
+import logging
+import uuid
 from datetime import datetime
 import os
+import threading
+import time
 
 app = Flask(__name__)
 app.secret_key = "very-secret-key"
 
 
+# Метрики запитів для /metrics. Хуки зареєстровані раніше за unit of work, тож
+# after_request виконується після фіксації транзакції і враховує її час.
+REQUESTS = metrics.registry.counter(
+    "http_requests_total", "Кількість HTTP-запитів", ("endpoint", "method", "status"))
+REQUEST_LATENCY = metrics.registry.histogram(
+    "http_request_duration_seconds", "Тривалість обробки HTTP-запиту", ("endpoint",))
+REQUEST_DB_TIME = metrics.registry.histogram(
+    "http_request_db_seconds", "Час SQL-запитів у межах HTTP-запиту", ("endpoint",))
+REQUEST_RENDER_TIME = metrics.registry.histogram(
+    "http_request_render_seconds", "Час рендерингу шаблонів у межах HTTP-запиту", ("endpoint",))
+REQUEST_DB_QUERIES = metrics.registry.histogram(
+    "http_request_db_queries", "Кількість SQL-запитів на HTTP-запит", ("endpoint",), metrics.COUNT_BUCKETS)
+REQUEST_DB_CONNECTIONS = metrics.registry.histogram(
+    "http_request_db_connections", "Кількість з'єднань, узятих з пулу, на HTTP-запит", ("endpoint",),
+    metrics.COUNT_BUCKETS)
+RESPONSE_SIZE = metrics.registry.histogram(
+    "http_response_size_bytes", "Розмір тіла відповіді", ("endpoint",), metrics.SIZE_BUCKETS)
+CACHE_ENTRIES = metrics.registry.gauge("app_cache_entries", "Записів у кеші", ("cache",))
+CACHE_HITS = metrics.registry.gauge("app_cache_hits", "Влучань у кеш від запуску", ("cache",))
+CACHE_MISSES = metrics.registry.gauge("app_cache_misses", "Промахів кешу від запуску", ("cache",))
+
+def collect_cache_metrics():
+    for name, stats in service.cache_stats().items():
+        CACHE_ENTRIES.set(stats["size"], cache=name)
+        CACHE_HITS.set(stats["hits"], cache=name)
+        CACHE_MISSES.set(stats["misses"], cache=name)
+
+metrics.registry.add_collector(collect_cache_metrics)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.render_time = 0.0
+    g.db_stats = querylog.begin_request_stats()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or "unknown"
+    db_stats = querylog.end_request_stats() or querylog.RequestStats()
+
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    REQUEST_DB_TIME.observe(db_stats.query_time, endpoint=endpoint)
+    REQUEST_DB_QUERIES.observe(db_stats.queries, endpoint=endpoint)
+    REQUEST_DB_CONNECTIONS.observe(db_stats.connections, endpoint=endpoint)
+    REQUEST_RENDER_TIME.observe(g.pop("render_time", 0.0), endpoint=endpoint)
+    # розмір потокових відповідей (експорт) наперед невідомий
+    if not response.is_streamed:
+        RESPONSE_SIZE.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def clear_request_metrics(exc):
+    querylog.end_request_stats()
+
+# Детектор N+1: у режимі налагодження або тестування рахує SQL-запити й з'єднання
+# за запит, повторені відбитки пише в журнал і заголовки X-DB-*. У тестовому
+# режимі перевищення QUERY_BUDGET (або QUERY_BUDGETS[endpoint]) — помилка.
+app.config.update(
+    QUERY_DETECTOR=False,       # увімкнути і без debug/testing
+    QUERY_BUDGET=20,
+    QUERY_BUDGETS={},
+    QUERY_REPEAT_THRESHOLD=3,
+)
+
+query_logger = logging.getLogger("db.nplusone")
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+@app.after_request
+def detect_repeated_queries(response):
+    db_stats = g.get("db_stats")
+    if db_stats is None or not (app.debug or app.testing or app.config["QUERY_DETECTOR"]):
+        return response
+
+    endpoint = request.endpoint or "unknown"
+    repeated = db_stats.repeated(app.config["QUERY_REPEAT_THRESHOLD"])
+    response.headers["X-DB-Queries"] = str(db_stats.queries)
+    response.headers["X-DB-Connections"] = str(db_stats.connections)
+    response.headers["X-DB-Time-Ms"] = f"{db_stats.query_time * 1000:.1f}"
+    if repeated:
+        # заголовки HTTP — лише latin-1, тож не-ASCII символи запиту замінюються
+        summary = "; ".join(f"{n}x {key[:80]}" for key, n in repeated)
+        response.headers["X-DB-Repeated-Queries"] = summary.encode("ascii", "replace").decode()
+        for key, n in repeated:
+            query_logger.warning("%s: запит виконано %d разів: %s", endpoint, n, key)
+
+    budget = app.config["QUERY_BUDGETS"].get(endpoint, app.config["QUERY_BUDGET"])
+    if budget is not None and db_stats.queries > budget:
+        message = f"{endpoint}: {db_stats.queries} SQL-запитів при бюджеті {budget}"
+        if app.testing:
+            raise QueryBudgetExceeded(message)
+        query_logger.warning(message)
+    return response
+
+def template_render_started(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+def template_render_finished(sender, template, context, **extra):
+    started = g.pop("template_started", None)
+    if started is not None:
+        g.render_time = g.get("render_time", 0.0) + time.perf_counter() - started
+
+before_render_template.connect(template_render_started, app)
+template_rendered.connect(template_render_finished, app)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# Схема БД (таблиці й міграції) готується з першим запитом кожного процесу,
+# тож її отримує і `gunicorn app:app`, а не лише `python app.py`. Як і черга
+# завдань нижче — не при імпорті модуля, щоб CLI-команди не створювали БД.
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+@app.before_request
+def prepare_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            create_tables()
+            migrate()
+            _schema_ready = True
+
+
+# Фонові завдання запускаються з першим запитом (а не при імпорті модуля), щоб
+# CLI-команди і батьківський процес reloader не відновлювали чергу. Хук іде до
+# unit of work: відновлення черги фіксується одразу, а не разом із запитом.
+@app.before_request
+def start_job_runner():
+    jobs.runner.start()
+
+@app.before_request
+def sweep_expired_sessions():
+    session_store.store.maybe_sweep()
+
+
+# Один запит — одне з'єднання і одна транзакція: усі виклики service.* у межах
+# запиту приєднуються до неї, фіксація відбувається один раз після обробника.
+@app.before_request
+def open_unit_of_work():
+    g.uow_started = begin_unit_of_work()
+
+# Flask викликає after_request і для необробленого винятку (відповідь 500),
+# тому фіксація — лише для успішних відповідей без винятку в обробнику.
+def mark_request_failed(sender, exception, **extra):
+    g.request_failed = True
+
+got_request_exception.connect(mark_request_failed, app)
+
+@app.after_request
+def commit_unit_of_work(response):
+    if g.pop("uow_started", False):
+        ok = response.status_code < 500 and not g.get("request_failed")
+        end_unit_of_work(commit=ok)
+    return response
+
+@app.teardown_request
+def rollback_unit_of_work(exc):
+    if g.pop("uow_started", False):
+        end_unit_of_work(commit=False)
+
+
+GUEST = {"id": None, "login": "Guest", "role": "guest"}
+
 def get_current_user():
-    user = session.get("user")
-    if not user:
-        return {"id": None, "login": "Guest", "role": "guest"}
+    # Користувач серверної сесії (cookie містить лише її id), один раз на запит
+    user = g.get("current_user")
+    if user is None:
+        user = session_store.store.get(request.cookies.get(session_store.SESSION_COOKIE)) or GUEST
+        g.current_user = user
     return user
 
+def set_session_cookie(response, sid):
+    response.set_cookie(session_store.SESSION_COOKIE, sid, httponly=True, samesite="Lax",
+                        secure=app.config["SESSION_COOKIE_SECURE"])
+    return response
+
 @app.context_processor
 def inject_current_user():
     return {"current_user": get_current_user()}
 
+def page_args():
+    return {
+        "after": request.args.get("after"),
+        "before": request.args.get("before"),
+        "limit": request.args.get("size", type=int) or service.PAGE_SIZE,
+    }
+
 def allow(*roles):
     def decorator(f):
         @wraps(f)
@@ -63,21 +268,68 @@ def search():
     results = service.search_subscribers(q)
     return render_template("search_results.html", query=q, results=results)
 
+@app.route("/phones/lookup")
+@allow("user", "operator", "admin")
+def phone_lookup():
+    q = request.args.get("q", "").strip()
+    mode = request.args.get("mode", "suffix")
+    results = []
+    if q:
+        results = service.lookup_phones(q, mode)
+        if not results and mode in ("suffix", "contains") and len([c for c in q if c.isdigit()]) < 3:
+            flash("Для пошуку за закінченням або фрагментом введіть щонайменше 3 цифри", "warning")
+    return render_template("phone_lookup.html", query=q, mode=mode, results=results)
+
+# Спроби входу обмежуються до перевірки пароля (token bucket): за логіном —
+# проти перебору паролів одного облікового запису, за IP — проти перебору
+# логінів. Ліміт за IP щедрий: оператори зміни часто виходять з одного NAT.
+LOGIN_RATE_PER_LOGIN = (5, 1 / 30)     # (місткість, жетонів за секунду)
+LOGIN_RATE_PER_IP = (100, 2)
+
+login_limiters = {
+    "login": ratelimit.TokenBucketLimiter(*LOGIN_RATE_PER_LOGIN),
+    "ip": ratelimit.TokenBucketLimiter(*LOGIN_RATE_PER_IP),
+}
+
+LOGIN_ATTEMPTS = metrics.registry.counter(
+    "login_attempts_total", "Спроби входу за результатом", ("outcome",))
+
+def login_throttled(login_):
+    # секунд до наступної дозволеної спроби або 0
+    keys = (("ip", request.remote_addr), ("login", (login_ or "").lower()))
+    for kind, key in keys:
+        if not login_limiters[kind].allow(key):
+            return max(1, round(login_limiters[kind].retry_after(key)))
+    return 0
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         login_ = request.form.get("login")
         password = request.form.get("password")
 
+        wait = login_throttled(login_)
+        if wait:
+            LOGIN_ATTEMPTS.inc(outcome="throttled")
+            flash(f"Забагато спроб входу. Спробуйте через {wait} с", "danger")
+            return render_template("login.html"), 429, {"Retry-After": str(wait)}
+
         user = service.get_user_by_login(login_)
-        if user and service.verify_password(user, password):
-            session["user"] = {
-                "id": user["id"],
-                "login": user["login"],
-                "role": user["role"]
-            }
+        try:
+            ok = service.verify_password(user, password)
+        except service.PasswordCheckBusy:
+            LOGIN_ATTEMPTS.inc(outcome="busy")
+            flash("Сервер перевантажений, спробуйте увійти за кілька секунд", "warning")
+            return render_template("login.html"), 503, {"Retry-After": "5"}
+
+        LOGIN_ATTEMPTS.inc(outcome="success" if ok else "failure")
+        if ok:
+            # попередня сесія (якщо була) не переживає повторного входу
+            session_store.store.revoke(request.cookies.get(session_store.SESSION_COOKIE))
+            sid = session_store.store.create(user["id"], request.remote_addr,
+                                             request.user_agent.string[:200])
             flash("Успішний вхід", "success")
-            return redirect(url_for("index"))
+            return set_session_cookie(redirect(url_for("index")), sid)
 
         flash("Невірний логін або пароль", "danger")
 
@@ -86,9 +338,11 @@ def login():
 
 @app.route("/logout")
 def logout():
-    session.pop("user", None)
+    session_store.store.revoke(request.cookies.get(session_store.SESSION_COOKIE))
     flash("Ви вийшли із системи", "info")
-    return redirect(url_for("index"))
+    response = redirect(url_for("index"))
+    response.delete_cookie(session_store.SESSION_COOKIE)
+    return response
 
 @app.route("/request-access", methods=["GET", "POST"])
 @allow("guest")
@@ -131,6 +385,75 @@ def admin_reject_request(req_id):
     return redirect(url_for("admin_requests"))
 
 
+@app.route("/admin/import", methods=["GET", "POST"])
+@allow("admin")
+def admin_import():
+    if request.method == "POST":
+        upload = request.files.get("file")
+        if not upload or not upload.filename:
+            flash("Оберіть файл для імпорту", "danger")
+            return redirect(url_for("admin_import"))
+
+        fmt = request.form.get("format") or detect_format(upload.filename)
+        if fmt not in IMPORT_FORMATS:
+            abort(400)
+
+        # файл зберігається на диск: імпорт іде у фоні і може продовжитись після перезапуску
+        path = jobs.upload_dir() / f"{uuid.uuid4().hex}.{fmt}"
+        upload.save(path)
+        job_id = jobs.runner.submit("import", {"path": str(path), "format": fmt, "filename": upload.filename},
+                                    user=get_current_user()["login"])
+        flash(f"Імпорт «{upload.filename}» поставлено в чергу (завдання #{job_id})", "info")
+        return redirect(url_for("admin_jobs"))
+
+    return render_template("admin_import.html", formats=IMPORT_FORMATS)
+
+
+@app.route("/admin/jobs")
+@allow("admin")
+def admin_jobs():
+    rows = [jobs.job_to_dict(r) for r in jobs.get_jobs()]
+    return render_template("admin_jobs.html", jobs=rows,
+                           active=any(j["status"] in jobs.ACTIVE_STATUSES for j in rows),
+                           operations=jobs.MAINTENANCE_OPERATIONS)
+
+@app.route("/admin/jobs/<int:job_id>")
+@allow("admin")
+def admin_job_status(job_id):
+    row = jobs.get_job(job_id)
+    if row is None:
+        abort(404)
+    return jsonify(jobs.job_to_dict(row))
+
+@app.route("/admin/jobs/submit", methods=["POST"])
+@allow("admin")
+def admin_job_submit():
+    # завдання без вхідних файлів: перебудова звітів, звірка боргів, обслуговування БД
+    kind = request.form.get("kind")
+    if kind == "rebuild_reports":
+        params = {}
+    elif kind == "reconcile_debts":
+        params = {"repair": bool(request.form.get("repair"))}
+    elif kind == "maintenance":
+        params = {"operation": request.form.get("operation", "analyze")}
+        if params["operation"] not in jobs.MAINTENANCE_OPERATIONS:
+            abort(400)
+    else:
+        abort(400)
+    job_id = jobs.runner.submit(kind, params, user=get_current_user()["login"])
+    flash(f"{jobs.job_title(kind)}: завдання #{job_id} поставлено в чергу", "info")
+    return redirect(url_for("admin_jobs"))
+
+@app.route("/admin/jobs/<int:job_id>/cancel", methods=["POST"])
+@allow("admin")
+def admin_job_cancel(job_id):
+    if jobs.runner.cancel(job_id):
+        flash(f"Завдання #{job_id} скасовано", "info")
+    else:
+        flash(f"Завдання #{job_id} вже завершене", "warning")
+    return redirect(url_for("admin_jobs"))
+
+
 @app.route("/admin/users")
 @allow("admin")
 def admin_users():
@@ -174,25 +497,52 @@ def admin_change_role(user_id):
     return redirect(url_for("admin_users"))
 
 
+@app.route("/admin/cache")
+@allow("admin")
+def admin_cache_stats():
+    return jsonify(service.cache_stats())
+
+
+QUERY_SORTS = {"total": "Сумарний час", "p95": "p95", "max": "Максимум", "mean": "Середній", "count": "Кількість"}
+
+@app.route("/admin/queries")
+@allow("admin")
+def admin_queries():
+    sort = request.args.get("sort", "total")
+    if sort not in QUERY_SORTS:
+        sort = "total"
+    return render_template("admin_queries.html",
+                           top=querylog.query_log.top(50, sort),
+                           slow=querylog.query_log.slow(),
+                           sort=sort, sorts=QUERY_SORTS,
+                           threshold_ms=querylog.SLOW_QUERY_THRESHOLD * 1000)
+
+@app.route("/admin/queries/reset", methods=["POST"])
+@allow("admin")
+def admin_queries_reset():
+    querylog.query_log.reset()
+    flash("Статистику запитів очищено", "info")
+    return redirect(url_for("admin_queries"))
+
+
 @app.route("/subscribers")
 @allow("guest", "user", "operator", "admin")
 def subscribers():
-    subs = service.get_all_subscribers()
-    return render_template("subscribers.html", subscribers=subs)
+    page = service.get_all_subscribers(**page_args())
+    return render_template("subscribers.html", subscribers=page.rows, page=page)
 
 
 @app.route("/subscriber/<int:sub_id>")
 @allow("guest", "user", "operator", "admin")
 def subscriber_view(sub_id):
-    sub = service.get_subscriber(sub_id)
-    if not sub:
+    profile = service.get_subscriber_profile(sub_id)
+    if not profile:
         flash("Абонента не знайдено", "danger")
         return redirect(url_for("subscribers"))
-    phones = service.get_phones_by_subscriber(sub_id)
-    debts = service.get_debts_by_subscriber(sub_id)
     return render_template(
         "subscriber_view.html",
-        subscriber=sub, phones=phones, debts=debts
+        subscriber=profile.subscriber, phones=profile.phones, debts=profile.debts,
+        profile=profile, ledger_kinds=service.DEBT_LEDGER_KINDS
     )
 
 @app.route("/subscriber/add", methods=["GET", "POST"])
@@ -300,12 +650,14 @@ def phone_delete(sub_id, phone_id):
 def debts():
     q = request.args.get("q", "").strip()
 
+    page = None
     if q and get_current_user()["role"] != "guest":
         debtors = service.search_debtors(q)
     else:
-        debtors = service.get_subscribers_with_debts()
+        page = service.get_subscribers_with_debts(**page_args())
+        debtors = page.rows
 
-    return render_template("debts.html", debtors=debtors, query=q)
+    return render_template("debts.html", debtors=debtors, query=q, page=page)
 
 @app.route("/subscriber/<int:sub_id>/debts/delete/<int:debt_id>")
 @allow("operator", "admin")
@@ -327,11 +679,29 @@ def debt_add(sub_id):
 
 
 
+REQUEST_STATUSES = {
+    "": "Усі",
+    "pending": "Необроблені",
+    "new": "Нові",
+    "processing": "В обробці",
+    "done": "Виконані",
+}
+
+def request_filters(source):
+    status = source.get("status", "")
+    return {
+        "status": status if status in REQUEST_STATUSES else "",
+        "date_from": source.get("date_from", "").strip(),
+        "date_to": source.get("date_to", "").strip(),
+    }
+
 @app.route("/requests")
 @allow("operator", "admin")
 def requests_list():
-    reqs = service.get_all_number_change_requests()
-    return render_template("requests.html", requests=reqs)
+    filters = request_filters(request.args)
+    page = service.get_all_number_change_requests(**page_args(), **filters)
+    return render_template("requests.html", requests=page.rows, page=page,
+                           filters=filters, statuses=REQUEST_STATUSES)
 
 @app.route("/requests/change/<int:sub_id>/<old_number>")
 @allow("user")
@@ -352,17 +722,37 @@ def request_add():
 @app.route("/requests/approve/<int:req_id>")
 @allow("operator", "admin")
 def request_approve(req_id):
-    req = service.get_request(req_id)
-    if not req:
-        flash("Заявку не знайдено", "danger")
-        return redirect(url_for("requests_list"))
-
-    service.apply_number_change(req)
+    outcome, = service.approve_number_changes([req_id])
+    if outcome.ok:
+        flash("Заявку прийнято. Номер оновлено.", "success")
+    else:
+        flash(outcome.message, "danger")
+    return redirect(url_for("requests_list"))
 
-    service.delete_request(req_id)
+@app.route("/requests/approve-batch", methods=["POST"])
+@allow("operator", "admin")
+def request_approve_batch():
+    # scope=selected — позначені заявки, scope=filter — усі необроблені за фільтром
+    filters = request_filters(request.form)
+    if request.form.get("scope") == "filter":
+        if filters["status"] not in ("pending", "new", "processing"):
+            filters["status"] = "pending"
+        # за фільтром можуть бути тисячі заявок — виконуємо у фоні
+        job_id = jobs.runner.submit("approve_number_changes", filters, user=get_current_user()["login"])
+        flash(f"Прийняття заявок за фільтром поставлено в чергу (завдання #{job_id})", "info")
+        return redirect(url_for("admin_jobs") if get_current_user()["role"] == "admin"
+                        else url_for("requests_list", **filters))
+    else:
+        ids = request.form.getlist("request_id", type=int)
+        if not ids:
+            flash("Не вибрано жодної заявки", "warning")
+            return redirect(url_for("requests_list", **filters))
+        outcomes = service.approve_number_changes(ids)
 
-    flash("Заявку прийнято. Номер оновлено.", "success")
-    return redirect(url_for("requests_list"))
+    approved = sum(o.ok for o in outcomes)
+    flash(f"Прийнято заявок: {approved} з {len(outcomes)}",
+          "success" if approved == len(outcomes) else "warning")
+    return render_template("requests_batch.html", outcomes=outcomes, filters=filters)
 
 @app.route("/requests/reject/<int:req_id>")
 @allow("operator", "admin")
@@ -378,12 +768,14 @@ def request_reject(req_id):
 def repairs():
     q = request.args.get("q", "").strip()
 
+    page = None
     if q and get_current_user()["role"] != "guest":
         repairs = service.search_repairs(q)
     else:
-        repairs = service.get_all_repairs()
+        page = service.get_all_repairs(**page_args())
+        repairs = page.rows
 
-    return render_template("repairs.html", repairs=repairs, query=q)
+    return render_template("repairs.html", repairs=repairs, query=q, page=page)
 
 @app.route("/repair/add", methods=["GET", "POST"])
 @allow("operator", "admin")
@@ -470,29 +862,252 @@ def sql_reports():
 
     return render_template("sql_reports.html",
                            selected=selected,
+                           params=params,
                            result=result)
 
 
 
 
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+def export_response(stream, fmt, filename):
+    # Потокова відповідь: рядки пишуться у відповідь пачками одразу з курсора
+    def generate():
+        cols = next(stream)
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(cols)
+            yield "\ufeff" + buf.getvalue()
+            for rows in stream:
+                buf.seek(0)
+                buf.truncate()
+                writer.writerows(tuple(r) for r in rows)
+                yield buf.getvalue()
+        else:
+            for rows in stream:
+                yield "".join(
+                    json.dumps(dict(zip(cols, r)), ensure_ascii=False, default=str) + "\n"
+                    for r in rows
+                )
+
+    return Response(generate(), content_type=EXPORT_FORMATS[fmt], headers={
+        "Content-Disposition": f'attachment; filename="{filename}.{fmt}"',
+    })
+
+@app.route("/sql/reports/<query_id>/export.<fmt>")
+@allow("user", "operator", "admin")
+def sql_report_export(query_id, fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    params = {
+        "lastname": request.args.get("lastname", "").strip(),
+        "firstname": request.args.get("firstname", "").strip(),
+        "street_name": request.args.get("street_name", "").strip()
+    }
+    stream = service.stream_builtin_query(query_id, params)
+    if stream is None:
+        abort(404)
+    return export_response(stream, fmt, f"report_{query_id}")
+
+@app.route("/sql/reports/check", methods=["POST"])
+@allow("admin")
+def sql_reports_check():
+    stale = {t: n for t, n in service.check_report_tables().items() if n}
+    if stale:
+        details = ", ".join(f"{t}: {n}" for t, n in stale.items())
+        flash(f"Зведені таблиці звітів застаріли ({details}). Виконайте перебудову.", "warning")
+    else:
+        flash("Зведені таблиці звітів актуальні", "success")
+    return redirect(url_for("sql_reports"))
+
+@app.route("/sql/reports/rebuild", methods=["POST"])
+@allow("admin")
+def sql_reports_rebuild():
+    job_id = jobs.runner.submit("rebuild_reports", user=get_current_user()["login"])
+    flash(f"Перебудову зведених таблиць поставлено в чергу (завдання #{job_id})", "info")
+    return redirect(url_for("admin_jobs"))
+
+
+
+
 @app.route("/sql/custom", methods=["GET", "POST"])
 @allow("operator", "admin")
 def sql_custom():
-    cols = []
-    rows = []
+    result = service.SqlResult()
     sql_text = ""
+    explain = False
 
     if request.method == "POST":
         sql_text = request.form.get("sql_text", "")
+        token = request.form.get("query_token")
+        explain = bool(request.form.get("explain"))
         if sql_text.strip():
             try:
-                cols, rows = service.run_custom_sql(sql_text)
+                result = service.run_custom_sql(sql_text, token=token, owner=get_current_user()["id"],
+                                                explain=explain)
                 flash("Запит виконано", "success")
+                if result.truncated:
+                    flash(f"Показано перші {service.CUSTOM_SQL_MAX_ROWS} рядків. "
+                          f"Повний результат можна вивантажити у CSV/JSONL.", "warning")
             except Exception as e:
                 flash(f"Помилка: {e}", "danger")
 
     return render_template("sql_custom.html",
-                           cols=cols, rows=rows, sql_text=sql_text)
+                           cols=result.cols, rows=result.rows, truncated=result.truncated,
+                           result=result, explain=explain,
+                           sql_text=sql_text, query_token=uuid.uuid4().hex)
+
+@app.route("/sql/custom/cancel/<token>", methods=["POST"])
+@allow("operator", "admin")
+def sql_custom_cancel(token):
+    cancelled = service.cancel_custom_sql(token, owner=get_current_user()["id"])
+    return jsonify({"cancelled": cancelled})
+
+@app.route("/sql/custom/export", methods=["POST"])
+@allow("operator", "admin")
+def sql_custom_export():
+    sql_text = request.form.get("sql_text", "")
+    fmt = request.form.get("fmt", "csv")
+    if fmt not in EXPORT_FORMATS or not sql_text.strip():
+        abort(400)
+    try:
+        stream = service.stream_custom_sql(sql_text, token=request.form.get("query_token"),
+                                           owner=get_current_user()["id"])
+        # перша порція (колонки) одразу виконує запит — помилку SQL показуємо тут
+        cols = next(stream)
+    except Exception as e:
+        flash(f"Помилка: {e}", "danger")
+        return redirect(url_for("sql_custom"))
+    return export_response(itertools.chain([cols], stream), fmt, "custom_sql")
+
+
+
+@app.cli.command("check-main-phones")
+@click.option("--fix", is_flag=True, help="Перебудувати розбіжні значення")
+def check_main_phones_command(fix):
+    """Перевірити узгодженість Subscriber.main_phone_id."""
+    broken, fixed = service.check_main_phones(fix)
+    if not broken:
+        click.echo("[OK] main_phone_id узгоджений")
+    elif fix:
+        click.echo(f"[OK] Виправлено абонентів: {fixed}")
+    else:
+        click.echo(f"[!] Розбіжностей: {broken} (запустіть з --fix)")
+        raise SystemExit(1)
+
+
+@app.cli.command("reconcile-debts")
+@click.option("--repair", is_flag=True, help="Перерахувати баланси з журналу")
+def reconcile_debts_command(repair):
+    """Звірити баланси абонентів з журналом боргів і активними боргами."""
+    mismatches = service.check_debt_ledger()
+    if not any(mismatches.values()):
+        click.echo("[OK] Баланси збігаються з журналом боргів")
+        return
+    click.echo(f"[!] Розбіжностей: баланс/журнал — {mismatches['balances']}, "
+               f"журнал/борги — {mismatches['debts']}")
+    if not repair:
+        click.echo("    запустіть з --repair, щоб перерахувати баланси")
+        raise SystemExit(1)
+    service.rebuild_debt_balances()
+    mismatches = service.check_debt_ledger()
+    click.echo(f"[OK] Баланси перераховано; залишилось розбіжностей: "
+               f"баланс/журнал — {mismatches['balances']}, журнал/борги — {mismatches['debts']}")
+
+
+@app.cli.command("import-subscribers")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(IMPORT_FORMATS), help="Формат файлу (за замовчуванням — за розширенням)")
+@click.option("--chunk-size", default=5000, show_default=True, help="Рядків в одній транзакції")
+def import_subscribers_command(path, fmt, chunk_size):
+    """Масовий імпорт абонентів з CSV або JSONL."""
+    def progress(stats):
+        click.echo(f"  ... {stats.rows} рядків, {stats.rows_per_minute:.0f} рядків/хв")
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        stats = import_subscribers(f, fmt or detect_format(path), chunk_size, progress)
+
+    for line, message in stats.errors:
+        click.echo(f"[!] Рядок {line}: {message}")
+    click.echo(f"[OK] Імпортовано абонентів: {stats.subscribers}, телефонів: {stats.phones}, "
+               f"пропущено рядків: {stats.skipped}")
+    click.echo(f"     {stats.rows} рядків за {stats.elapsed:.1f} с ({stats.rows_per_minute:.0f} рядків/хв)")
+
+
+# маршрути, які перевіряє check-query-budget (лише ті, що не змінюють дані на GET)
+BUDGET_CHECK_ENDPOINTS = {
+    "index": {},
+    "subscribers": {},
+    "subscriber_view": {"sub_id": "SELECT id FROM Subscriber ORDER BY id LIMIT 1"},
+    "subscriber_edit": {"sub_id": "SELECT id FROM Subscriber ORDER BY id LIMIT 1"},
+    "subscriber_add": {},
+    "search": {"q": "Ков*"},
+    "phone_lookup": {"q": "4567"},
+    "debts": {},
+    "repairs": {},
+    "repair_add": {},
+    "repair_edit": {"repair_id": "SELECT id FROM RepairWork ORDER BY id LIMIT 1"},
+    "requests_list": {},
+    "services_list": {},
+    "sql_reports": {},
+    "sql_custom": {},
+    "admin_users": {},
+    "admin_requests": {},
+    "admin_import": {},
+    "admin_queries": {},
+}
+
+@app.cli.command("sweep-sessions")
+def sweep_sessions_command():
+    """Видалити прострочені сесії входу."""
+    click.echo(f"[OK] Видалено сесій: {session_store.store.sweep()}")
+
+
+@app.cli.command("check-query-budget")
+@click.option("--budget", type=int, help="Максимум SQL-запитів на маршрут (за замовчуванням QUERY_BUDGET)")
+def check_query_budget_command(budget):
+    """Пройти основні маршрути в тестовому режимі й перевірити кількість SQL-запитів."""
+    if budget is not None:
+        app.config["QUERY_BUDGET"] = budget
+    app.testing = True
+    client = app.test_client()
+    with get_db() as conn:
+        admin = conn.execute("SELECT id FROM User WHERE role = 'admin' ORDER BY id LIMIT 1").fetchone()
+    if admin is None:
+        raise click.ClickException("Немає користувача з роллю admin")
+    client.set_cookie(session_store.SESSION_COOKIE, session_store.store.create(admin["id"]))
+
+    failed = 0
+    for endpoint, args in BUDGET_CHECK_ENDPOINTS.items():
+        values = {}
+        for name, value in args.items():
+            if value.startswith("SELECT"):
+                with get_db() as conn:
+                    row = conn.execute(value).fetchone()
+                if row is None:
+                    break
+                value = row[0]
+            values[name] = value
+        else:
+            with app.test_request_context():
+                url = url_for(endpoint, **values)
+            try:
+                response = client.get(url)
+            except QueryBudgetExceeded as e:
+                click.echo(f"[!] {e}")
+                failed += 1
+                continue
+            repeated = response.headers.get("X-DB-Repeated-Queries")
+            click.echo(f"[OK] {url}: {response.headers.get('X-DB-Queries')} запитів"
+                       + (f", повтори: {repeated}" if repeated else ""))
+
+    if failed:
+        click.echo(f"[!] Маршрутів понад бюджет: {failed}")
+        raise SystemExit(1)
 
 
 
@@ -500,5 +1115,6 @@ if __name__ == "__main__":
     if not os.path.exists('db/db.sqlite'):
         print('Створення БД')
         init_db()
+    migrate()
 
     app.run(debug=True)
@@ -0,0 +1,362 @@
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import re
+import sqlite3
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import db.utils
+import service
+import session_store
+from db.generate import generate
+from db.init import create_admin, create_mobile_operators, create_special_services, create_tables
+from db.migrations import migrate
+from db.utils import begin_unit_of_work, end_unit_of_work, close_pool, get_db
+
+# Бенчмарк функцій service.py і основних маршрутів на синтетичних БД різного розміру:
+#
+#   python benchmark.py --scales 10000,100000,1000000 --output bench/new.json
+#   python benchmark.py --compare bench/base.json bench/new.json --threshold 0.2
+#   python benchmark.py --memory --scales 100000
+#
+# БД для кожного масштабу генерується db/generate.py один раз і кешується в bench/.
+# Функції запису виконуються в unit of work, який відкочується (час commit не входить).
+
+BENCH_DIR = "bench"
+DEFAULT_SCALES = "10000,100000"
+DEFAULT_ITERATIONS = 20
+DEFAULT_SEED = 1
+# повільні операції (повні перевірки, перебудови) виконуються рідше
+SLOW_ITERATIONS_DIVISOR = 4
+
+DEFAULT_THRESHOLD = 0.2
+COMPARE_METRIC = "p50_ms"
+# різниці, менші за цю (мс), вважаються шумом і не є регресією
+NOISE_FLOOR_MS = 0.05
+
+# пошук за маскою «*» повертає всіх абонентів (з кожним активним телефоном)
+MEMORY_PATTERN = "*"
+MEMORY_ROWS_UNIT = 100_000
+
+REPORT_PARAMS = {"lastname": "Ков", "firstname": "", "street_name": "Сад"}
+
+
+def prepare_database(subscribers, seed=DEFAULT_SEED, directory=BENCH_DIR):
+    path = os.path.join(directory, f"db-{subscribers}-{seed}.sqlite")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(directory, exist_ok=True)
+    # генеруємо в тимчасовий файл, щоб перерваний запуск не лишив неповну БД
+    partial = path + ".part"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+
+    db.utils.DB_PATH = partial
+    create_tables()
+    migrate()
+    create_admin()
+    create_mobile_operators()
+    create_special_services()
+    generate(subscribers, seed)
+    close_pool()
+    os.replace(partial, path)
+    return path
+
+
+def _sample(conn):
+    # «типові» рядки з середини таблиць, щоб не міряти лише перші сторінки
+    def middle(sql):
+        total = conn.execute(f"SELECT COUNT(*) FROM ({sql})").fetchone()[0]
+        return conn.execute(f"{sql} LIMIT 1 OFFSET ?", (total // 2,)).fetchone()
+
+    sub = middle("""
+        SELECT s.id, s.id_address, s.lastname, mp.number
+        FROM Subscriber s
+        JOIN PhoneNumber mp ON mp.id = s.main_phone_id
+        WHERE s.id_address IS NOT NULL
+        ORDER BY s.id
+    """)
+    debt = middle("SELECT id, id_subscriber FROM Debt ORDER BY id")
+    request = middle("SELECT * FROM NumberChangeRequest ORDER BY id")
+    repair = middle("SELECT id, id_address FROM RepairWork ORDER BY id")
+    operator = conn.execute("SELECT id FROM MobileOperator ORDER BY id LIMIT 1").fetchone()
+    return {
+        "sub_id": sub["id"],
+        "address_id": sub["id_address"],
+        "lastname": sub["lastname"],
+        "number": sub["number"],
+        "debt_id": debt["id"] if debt else 0,
+        "request": dict(request) if request else None,
+        "repair_id": repair["id"] if repair else 0,
+        "operator_id": operator["id"],
+    }
+
+
+def service_cases(ctx):
+    # (назва, функція, запис?, повільна?)
+    sub_id, number = ctx["sub_id"], ctx["number"]
+    second_page = service.get_all_subscribers().next_cursor
+    cases = [
+        ("get_user_by_login", lambda: service.get_user_by_login("admin"), False, False),
+        ("get_all_users", service.get_all_users, False, False),
+        ("get_registration_requests", service.get_registration_requests, False, False),
+        ("get_address", lambda: service.get_address(ctx["address_id"]), False, False),
+        ("get_all_post_offices", service.get_all_post_offices, False, False),
+        ("get_all_post_offices[cold]", lambda: (service.reference_cache.invalidate(),
+                                                service.get_all_post_offices()), False, True),
+        ("get_all_operators", service.get_all_operators, False, False),
+        ("get_all_special_services", service.get_all_special_services, False, False),
+        ("get_all_subscribers", service.get_all_subscribers, False, False),
+        ("get_all_subscribers[page2]", lambda: service.get_all_subscribers(after=second_page), False, False),
+        ("get_subscriber", lambda: service.get_subscriber(sub_id), False, False),
+        ("get_subscriber_profile", lambda: service.get_subscriber_profile(sub_id), False, False),
+        ("get_phones_by_subscriber", lambda: service.get_phones_by_subscriber(sub_id), False, False),
+        ("get_debts_by_subscriber", lambda: service.get_debts_by_subscriber(sub_id), False, False),
+        ("search_subscribers[name]", lambda: service.search_subscribers(ctx["lastname"][:4] + "*"), False, False),
+        ("search_subscribers[phone]", lambda: service.search_subscribers("*" + number[-4:]), False, False),
+        ("lookup_phones[suffix]", lambda: service.lookup_phones(number[-4:], "suffix"), False, False),
+        ("lookup_phones[prefix]", lambda: service.lookup_phones(number[:6], "prefix"), False, False),
+        ("lookup_phones[local]", lambda: service.lookup_phones(number[3:], "local"), False, False),
+        ("get_all_number_change_requests", service.get_all_number_change_requests, False, False),
+        ("get_subscribers_with_debts", service.get_subscribers_with_debts, False, False),
+        ("search_debtors", lambda: service.search_debtors(ctx["lastname"][:3] + "*"), False, False),
+        ("get_all_repairs", service.get_all_repairs, False, False),
+        ("get_repair", lambda: service.get_repair(ctx["repair_id"]), False, False),
+        ("search_repairs", lambda: service.search_repairs("Сад*"), False, False),
+        ("run_custom_sql", lambda: service.run_custom_sql("SELECT COUNT(*) FROM PhoneNumber"), False, True),
+        ("check_main_phones", service.check_main_phones, False, True),
+        ("check_report_tables", service.check_report_tables, False, True),
+        ("check_debt_ledger", service.check_debt_ledger, False, True),
+    ]
+    for query_id in service.BUILTIN_QUERIES:
+        cases.append((f"run_builtin_query[{query_id}]",
+                      lambda q=query_id: service.run_builtin_query(q, REPORT_PARAMS), False, False))
+
+    def add_subscriber():
+        address_id = service.create_address("Садова", "вул.", "1", "1")
+        new_id = service.create_subscriber("Бенчмарк", "Тест", "Тестович", address_id, None)
+        service.create_phone("0670000000", "mobile", new_id, ctx["operator_id"])
+
+    cases += [
+        ("write:add_subscriber", add_subscriber, True, False),
+        ("write:update_subscriber", lambda: service.update_subscriber(sub_id, "Бенчмарк", "Тест", "Тест"), True, False),
+        ("write:create_phone", lambda: service.create_phone("0671234567", "mobile", sub_id, ctx["operator_id"]), True, False),
+        ("write:create_debt", lambda: service.create_debt(sub_id, 100.0, "2025-01-01", "2025-02-01"), True, False),
+        ("write:update_debt", lambda: service.update_debt(ctx["debt_id"], 1.0, "paid"), True, False),
+        ("write:delete_subscriber", lambda: service.delete_subscriber(sub_id), True, False),
+        ("write:create_repair", lambda: service.create_repair(ctx["address_id"], "2025-01-01", "2025-01-02", "Тест"), True, False),
+    ]
+    if ctx["request"]:
+        cases += [
+            ("write:apply_number_change", lambda: service.apply_number_change(ctx["request"]), True, False),
+            ("write:approve_number_changes", lambda: service.approve_number_changes([ctx["request"]["id"]]), True, False),
+            ("write:approve_number_changes[all]", service.approve_number_changes, True, True),
+        ]
+    return cases
+
+
+def route_cases(ctx):
+    from app import app
+
+    app.testing = True
+    client = app.test_client()
+    with get_db() as conn:
+        admin_id = conn.execute("SELECT id FROM User WHERE role = 'admin' ORDER BY id LIMIT 1").fetchone()[0]
+    client.set_cookie(session_store.SESSION_COOKIE, session_store.store.create(admin_id))
+
+    def get(url):
+        return lambda: client.get(url)
+
+    def report(query_id):
+        return lambda: client.post("/sql/reports", data=dict(REPORT_PARAMS, query_id=query_id))
+
+    return [
+        ("GET /", get("/"), False, False),
+        ("GET /subscribers", get("/subscribers"), False, False),
+        ("GET /subscriber/<id>", get(f"/subscriber/{ctx['sub_id']}"), False, False),
+        ("GET /search", get(f"/search?q={ctx['lastname'][:4]}*"), False, False),
+        ("GET /phones/lookup", get(f"/phones/lookup?q={ctx['number'][-4:]}"), False, False),
+        ("GET /debts", get("/debts"), False, False),
+        ("GET /repairs", get("/repairs"), False, False),
+        ("GET /requests", get("/requests"), False, False),
+        ("GET /services", get("/services"), False, False),
+        ("POST /sql/reports[1]", report("1"), False, False),
+        ("POST /sql/reports[7]", report("7"), False, False),
+    ]
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    rank = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize(samples):
+    total = sum(samples)
+    return {
+        "n": len(samples),
+        "mean_ms": total / len(samples) * 1000,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "max_ms": max(samples) * 1000,
+        "ops_per_s": len(samples) / total if total else 0.0,
+    }
+
+
+def measure(fn, iterations, rollback=False):
+    samples = []
+    # перший виклик — прогрів (кеш сторінок SQLite, шаблони Jinja)
+    for i in range(iterations + 1):
+        if rollback:
+            begin_unit_of_work()
+        started = time.perf_counter()
+        try:
+            fn()
+        finally:
+            elapsed = time.perf_counter() - started
+            if rollback:
+                end_unit_of_work(commit=False)
+        if i:
+            samples.append(elapsed)
+    return summarize(samples)
+
+
+def run_scale(subscribers, iterations, seed=DEFAULT_SEED, pattern=None, routes=True):
+    db.utils.DB_PATH = prepare_database(subscribers, seed)
+    service.reference_cache.invalidate()
+    with get_db() as conn:
+        ctx = _sample(conn)
+
+    cases = service_cases(ctx) + (route_cases(ctx) if routes else [])
+    results = {}
+    for name, fn, write, slow in cases:
+        if pattern and not re.search(pattern, name):
+            continue
+        n = max(iterations // SLOW_ITERATIONS_DIVISOR, 3) if slow else iterations
+        results[name] = measure(fn, n, rollback=write)
+        print(f"  {name:<36} p50 {results[name]['p50_ms']:9.3f} ms   "
+              f"p95 {results[name]['p95_ms']:9.3f} ms   {results[name]['ops_per_s']:9.1f} оп/с")
+    close_pool()
+    return results
+
+
+def measure_memory(fn):
+    # (кількість рядків, байт на рядок): пам'ять, яку утримує результат fn()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        rows = fn()
+        held = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return len(rows), held / len(rows) if rows else 0.0
+
+
+def run_memory(subscribers, seed=DEFAULT_SEED):
+    # sqlite3.Row проти db.records.Record на тому самому запиті search_subscribers
+    db.utils.DB_PATH = prepare_database(subscribers, seed)
+    compact = service.COMPACT_ROWS
+    results = {}
+    # повний перебір під tracemalloc завжди «повільний», журнал тут лише заважає
+    slow_log = logging.getLogger("db.slow")
+    slow_log.disabled = True
+    try:
+        for name, flag in (("sqlite3.Row", False), ("Record", True)):
+            service.COMPACT_ROWS = flag
+            service.search_subscribers(MEMORY_PATTERN)  # прогрів кешу сторінок і запиту
+            rows, per_row = measure_memory(lambda: service.search_subscribers(MEMORY_PATTERN))
+            results[name] = {"rows": rows, "bytes_per_row": per_row,
+                             "mb_per_100k": per_row * MEMORY_ROWS_UNIT / 2 ** 20}
+            print(f"  {name:<12} {rows} рядків   {per_row:8.1f} Б/рядок   "
+                  f"{results[name]['mb_per_100k']:7.2f} МБ на 100 тис. рядків")
+    finally:
+        service.COMPACT_ROWS = compact
+        slow_log.disabled = False
+        close_pool()
+    return results
+
+
+def compare(base, new, threshold=DEFAULT_THRESHOLD, metric=COMPARE_METRIC):
+    # [(масштаб, випадок, було, стало, відношення)] для випадків, що погіршились
+    regressions = []
+    for scale, cases in new["results"].items():
+        for name, stats in cases.items():
+            before = base["results"].get(scale, {}).get(name)
+            if not before:
+                continue
+            old, cur = before[metric], stats[metric]
+            if cur - old > NOISE_FLOOR_MS and cur > old * (1 + threshold):
+                regressions.append((scale, name, old, cur, cur / old if old else math.inf))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк запитів service.py і маршрутів Flask")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="кількості абонентів через кому")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--cases", help="регулярний вираз для відбору випадків за назвою")
+    parser.add_argument("--no-routes", action="store_true", help="не вимірювати маршрути Flask")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results.json"))
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="порівняти два файли результатів")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="допустиме відносне погіршення (0.2 = 20%%)")
+    parser.add_argument("--memory", action="store_true",
+                        help="порівняти пам'ять на рядок: sqlite3.Row проти компактних Record")
+    parser.add_argument("--metric", default=COMPARE_METRIC, choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms"])
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.compare[1], encoding="utf-8") as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold, args.metric)
+        for scale, name, old, cur, ratio in regressions:
+            print(f"[!] {scale}: {name}: {old:.3f} → {cur:.3f} ms (×{ratio:.2f})")
+        if regressions:
+            print(f"Регресій: {len(regressions)}")
+            return 1
+        print("[OK] Регресій не знайдено")
+        return 0
+
+    if args.memory:
+        for scale in [int(s) for s in args.scales.split(",") if s.strip()]:
+            print(f"[i] {scale} абонентів")
+            run_memory(scale, args.seed)
+        return 0
+
+    report = {
+        "meta": {
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "iterations": args.iterations,
+        },
+        "results": {},
+    }
+    for scale in [int(s) for s in args.scales.split(",") if s.strip()]:
+        print(f"[i] {scale} абонентів")
+        report["results"][str(scale)] = run_scale(scale, args.iterations, args.seed, args.cases,
+                                                  routes=not args.no_routes)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[OK] Результати збережено в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# Похідні (денормалізовані) дані, які підтримуються тригерами з міграцій.
+# Функції rebuild_* повністю перебудовують відповідну структуру з основних
+# таблиць — використовуються міграціями для заповнення існуючих БД і як
+# ручний інструмент відновлення узгодженості.
+
+
+def rebuild_search_index(conn):
+    # Рядки пошукового індексу абонентів: частини ПІБ, номер пошт. відділення
+    # та активні телефони. FTS-таблиця SubscriberSearch оновлюється тригерами
+    # SubscriberSearchTerm, тому після очищення її достатньо перебудувати.
+    conn.execute("DELETE FROM SubscriberSearchTerm")
+    conn.execute("""
+        INSERT INTO SubscriberSearchTerm (id_subscriber, kind, term)
+        SELECT id, 'name', lastname FROM Subscriber WHERE lastname IS NOT NULL
+        UNION ALL
+        SELECT id, 'name', firstname FROM Subscriber WHERE firstname IS NOT NULL
+        UNION ALL
+        SELECT id, 'name', middlename FROM Subscriber WHERE middlename IS NOT NULL
+    """)
+    conn.execute("""
+        INSERT INTO SubscriberSearchTerm (id_subscriber, kind, term)
+        SELECT s.id, 'office', CAST(po.office_number AS TEXT)
+        FROM Subscriber s
+        JOIN PostOffice po ON po.id = s.id_post_office
+        WHERE po.office_number IS NOT NULL
+    """)
+    conn.execute("""
+        INSERT INTO SubscriberSearchTerm (id_subscriber, kind, id_phone, term)
+        SELECT id_subscriber, 'phone', id, number
+        FROM PhoneNumber
+        WHERE active = 1 AND id_subscriber IS NOT NULL AND number IS NOT NULL
+    """)
+    conn.execute("INSERT INTO SubscriberSearch (SubscriberSearch) VALUES ('rebuild')")
+
+
+def rebuild_phone_index(conn):
+    # PhoneNumberSearch — external-content FTS5 над PhoneNumber.number
+    conn.execute("INSERT INTO PhoneNumberSearch (PhoneNumberSearch) VALUES ('rebuild')")
+
+
+# Основний номер абонента: активний, за пріоритетом типу, потім найстаріший.
+# {sub} — вираз з id абонента (new.id_subscriber у тригерах, Subscriber.id у перебудові).
+MAIN_PHONE_SQL = """
+    SELECT pn.id
+    FROM PhoneNumber pn
+    WHERE pn.id_subscriber = {sub} AND pn.active = 1
+    ORDER BY
+        (CASE pn.type
+            WHEN 'mobile' THEN 0
+            WHEN 'home' THEN 1
+            WHEN 'service' THEN 2
+            ELSE 3 END),
+        pn.id ASC
+    LIMIT 1
+"""
+
+
+def check_main_phones(conn):
+    # Кількість абонентів, у яких main_phone_id не збігається з обчисленим
+    row = conn.execute(f"""
+        SELECT COUNT(*)
+        FROM Subscriber
+        WHERE main_phone_id IS NOT ({MAIN_PHONE_SQL.format(sub="Subscriber.id")})
+    """).fetchone()
+    return row[0]
+
+
+def rebuild_main_phones(conn):
+    cur = conn.execute(f"""
+        UPDATE Subscriber
+        SET main_phone_id = ({MAIN_PHONE_SQL.format(sub="Subscriber.id")})
+        WHERE main_phone_id IS NOT ({MAIN_PHONE_SQL.format(sub="Subscriber.id")})
+    """)
+    return cur.rowcount
+
+
+# Зведені таблиці для звітів 6 і 10 (run_builtin_query). Тригери з міграції 6
+# оновлюють їх інкрементально; тут — еталонні агрегати для перевірки і перебудови.
+REPORT_TABLES = {
+    "ReportOperatorPhones": ("id_operator", "phone_count", """
+        SELECT pn.id_operator, COUNT(pn.id)
+        FROM PhoneNumber pn
+        JOIN MobileOperator mo ON mo.id = pn.id_operator
+        WHERE pn.active = 1
+        GROUP BY pn.id_operator
+    """),
+    "ReportStreetResidents": ("id_street", "resident_count", """
+        SELECT a.id_street, COUNT(s.id)
+        FROM Subscriber s
+        JOIN Address a ON a.id = s.id_address
+        JOIN Street st ON st.id = a.id_street
+        GROUP BY a.id_street
+    """),
+}
+
+
+def check_report_tables(conn):
+    # Кількість розбіжних рядків у кожній зведеній таблиці (0 — актуальна)
+    result = {}
+    for table, (key, columns, source) in REPORT_TABLES.items():
+        cols = [c.strip() for c in columns.split(",")]
+        values = ", ".join(f"ROUND(IFNULL(v{i}, 0), 2)" for i in range(len(cols)))
+        stored = ", ".join(f"ROUND({c}, 2)" for c in cols)
+        names = ", ".join(["k"] + [f"v{i}" for i in range(len(cols))])
+        row = conn.execute(f"""
+            WITH fresh({names}) AS ({source}),
+            stored AS (
+                SELECT {key} AS k, {stored} FROM {table}
+                WHERE {cols[-1]} <> 0
+            ),
+            expected AS (
+                SELECT k, {values} FROM fresh
+            )
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT * FROM stored EXCEPT SELECT * FROM expected)) +
+                (SELECT COUNT(*) FROM (SELECT * FROM expected EXCEPT SELECT * FROM stored))
+        """).fetchone()
+        result[table] = row[0]
+    return result
+
+
+def rebuild_report_tables(conn):
+    for table, (key, columns, source) in REPORT_TABLES.items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} ({key}, {columns}) {source}")
+
+
+# Журнал боргів DebtLedger (міграція 9) лише доповнюється: тригери на Debt пишуть
+# у нього кожну зміну активної заборгованості, а тригер журналу оновлює баланс
+# абонента SubscriberBalance у тій самій транзакції. Записи, що відкривають
+# (+1) або закривають (-1) активний борг, змінюють і лічильник debt_count.
+# {kind} — вираз з видом запису.
+DEBT_COUNT_DELTA_SQL = """
+    (CASE WHEN {kind} IN ('opening', 'charge', 'reopen', 'transfer_in') THEN 1
+          WHEN {kind} IN ('payment', 'writeoff', 'cancel', 'transfer_out') THEN -1
+          ELSE 0 END)
+"""
+
+
+def seed_debt_ledger(conn):
+    # Початкові записи 'opening' для активних боргів, яких ще немає в журналі
+    # (існуючі дані при міграції, рядки генератора з вимкненими тригерами)
+    cur = conn.execute("""
+        INSERT INTO DebtLedger (id_debt, id_subscriber, kind, amount, note)
+        SELECT d.id, d.id_subscriber, 'opening', IFNULL(d.amount, 0), 'початковий залишок'
+        FROM Debt d
+        WHERE d.status = 'active' AND d.id_subscriber IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM DebtLedger l WHERE l.id_debt = d.id)
+    """)
+    return cur.rowcount
+
+
+def rebuild_debt_balances(conn):
+    conn.execute("DELETE FROM SubscriberBalance")
+    conn.execute(f"""
+        INSERT INTO SubscriberBalance (id_subscriber, balance, debt_count, updated_at)
+        SELECT l.id_subscriber, ROUND(SUM(l.amount), 2),
+               SUM({DEBT_COUNT_DELTA_SQL.format(kind="l.kind")}), MAX(l.created_at)
+        FROM DebtLedger l
+        JOIN Subscriber s ON s.id = l.id_subscriber
+        GROUP BY l.id_subscriber
+    """)
+
+
+def check_debt_ledger(conn):
+    # Звірка: {"balances": абоненти, у яких SubscriberBalance не збігається з
+    # сумою журналу, "debts": абоненти, у яких сума журналу не збігається з
+    # активними боргами в Debt}
+    balances = conn.execute(f"""
+        WITH ledger AS (
+            SELECT l.id_subscriber AS k, ROUND(SUM(l.amount), 2) AS balance,
+                   SUM({DEBT_COUNT_DELTA_SQL.format(kind="l.kind")}) AS debt_count
+            FROM DebtLedger l
+            JOIN Subscriber s ON s.id = l.id_subscriber
+            GROUP BY l.id_subscriber
+        ),
+        stored AS (
+            SELECT id_subscriber AS k, ROUND(balance, 2) AS balance, debt_count
+            FROM SubscriberBalance
+            WHERE balance <> 0 OR debt_count <> 0
+        ),
+        expected AS (
+            SELECT * FROM ledger WHERE balance <> 0 OR debt_count <> 0
+        )
+        SELECT
+            (SELECT COUNT(*) FROM (SELECT * FROM stored EXCEPT SELECT * FROM expected)) +
+            (SELECT COUNT(*) FROM (SELECT * FROM expected EXCEPT SELECT * FROM stored))
+    """).fetchone()[0]
+    debts = conn.execute("""
+        WITH ledger AS (
+            SELECT id_subscriber AS k, ROUND(SUM(amount), 2) AS total
+            FROM DebtLedger
+            GROUP BY id_subscriber
+            HAVING ROUND(SUM(amount), 2) <> 0
+        ),
+        active AS (
+            SELECT id_subscriber AS k, ROUND(SUM(IFNULL(amount, 0)), 2) AS total
+            FROM Debt
+            WHERE status = 'active' AND id_subscriber IS NOT NULL
+            GROUP BY id_subscriber
+            HAVING ROUND(SUM(IFNULL(amount, 0)), 2) <> 0
+        )
+        SELECT
+            (SELECT COUNT(*) FROM (SELECT * FROM ledger EXCEPT SELECT * FROM active)) +
+            (SELECT COUNT(*) FROM (SELECT * FROM active EXCEPT SELECT * FROM ledger))
+    """).fetchone()[0]
+    return {"balances": balances, "debts": debts}
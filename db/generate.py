@@ -0,0 +1,325 @@
+import argparse
+import bisect
+import datetime
+import itertools
+import random
+import sys
+import time
+
+import db.utils
+from db.derived import (rebuild_debt_balances, rebuild_main_phones, rebuild_phone_index,
+                        rebuild_report_tables, rebuild_search_index, seed_debt_ledger)
+from db.ids import IdAllocator
+from db.init import (FIRSTNAMES, LASTNAMES, MIDDLENAMES, REPAIR_DESCRIPTIONS, STREETS,
+                     create_admin, create_mobile_operators, create_special_services, create_tables)
+from db.migrations import migrate
+
+# Генератор синтетичних даних для навантажувального тестування:
+#
+#   python -m db.generate --subscribers 1000000 --seed 42 --db db/load.sqlite
+#
+# Популярність вулиць і прізвищ розподілена за Ціпфом, частки операторів —
+# за OPERATOR_SHARES. Однаковий seed на однаковій початковій БД дає однакові
+# дані. Вставка йде пачками executemany в одній транзакції з послабленими
+# PRAGMA; тригери похідних даних на час завантаження знімаються, а індекси
+# пошуку, main_phone_id і зведені таблиці звітів потім перебудовуються цілком.
+
+BATCH_SIZE = 10000
+
+OPERATOR_SHARES = {"Kyivstar": 0.46, "Vodafone": 0.33, "Lifecell": 0.21}
+OTHER_OPERATOR_SHARE = 0.02
+
+# кількість телефонів в абонента → ймовірність
+PHONES_PER_SUBSCRIBER = {1: 0.55, 2: 0.30, 3: 0.12, 4: 0.03}
+HOME_PHONE_SHARE = 0.4
+INACTIVE_PHONE_SHARE = 0.05
+LANDLINE_PREFIX = "0372"
+
+ACTIVE_DEBT_SHARE = 0.65
+REQUEST_STATUSES = ["new", "processing", "done"]
+
+# дати рахуються від фіксованої дати, щоб результат не залежав від дня запуску
+BASE_DATE = datetime.date(2025, 1, 1)
+
+EXTRA_STREETS = [
+    "Героїв Майдану", "Руська", "Університетська", "Кафедральна", "Садова",
+    "Винниченка", "Франка", "Лесі Українки", "Заводська", "Комарова",
+    "Південно-Кільцева", "Київська", "Воробкевича", "Федьковича", "Галицький Шлях",
+]
+STREET_TYPES = ["вул.", "вул.", "вул.", "пров.", "проспект."]
+
+LASTNAME_ROOTS = [
+    "Ковал", "Шевч", "Ткач", "Петр", "Мельнич", "Бондар", "Кравч", "Савч",
+    "Гриц", "Сидор", "Лис", "Проц", "Марчен", "Дем'ян", "Олійн", "Гаврил",
+    "Клим", "Остап", "Павл", "Руд", "Собол", "Тарасен", "Харч", "Юрч",
+]
+LASTNAME_SUFFIXES = ["енко", "ук", "юк", "ишин", "ський", "ко", "ець", "ан"]
+
+
+def _zipf_cum_weights(n, s=1.0):
+    weights = itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1))
+    return list(weights)
+
+
+class _Picker:
+    # Вибір зі зваженої сукупності через кумулятивні ваги (bisect замість
+    # random.choices на кожен виклик — без повторного нормування)
+
+    def __init__(self, rng, population, cum_weights):
+        self.rng = rng
+        self.population = population
+        self.cum_weights = cum_weights
+        self.total = cum_weights[-1]
+
+    def __call__(self):
+        i = bisect.bisect(self.cum_weights, self.rng.random() * self.total)
+        return self.population[min(i, len(self.population) - 1)]
+
+
+class _NumberSequence:
+    # Унікальні 7-значні номери для префікса: (a + k·b) mod 10^7 з b, взаємно
+    # простим з 10^7, — перестановка без повторів і без множини виданих номерів
+
+    def __init__(self, rng, prefix, digits=7):
+        self.prefix = prefix
+        self.digits = digits
+        self.modulus = 10 ** digits
+        self.offset = rng.randrange(self.modulus)
+        self.step = rng.randrange(1, self.modulus // 10) * 10 + rng.choice([1, 3, 7, 9])
+        self.k = 0
+
+    def __call__(self):
+        value = (self.offset + self.k * self.step) % self.modulus
+        self.k += 1
+        return f"{self.prefix}{value:0{self.digits}d}"
+
+
+def _street_names(rng, count):
+    base = [name for name, _ in STREETS] + EXTRA_STREETS
+    names = []
+    for i in range(count):
+        name = base[i % len(base)]
+        if i >= len(base):
+            name = f"{name} {i // len(base) + 1}-а"
+        st_type = dict(STREETS).get(name, rng.choice(STREET_TYPES))
+        names.append((name, st_type))
+    # найпопулярнішими мають бути випадкові вулиці, а не перші в списку
+    rng.shuffle(names)
+    return names
+
+
+def _random_date(rng, days_back):
+    return BASE_DATE - datetime.timedelta(days=rng.randrange(days_back))
+
+
+def _operators(conn, rng):
+    rows = conn.execute("SELECT id, name, prefix FROM MobileOperator ORDER BY id").fetchall()
+    if not rows:
+        raise SystemExit("[!] У БД немає мобільних операторів")
+    by_name = {}
+    for row in rows:
+        by_name.setdefault(row["name"], []).append(row)
+    population, weights = [], []
+    for name, ops in by_name.items():
+        share = OPERATOR_SHARES.get(name, OTHER_OPERATOR_SHARE)
+        for op in ops:
+            population.append((op["id"], _NumberSequence(rng, op["prefix"])))
+            weights.append(share / len(ops))
+    return _Picker(rng, population, list(itertools.accumulate(weights)))
+
+
+def _suspend_triggers(conn):
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    for row in triggers:
+        conn.execute(f'DROP TRIGGER "{row["name"]}"')
+    return [row["sql"] for row in triggers]
+
+
+def _rebuild_derived(conn):
+    rebuild_search_index(conn)
+    rebuild_phone_index(conn)
+    rebuild_main_phones(conn)
+    rebuild_report_tables(conn)
+    # нові активні борги потрапляють у журнал як початкові залишки
+    seed_debt_ledger(conn)
+    rebuild_debt_balances(conn)
+
+
+def generate(subscribers, seed=1, streets=None, debt_share=0.2, repairs=None, requests=None,
+             keep_triggers=False, batch_size=BATCH_SIZE, progress=None):
+    rng = random.Random(seed)
+    streets = streets or max(len(STREETS), subscribers // 500)
+    repairs = subscribers // 100 if repairs is None else repairs
+    requests = subscribers // 50 if requests is None else requests
+    counts = dict.fromkeys(["Street", "Address", "PostOffice", "Subscriber", "PhoneNumber",
+                            "Debt", "RepairWork", "NumberChangeRequest"], 0)
+
+    conn = db.utils.connect()
+    try:
+        conn.execute("PRAGMA foreign_keys = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -262144")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("BEGIN IMMEDIATE")
+
+        triggers = [] if keep_triggers else _suspend_triggers(conn)
+        ids = IdAllocator(conn)
+        operator = _operators(conn, rng)
+        landline = _NumberSequence(rng, LANDLINE_PREFIX, digits=6)
+
+        # вулиці з такою самою назвою і типом, що вже є в БД, використовуються повторно
+        existing = {
+            (row["name"], row["type"]): row["id"]
+            for row in conn.execute("SELECT MIN(id) AS id, name, type FROM Street GROUP BY name, type")
+        }
+        street_ids, street_rows = [], []
+        for name in _street_names(rng, streets):
+            if name not in existing:
+                existing[name] = ids.take("Street")
+                street_rows.append((existing[name],) + name)
+            street_ids.append(existing[name])
+        conn.executemany("INSERT INTO Street (id, name, type) VALUES (?, ?, ?)", street_rows)
+        counts["Street"] = len(street_rows)
+        street = _Picker(rng, street_ids, _zipf_cum_weights(len(street_ids)))
+
+        lastname_pool = LASTNAMES + [root + suffix for root in LASTNAME_ROOTS for suffix in LASTNAME_SUFFIXES]
+        rng.shuffle(lastname_pool)
+        lastname = _Picker(rng, lastname_pool, _zipf_cum_weights(len(lastname_pool), s=0.8))
+        phone_count = _Picker(rng, list(PHONES_PER_SUBSCRIBER),
+                              list(itertools.accumulate(PHONES_PER_SUBSCRIBER.values())))
+
+        request_subscribers = set(rng.sample(range(subscribers), min(requests, subscribers)))
+        offices = max(25, subscribers // 2000)
+        first_address = None
+
+        for start in range(0, subscribers, batch_size):
+            addresses, post_offices, subs, phones, debts, change_requests = [], [], [], [], [], []
+            for index in range(start, min(start + batch_size, subscribers)):
+                address_id = ids.take("Address")
+                first_address = first_address or address_id
+                addresses.append((address_id, street(), str(rng.randint(1, 120)), str(rng.randint(1, 200))))
+
+                post_office_id = ids.take("PostOffice")
+                post_offices.append((post_office_id, 58000 + rng.randint(1, offices), address_id))
+
+                sub_id = ids.take("Subscriber")
+                subs.append((sub_id, lastname(), rng.choice(FIRSTNAMES), rng.choice(MIDDLENAMES),
+                             address_id, post_office_id))
+
+                op_id, numbers = operator()
+                main_number = numbers()
+                phones.append((main_number, "mobile", sub_id, op_id, 1))
+                for _ in range(phone_count() - 1):
+                    active = 0 if rng.random() < INACTIVE_PHONE_SHARE else 1
+                    if rng.random() < HOME_PHONE_SHARE:
+                        phones.append((landline(), "home", sub_id, None, active))
+                    else:
+                        extra_op, extra_numbers = operator()
+                        phones.append((extra_numbers(), "mobile", sub_id, extra_op, active))
+
+                if rng.random() < debt_share:
+                    for _ in range(rng.randint(1, 3)):
+                        date_start = _random_date(rng, 730)
+                        deadline = date_start + datetime.timedelta(days=rng.randint(30, 90))
+                        status = "active" if rng.random() < ACTIVE_DEBT_SHARE else "paid"
+                        amount = round(min(rng.lognormvariate(5.5, 0.8), 20000), 2)
+                        debts.append((sub_id, amount, date_start.isoformat(), deadline.isoformat(), status))
+
+                if index in request_subscribers:
+                    change_requests.append((sub_id, main_number, numbers(),
+                                            _random_date(rng, 365).isoformat(), rng.choice(REQUEST_STATUSES)))
+
+            conn.executemany("INSERT INTO Address (id, id_street, building, apartment) VALUES (?, ?, ?, ?)", addresses)
+            conn.executemany("INSERT INTO PostOffice (id, office_number, id_address) VALUES (?, ?, ?)", post_offices)
+            conn.executemany("""
+                INSERT INTO Subscriber (id, lastname, firstname, middlename, id_address, id_post_office)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, subs)
+            conn.executemany("""
+                INSERT INTO PhoneNumber (number, type, id_subscriber, id_operator, active)
+                VALUES (?, ?, ?, ?, ?)
+            """, phones)
+            conn.executemany("""
+                INSERT INTO Debt (id_subscriber, amount, date_start, deadline, status)
+                VALUES (?, ?, ?, ?, ?)
+            """, debts)
+            conn.executemany("""
+                INSERT INTO NumberChangeRequest (id_subscriber, old_number, new_number, date_request, status)
+                VALUES (?, ?, ?, ?, ?)
+            """, change_requests)
+
+            counts["Address"] += len(addresses)
+            counts["PostOffice"] += len(post_offices)
+            counts["Subscriber"] += len(subs)
+            counts["PhoneNumber"] += len(phones)
+            counts["Debt"] += len(debts)
+            counts["NumberChangeRequest"] += len(change_requests)
+            if progress:
+                progress(counts)
+
+        if first_address is not None:
+            last_address = ids.next["Address"] - 1
+            repair_rows = []
+            for _ in range(repairs):
+                date_start = _random_date(rng, 365)
+                date_end = date_start + datetime.timedelta(days=rng.randint(1, 10))
+                repair_rows.append((rng.randint(first_address, last_address), date_start.isoformat(),
+                                    date_end.isoformat(), rng.choice(REPAIR_DESCRIPTIONS)))
+            conn.executemany("""
+                INSERT INTO RepairWork (id_address, date_start, date_end, description)
+                VALUES (?, ?, ?, ?)
+            """, repair_rows)
+            counts["RepairWork"] = len(repair_rows)
+
+        if not keep_triggers:
+            _rebuild_derived(conn)
+            for sql in triggers:
+                conn.execute(sql)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    with db.utils.get_db() as conn:
+        conn.execute("ANALYZE")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Генерація синтетичних даних для навантажувального тестування")
+    parser.add_argument("--db", default=db.utils.DB_PATH, help="шлях до файлу БД (створюється, якщо немає)")
+    parser.add_argument("--subscribers", type=int, default=10000, help="кількість абонентів")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--streets", type=int, help="кількість вулиць (за замовчуванням абоненти / 500)")
+    parser.add_argument("--debt-share", type=float, default=0.2, help="частка абонентів з боргами")
+    parser.add_argument("--repairs", type=int, help="кількість ремонтних робіт (абоненти / 100)")
+    parser.add_argument("--requests", type=int, help="кількість заявок на зміну номера (абоненти / 50)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--keep-triggers", action="store_true",
+                        help="не знімати тригери на час завантаження (повільніше)")
+    args = parser.parse_args(argv)
+
+    db.utils.DB_PATH = args.db
+    create_tables()
+    migrate()
+    create_admin()
+    create_mobile_operators()
+    create_special_services()
+
+    started = time.perf_counter()
+
+    def progress(counts):
+        print(f"  ... {counts['Subscriber']} абонентів ({time.perf_counter() - started:.1f} с)")
+
+    counts = generate(args.subscribers, args.seed, args.streets, args.debt_share, args.repairs,
+                      args.requests, args.keep_triggers, args.batch_size, progress)
+    for table, count in counts.items():
+        print(f"[OK] {table}: {count}")
+    print(f"[OK] Згенеровано за {time.perf_counter() - started:.1f} с")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
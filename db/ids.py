@@ -0,0 +1,24 @@
+# Попереднє призначення id для пакетних вставок (імпорт, генератор даних):
+# зв'язки між таблицями заповнюються ще до вставки. Працює лише під
+# BEGIN IMMEDIATE — тоді ніхто інший у ці таблиці не пише.
+#
+# Як і AUTOINCREMENT, лічильник продовжує sqlite_sequence, а не MAX(id):
+# id видалених рядків не використовуються вдруге (журнал боргів прив'язаний
+# до id абонента без зовнішнього ключа).
+
+
+class IdAllocator:
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.next = {}
+
+    def take(self, table):
+        if table not in self.next:
+            self.next[table] = self.conn.execute(f"""
+                SELECT MAX(IFNULL((SELECT MAX(id) FROM {table}), 0),
+                           IFNULL((SELECT seq FROM sqlite_sequence WHERE name = ?), 0)) + 1
+            """, (table,)).fetchone()[0]
+        value = self.next[table]
+        self.next[table] += 1
+        return value
@@ -0,0 +1,275 @@
+import csv
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+
+from db.ids import IdAllocator
+from db.utils import get_pool
+from service import invalidate_reference
+
+# Масовий імпорт абонентів з CSV або JSONL (flask import-subscribers, /admin/import).
+#
+# Вхід читається потоково і обробляється пачками по CHUNK_SIZE рядків: кожна
+# пачка — одна транзакція BEGIN IMMEDIATE з executemany по кожній таблиці.
+# Вулиці та оператори тримаються в пам'яті (їх небагато), id нових рядків
+# призначаються наперед, щоб зв'язки між таблицями не вимагали lastrowid.
+#
+# Поля рядка: lastname, firstname, middlename, street_name, street_type,
+# building, apartment, post_office (номер відділення), phone (кілька номерів
+# через «;»), phone_type, operator (назва оператора для мобільних номерів з
+# префіксом, якого ще немає в MobileOperator). Номер з відомим префіксом
+# прив'язується до оператора автоматично. У JSONL замість phone можна передати
+# список phones з рядків або об'єктів {"number", "type", "operator"}.
+
+CHUNK_SIZE = 5000
+IMPORT_FORMATS = ("csv", "jsonl")
+MAX_REPORTED_ERRORS = 100
+
+PHONE_TYPES = ("mobile", "home", "service")
+
+
+@dataclass
+class ImportStats:
+    rows: int = 0
+    subscribers: int = 0
+    phones: int = 0
+    addresses: int = 0
+    streets: int = 0
+    post_offices: int = 0
+    operators: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)  # [(номер рядка, повідомлення)]
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_minute(self):
+        return self.rows / self.elapsed * 60 if self.elapsed else 0.0
+
+    def error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def detect_format(filename):
+    return "jsonl" if filename.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def read_rows(stream, fmt="csv"):
+    # (номер рядка, dict) з текстового потоку; некоректний JSON — (номер, None)
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for line_num, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Невідомий формат імпорту: {fmt}")
+
+
+def _text(row, key):
+    value = row.get(key)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def normalize_number(number):
+    digits = re.sub(r"\D", "", str(number))
+    # +380671234567 → 0671234567
+    if len(digits) == 12 and digits.startswith("380"):
+        digits = digits[2:]
+    return digits
+
+
+def _phones(row):
+    default_type = _text(row, "phone_type")
+    default_operator = _text(row, "operator")
+
+    raw = row.get("phones")
+    if raw is None:
+        raw = [p for p in (_text(row, "phone") or "").split(";")]
+    elif not isinstance(raw, list):
+        raise ValueError("phones має бути списком")
+
+    phones = []
+    for item in raw:
+        if isinstance(item, dict):
+            number, ptype, operator = item.get("number"), item.get("type"), item.get("operator")
+            # оператор, вказаний для конкретного номера, означає мобільний номер
+            ptype = ptype or (operator and "mobile")
+        else:
+            number, ptype, operator = item, None, None
+        if number is None or not str(number).strip():
+            continue
+        digits = normalize_number(number)
+        if not 3 <= len(digits) <= 15:
+            raise ValueError(f"некоректний номер телефону: {number}")
+        ptype = ptype or default_type
+        if ptype is not None and ptype not in PHONE_TYPES:
+            raise ValueError(f"невідомий тип телефону: {ptype}")
+        phones.append((digits, ptype, operator or default_operator))
+    return phones
+
+
+def parse_row(row):
+    # dict з файлу → нормалізований запис або ValueError з причиною
+    lastname = _text(row, "lastname")
+    if not lastname:
+        raise ValueError("не вказано прізвище")
+
+    street = building = apartment = None
+    street_name = _text(row, "street_name")
+    building = _text(row, "building")
+    # як у формі додавання абонента: адреса лише коли є вулиця і будинок
+    if street_name and building:
+        street = (street_name, _text(row, "street_type") or "вул.")
+        apartment = _text(row, "apartment")
+
+    office = _text(row, "post_office")
+    if office is not None:
+        if not office.isdigit():
+            raise ValueError(f"некоректний номер відділення: {office}")
+        office = int(office)
+
+    return {
+        "name": (lastname, _text(row, "firstname"), _text(row, "middlename")),
+        "street": street,
+        "building": building,
+        "apartment": apartment,
+        "office": office,
+        "phones": _phones(row),
+    }
+
+
+class _Resolver:
+    # Кеш довідників на час імпорту: вулиці та оператори (за префіксом)
+
+    def __init__(self, conn):
+        self.streets = {
+            (r["name"], r["type"]): r["id"]
+            for r in conn.execute("SELECT MIN(id) AS id, name, type FROM Street GROUP BY name, type")
+        }
+        self.operators = {}
+        for r in conn.execute("SELECT id, prefix FROM MobileOperator ORDER BY id"):
+            self.operators.setdefault(r["prefix"], r["id"])
+
+
+def _import_chunk(conn, resolver, records, stats, checkpoint=None):
+    # Як і у формі додавання, кожен абонент отримує власні рядки Address і
+    # PostOffice (їх редагують на місці), спільними є лише вулиці й оператори.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        ids = IdAllocator(conn)
+        streets, operators, addresses, offices, subscribers, phones = [], [], [], [], [], []
+        for rec in records:
+            address_id = None
+            if rec["street"]:
+                street_id = resolver.streets.get(rec["street"])
+                if street_id is None:
+                    street_id = resolver.streets[rec["street"]] = ids.take("Street")
+                    streets.append((street_id,) + rec["street"])
+                address_id = ids.take("Address")
+                addresses.append((address_id, street_id, rec["building"], rec["apartment"]))
+
+            post_office_id = None
+            if rec["office"] is not None:
+                post_office_id = ids.take("PostOffice")
+                offices.append((post_office_id, rec["office"], address_id))
+
+            sub_id = ids.take("Subscriber")
+            subscribers.append((sub_id,) + rec["name"] + (address_id, post_office_id))
+
+            for number, ptype, operator in rec["phones"]:
+                prefix = number[:3]
+                operator_id = resolver.operators.get(prefix)
+                # новий оператор створюється лише для мобільних номерів з невідомим префіксом
+                if operator_id is None and operator and ptype == "mobile":
+                    operator_id = resolver.operators[prefix] = ids.take("MobileOperator")
+                    operators.append((operator_id, operator, prefix))
+                phones.append((number, ptype or ("mobile" if operator_id else "home"), sub_id, operator_id))
+
+        conn.executemany("INSERT INTO Street (id, name, type) VALUES (?, ?, ?)", streets)
+        conn.executemany("INSERT INTO MobileOperator (id, name, prefix) VALUES (?, ?, ?)", operators)
+        conn.executemany("INSERT INTO Address (id, id_street, building, apartment) VALUES (?, ?, ?, ?)", addresses)
+        conn.executemany("INSERT INTO PostOffice (id, office_number, id_address) VALUES (?, ?, ?)", offices)
+        conn.executemany("""
+            INSERT INTO Subscriber (id, lastname, firstname, middlename, id_address, id_post_office)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, subscribers)
+        conn.executemany("""
+            INSERT INTO PhoneNumber (number, type, id_subscriber, id_operator, active)
+            VALUES (?, ?, ?, ?, 1)
+        """, phones)
+
+        stats.subscribers += len(subscribers)
+        stats.phones += len(phones)
+        stats.addresses += len(addresses)
+        stats.streets += len(streets)
+        stats.post_offices += len(offices)
+        stats.operators += len(operators)
+        if checkpoint:
+            checkpoint(conn, stats)
+        conn.commit()
+    except BaseException:
+        # імпорт переривається, тож кеш _Resolver з відкоченими id далі не використовується
+        conn.rollback()
+        raise
+
+
+def _parsed(rows, stats):
+    for line, row in rows:
+        stats.rows += 1
+        if row is None:
+            stats.error(line, "некоректний рядок")
+            continue
+        try:
+            yield parse_row(row)
+        except ValueError as e:
+            stats.error(line, str(e))
+
+
+def import_subscribers(stream, fmt="csv", chunk_size=CHUNK_SIZE, progress=None, start_row=0,
+                       checkpoint=None):
+    # stream — текстовий потік; progress(stats) викликається після кожної пачки
+    # (вже зафіксованої). checkpoint(conn, stats) — у транзакції пачки перед
+    # фіксацією: stats.rows + start_row — місце для продовження перерваного
+    # імпорту, і воно фіксується разом з даними (перші start_row рядків пропускаються).
+    # Власне з'єднання з пулу: пачки фіксуються незалежно від unit of work запиту.
+    stats = ImportStats()
+    started = time.perf_counter()
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        resolver = _Resolver(conn)
+        rows = read_rows(stream, fmt)
+        if start_row:
+            rows = islice(rows, start_row, None)
+        records = _parsed(rows, stats)
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            _import_chunk(conn, resolver, chunk, stats, checkpoint)
+            stats.elapsed = time.perf_counter() - started
+            if progress:
+                progress(stats)
+    finally:
+        pool.release(conn)
+        # і при перериванні з progress: зафіксовані пачки вже змінили довідники
+        if stats.post_offices:
+            invalidate_reference("post_offices")
+        if stats.operators:
+            invalidate_reference("operators")
+    stats.elapsed = time.perf_counter() - started
+    return stats
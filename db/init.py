@@ -1,9 +1,65 @@
 import random, datetime
 from werkzeug.security import generate_password_hash
 from db.utils import get_db
+from db.migrations import migrate
 from service import create_post_office_for_address
 
+# Довідкові значення для демонстраційних даних (також використовує db/generate.py)
+STREETS = [
+    ("Сторожинецька", "вул."),
+    ("Шевченка", "вул."),
+    ("Незалежності", "проспект."),
+    ("Хотинська", "вул."),
+    ("Гагаріна", "вул."),
+    ("Головна", "вул."),
+    ("Кобиляньської", "вул."),
+]
+
+FIRSTNAMES = [
+    "Богдан", "Олександр", "Олег", "Іван", "Дмитро",
+    "Євген", "Ілля", "Микита", "Роман", "Сергій",
+    "Андрій", "Юрій", "Максим", "Степан", "Арсен",
+    "Тарас", "Володимир", "Петро", "Гнат", "Лев"
+]
+
+LASTNAMES = [
+    "Коваленко", "Шевченко", "Ткаченко", "Іванов", "Петренко",
+    "Коваль", "Маргер", "Пастух", "Гуменюк", "Мельник",
+    "Бондар", "Кравець", "Савчук", "Мороз", "Гриценко",
+    "Сидоренко", "Ігнатенко", "Лисенко", "Гордійчук", "Проценко"
+]
+
+MIDDLENAMES = [
+    "Олександрович", "Ігорович", "Іванович", "Михайлович", "Андрійович",
+    "Богданович", "Євгенович", "Дмитрович", "Володимирович", "Сергійович",
+    "Юрійович", "Петрович", "Степанович", "Романович", "Максимович",
+    "Тарасович", "Гнатович", "Олегович", "Левович", "Микитович"
+]
+
+REPAIR_DESCRIPTIONS = [
+    "Ремонт телефонної лінії",
+    "Заміна оптоволоконного кабелю",
+    "Планове обслуговування мережі",
+    "Усунення аварії",
+    "Реконструкція узлової точки звʼязку"
+]
+
+
 def init_db():
+    create_tables()
+    migrate()
+
+    print('Для тесту/демонстрації генерую рандом дані')
+    create_admin()
+    create_mobile_operators()
+    create_special_services()
+    create_random_subscribers(50)
+    create_random_debts(9)
+    create_random_number_change_requests(5)
+    create_random_repairs(6)
+
+
+def create_tables():
     with get_db() as conn:
         cur = conn.cursor()
 
@@ -137,16 +193,6 @@ def init_db():
         print('БД створена!')
 
 
-    print('Для тесту/демонстрації генерую рандом дані')
-    create_admin()
-    create_mobile_operators()
-    create_special_services()
-    create_random_subscribers(50)
-    create_random_debts(9)
-    create_random_number_change_requests(5)
-    create_random_repairs(6)
-
-
 def create_admin():
     with get_db() as conn:
         cur = conn.cursor()
@@ -218,17 +264,7 @@ def create_special_services():
         print("[OK] Створено спецслужби")
 
 def create_random_address(conn):
-    streets = [
-        ("Сторожинецька", "вул."),
-        ("Шевченка", "вул."),
-        ("Незалежності", "проспект."),
-        ("Хотинська", "вул."),
-        ("Гагаріна", "вул."),
-        ("Головна", "вул."),
-        ("Кобиляньської", "вул."),
-    ]
-
-    street_name, street_type = random.choice(streets)
+    street_name, street_type = random.choice(STREETS)
     building = str(random.randint(1, 120))
     apartment = str(random.randint(1, 20))
 
@@ -251,25 +287,6 @@ def create_random_address(conn):
     return cur.lastrowid
 
 def create_random_subscribers(n=5):
-    firstnames = [
-        "Богдан", "Олександр", "Олег", "Іван", "Дмитро",
-        "Євген", "Ілля", "Микита", "Роман", "Сергій",
-        "Андрій", "Юрій", "Максим", "Степан", "Арсен",
-        "Тарас", "Володимир", "Петро", "Гнат", "Лев"
-    ]
-    lastnames = [
-        "Коваленко", "Шевченко", "Ткаченко", "Іванов", "Петренко",
-        "Коваль", "Маргер", "Пастух", "Гуменюк", "Мельник",
-        "Бондар", "Кравець", "Савчук", "Мороз", "Гриценко",
-        "Сидоренко", "Ігнатенко", "Лисенко", "Гордійчук", "Проценко"
-    ]
-    middlenames = [
-        "Олександрович", "Ігорович", "Іванович", "Михайлович", "Андрійович",
-        "Богданович", "Євгенович", "Дмитрович", "Володимирович", "Сергійович",
-        "Юрійович", "Петрович", "Степанович", "Романович", "Максимович",
-        "Тарасович", "Гнатович", "Олегович", "Левович", "Микитович"
-    ]
-
     with get_db() as conn:
         cur = conn.cursor()
 
@@ -278,10 +295,13 @@ def create_random_subscribers(n=5):
             print("[i] Абоненти вже існують")
             return
 
+        cur.execute("SELECT id, prefix FROM MobileOperator")
+        operators = cur.fetchall()
+
         for _ in range(n):
-            ln = random.choice(lastnames)
-            fn = random.choice(firstnames)
-            mn = random.choice(middlenames)
+            ln = random.choice(LASTNAMES)
+            fn = random.choice(FIRSTNAMES)
+            mn = random.choice(MIDDLENAMES)
 
             addr_id = create_random_address(conn)
 
@@ -294,8 +314,7 @@ def create_random_subscribers(n=5):
 
             sub_id = cur.lastrowid
 
-            cur.execute("SELECT id, prefix FROM MobileOperator ORDER BY RANDOM() LIMIT 1")
-            op = cur.fetchone()
+            op = random.choice(operators)
             op_id = op["id"]
             prefix = op["prefix"]
 
@@ -330,13 +349,15 @@ def create_random_number_change_requests(n):
             print("[i] Немає телефонів — заявки не створено")
             return
 
+        cur.execute("SELECT id, prefix FROM MobileOperator")
+        operators = cur.fetchall()
+
         for _ in range(n):
             row = random.choice(numbers)
             old_number = row["number"]
             sub_id = row["sub_id"]
 
-            cur.execute("SELECT id, prefix FROM MobileOperator ORDER BY RANDOM() LIMIT 1")
-            op = cur.fetchone()
+            op = random.choice(operators)
             prefix = op["prefix"]
             new_number = f"{prefix}{random.randint(0, 9999999):07d}"
 
@@ -376,13 +397,7 @@ def create_random_repairs(n):
             date_start = start.strftime("%Y-%m-%d")
             date_end = end.strftime("%Y-%m-%d")
 
-            desc = random.choice([
-                "Ремонт телефонної лінії",
-                "Заміна оптоволоконного кабелю",
-                "Планове обслуговування мережі",
-                "Усунення аварії",
-                "Реконструкція узлової точки звʼязку"
-            ])
+            desc = random.choice(REPAIR_DESCRIPTIONS)
 
             cur.execute("""
                 INSERT INTO RepairWork (id_address, date_start, date_end, description)
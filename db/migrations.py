@@ -0,0 +1,544 @@
+from db import derived
+from db.utils import get_db
+
+# Кожен елемент — одна версія схеми (PRAGMA user_version = номер у списку, з 1).
+# Крок міграції — SQL-рядок або функція, що приймає з'єднання.
+# Нові зміни схеми додаються лише в кінець списку.
+MIGRATIONS = [
+    # 1: вторинні індекси для запитів service.py
+    [
+        "CREATE INDEX IF NOT EXISTS idx_phone_subscriber ON PhoneNumber(id_subscriber, active, type)",
+        "CREATE INDEX IF NOT EXISTS idx_phone_number ON PhoneNumber(number)",
+        "CREATE INDEX IF NOT EXISTS idx_phone_operator ON PhoneNumber(id_operator, active)",
+        "CREATE INDEX IF NOT EXISTS idx_debt_subscriber ON Debt(id_subscriber, date_start)",
+        "CREATE INDEX IF NOT EXISTS idx_debt_status ON Debt(status, id_subscriber, amount)",
+        "CREATE INDEX IF NOT EXISTS idx_street_name_type ON Street(name, type)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_name ON Subscriber(lastname, firstname)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_address ON Subscriber(id_address)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_post_office ON Subscriber(id_post_office)",
+        "CREATE INDEX IF NOT EXISTS idx_address_street ON Address(id_street)",
+        "CREATE INDEX IF NOT EXISTS idx_post_office_address ON PostOffice(id_address)",
+        "CREATE INDEX IF NOT EXISTS idx_post_office_number ON PostOffice(office_number)",
+        "CREATE INDEX IF NOT EXISTS idx_request_date ON NumberChangeRequest(date_request)",
+        "CREATE INDEX IF NOT EXISTS idx_request_subscriber ON NumberChangeRequest(id_subscriber)",
+        "CREATE INDEX IF NOT EXISTS idx_repair_address ON RepairWork(id_address)",
+        "CREATE INDEX IF NOT EXISTS idx_repair_date ON RepairWork(date_start)",
+        "CREATE INDEX IF NOT EXISTS idx_special_service_name ON SpecialService(name)",
+        "CREATE INDEX IF NOT EXISTS idx_special_service_number ON SpecialService(id_number)",
+        "CREATE INDEX IF NOT EXISTS idx_operator_name ON MobileOperator(name)",
+        "ANALYZE",
+    ],
+
+    # 2: повнотекстовий (trigram) індекс для пошуку абонентів за маскою
+    [
+        """
+        CREATE TABLE IF NOT EXISTS SubscriberSearchTerm (
+            id INTEGER PRIMARY KEY,
+            id_subscriber INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            id_phone INTEGER,
+            term TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_search_term_subscriber ON SubscriberSearchTerm(id_subscriber, kind)",
+        "CREATE INDEX IF NOT EXISTS idx_search_term_phone ON SubscriberSearchTerm(id_phone)",
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS SubscriberSearch USING fts5(
+            term,
+            content='SubscriberSearchTerm',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS search_term_ai AFTER INSERT ON SubscriberSearchTerm BEGIN
+            INSERT INTO SubscriberSearch (rowid, term) VALUES (new.id, new.term);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS search_term_ad AFTER DELETE ON SubscriberSearchTerm BEGIN
+            INSERT INTO SubscriberSearch (SubscriberSearch, rowid, term) VALUES ('delete', old.id, old.term);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS subscriber_search_ai AFTER INSERT ON Subscriber BEGIN
+            INSERT INTO SubscriberSearchTerm (id_subscriber, kind, term)
+            SELECT new.id, 'name', v FROM (
+                SELECT new.lastname AS v UNION ALL SELECT new.firstname UNION ALL SELECT new.middlename
+            ) WHERE v IS NOT NULL;
+            INSERT INTO SubscriberSearchTerm (id_subscriber, kind, term)
+            SELECT new.id, 'office', CAST(office_number AS TEXT)
+            FROM PostOffice WHERE id = new.id_post_office AND office_number IS NOT NULL;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS subscriber_search_au
+        AFTER UPDATE OF lastname, firstname, middlename, id_post_office ON Subscriber BEGIN
+            DELETE FROM SubscriberSearchTerm WHERE id_subscriber = old.id AND kind IN ('name', 'office');
+            INSERT INTO SubscriberSearchTerm (id_subscriber, kind, term)
+            SELECT new.id, 'name', v FROM (
+                SELECT new.lastname AS v UNION ALL SELECT new.firstname UNION ALL SELECT new.middlename
+            ) WHERE v IS NOT NULL;
+            INSERT INTO SubscriberSearchTerm (id_subscriber, kind, term)
+            SELECT new.id, 'office', CAST(office_number AS TEXT)
+            FROM PostOffice WHERE id = new.id_post_office AND office_number IS NOT NULL;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS subscriber_search_ad AFTER DELETE ON Subscriber BEGIN
+            DELETE FROM SubscriberSearchTerm WHERE id_subscriber = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS phone_search_ai AFTER INSERT ON PhoneNumber
+        WHEN new.active = 1 AND new.id_subscriber IS NOT NULL AND new.number IS NOT NULL BEGIN
+            INSERT INTO SubscriberSearchTerm (id_subscriber, kind, id_phone, term)
+            VALUES (new.id_subscriber, 'phone', new.id, new.number);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS phone_search_au
+        AFTER UPDATE OF number, active, id_subscriber ON PhoneNumber BEGIN
+            DELETE FROM SubscriberSearchTerm WHERE id_phone = old.id;
+            INSERT INTO SubscriberSearchTerm (id_subscriber, kind, id_phone, term)
+            SELECT new.id_subscriber, 'phone', new.id, new.number
+            WHERE new.active = 1 AND new.id_subscriber IS NOT NULL AND new.number IS NOT NULL;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS phone_search_ad AFTER DELETE ON PhoneNumber BEGIN
+            DELETE FROM SubscriberSearchTerm WHERE id_phone = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS post_office_search_au AFTER UPDATE OF office_number ON PostOffice BEGIN
+            DELETE FROM SubscriberSearchTerm
+            WHERE kind = 'office' AND id_subscriber IN (SELECT id FROM Subscriber WHERE id_post_office = new.id);
+            INSERT INTO SubscriberSearchTerm (id_subscriber, kind, term)
+            SELECT id, 'office', CAST(new.office_number AS TEXT)
+            FROM Subscriber WHERE id_post_office = new.id AND new.office_number IS NOT NULL;
+        END
+        """,
+        derived.rebuild_search_index,
+    ],
+
+    # 3: trigram-індекс номерів телефонів для пошуку за суфіксом / фрагментом цифр
+    [
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS PhoneNumberSearch USING fts5(
+            number,
+            content='PhoneNumber',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS phone_number_fts_ai AFTER INSERT ON PhoneNumber BEGIN
+            INSERT INTO PhoneNumberSearch (rowid, number) VALUES (new.id, new.number);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS phone_number_fts_ad AFTER DELETE ON PhoneNumber BEGIN
+            INSERT INTO PhoneNumberSearch (PhoneNumberSearch, rowid, number) VALUES ('delete', old.id, old.number);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS phone_number_fts_au AFTER UPDATE OF number ON PhoneNumber BEGIN
+            INSERT INTO PhoneNumberSearch (PhoneNumberSearch, rowid, number) VALUES ('delete', old.id, old.number);
+            INSERT INTO PhoneNumberSearch (rowid, number) VALUES (new.id, new.number);
+        END
+        """,
+        derived.rebuild_phone_index,
+    ],
+
+    # 4: індекси під ключі keyset-пагінації списків
+    [
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_sort ON Subscriber(IFNULL(lastname, ''), IFNULL(firstname, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_request_sort ON NumberChangeRequest(IFNULL(date_request, ''))",
+        "CREATE INDEX IF NOT EXISTS idx_repair_sort ON RepairWork(IFNULL(date_start, ''))",
+    ],
+
+    # 5: денормалізований основний номер абонента (Subscriber.main_phone_id)
+    [
+        "ALTER TABLE Subscriber ADD COLUMN main_phone_id INTEGER",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS phone_main_ai AFTER INSERT ON PhoneNumber
+        WHEN new.id_subscriber IS NOT NULL BEGIN
+            UPDATE Subscriber
+            SET main_phone_id = ({derived.MAIN_PHONE_SQL.format(sub="new.id_subscriber")})
+            WHERE id = new.id_subscriber;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS phone_main_ad AFTER DELETE ON PhoneNumber
+        WHEN old.id_subscriber IS NOT NULL BEGIN
+            UPDATE Subscriber
+            SET main_phone_id = ({derived.MAIN_PHONE_SQL.format(sub="old.id_subscriber")})
+            WHERE id = old.id_subscriber AND main_phone_id = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS phone_main_au AFTER UPDATE OF type, active, id_subscriber ON PhoneNumber BEGIN
+            UPDATE Subscriber
+            SET main_phone_id = ({derived.MAIN_PHONE_SQL.format(sub="old.id_subscriber")})
+            WHERE id = old.id_subscriber;
+            UPDATE Subscriber
+            SET main_phone_id = ({derived.MAIN_PHONE_SQL.format(sub="new.id_subscriber")})
+            WHERE id = new.id_subscriber AND new.id_subscriber IS NOT old.id_subscriber;
+        END
+        """,
+        derived.rebuild_main_phones,
+    ],
+
+    # 6: зведені таблиці для звітів 6, 7 і 10
+    [
+        """
+        CREATE TABLE IF NOT EXISTS ReportOperatorPhones (
+            id_operator INTEGER PRIMARY KEY,
+            phone_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ReportSubscriberDebt (
+            id_subscriber INTEGER PRIMARY KEY,
+            total REAL NOT NULL DEFAULT 0,
+            debt_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS ReportStreetResidents (
+            id_street INTEGER PRIMARY KEY,
+            resident_count INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_report_operator_count ON ReportOperatorPhones(phone_count)",
+        "CREATE INDEX IF NOT EXISTS idx_report_debt_total ON ReportSubscriberDebt(total)",
+        "CREATE INDEX IF NOT EXISTS idx_report_street_count ON ReportStreetResidents(resident_count)",
+
+        # звіт 6: активні номери за операторами
+        """
+        CREATE TRIGGER IF NOT EXISTS report_operator_ai AFTER INSERT ON PhoneNumber
+        WHEN new.active = 1 AND new.id_operator IS NOT NULL BEGIN
+            INSERT INTO ReportOperatorPhones (id_operator, phone_count) VALUES (new.id_operator, 1)
+            ON CONFLICT(id_operator) DO UPDATE SET phone_count = phone_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_operator_ad AFTER DELETE ON PhoneNumber
+        WHEN old.active = 1 AND old.id_operator IS NOT NULL BEGIN
+            UPDATE ReportOperatorPhones SET phone_count = phone_count - 1 WHERE id_operator = old.id_operator;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_operator_au AFTER UPDATE OF active, id_operator ON PhoneNumber BEGIN
+            UPDATE ReportOperatorPhones SET phone_count = phone_count - 1
+            WHERE id_operator = old.id_operator AND old.active = 1;
+            INSERT INTO ReportOperatorPhones (id_operator, phone_count)
+            SELECT new.id_operator, 1 WHERE new.active = 1 AND new.id_operator IS NOT NULL
+            ON CONFLICT(id_operator) DO UPDATE SET phone_count = phone_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_operator_del AFTER DELETE ON MobileOperator BEGIN
+            DELETE FROM ReportOperatorPhones WHERE id_operator = old.id;
+        END
+        """,
+
+        # звіт 7: сума активних боргів абонента
+        """
+        CREATE TRIGGER IF NOT EXISTS report_debt_ai AFTER INSERT ON Debt
+        WHEN new.status = 'active' AND new.id_subscriber IS NOT NULL BEGIN
+            INSERT INTO ReportSubscriberDebt (id_subscriber, total, debt_count)
+            VALUES (new.id_subscriber, IFNULL(new.amount, 0), 1)
+            ON CONFLICT(id_subscriber) DO UPDATE SET
+                total = total + IFNULL(new.amount, 0), debt_count = debt_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_debt_ad AFTER DELETE ON Debt
+        WHEN old.status = 'active' BEGIN
+            UPDATE ReportSubscriberDebt SET
+                total = CASE WHEN debt_count = 1 THEN 0 ELSE total - IFNULL(old.amount, 0) END,
+                debt_count = debt_count - 1
+            WHERE id_subscriber = old.id_subscriber;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_debt_au AFTER UPDATE OF amount, status, id_subscriber ON Debt BEGIN
+            UPDATE ReportSubscriberDebt SET
+                total = CASE WHEN debt_count = 1 THEN 0 ELSE total - IFNULL(old.amount, 0) END,
+                debt_count = debt_count - 1
+            WHERE id_subscriber = old.id_subscriber AND old.status = 'active';
+            INSERT INTO ReportSubscriberDebt (id_subscriber, total, debt_count)
+            SELECT new.id_subscriber, IFNULL(new.amount, 0), 1
+            WHERE new.status = 'active' AND new.id_subscriber IS NOT NULL
+            ON CONFLICT(id_subscriber) DO UPDATE SET
+                total = total + IFNULL(new.amount, 0), debt_count = debt_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_debt_subscriber_ad AFTER DELETE ON Subscriber BEGIN
+            DELETE FROM ReportSubscriberDebt WHERE id_subscriber = old.id;
+        END
+        """,
+
+        # звіт 10: кількість мешканців на вулиці
+        """
+        CREATE TRIGGER IF NOT EXISTS report_street_ai AFTER INSERT ON Subscriber
+        WHEN new.id_address IS NOT NULL BEGIN
+            INSERT INTO ReportStreetResidents (id_street, resident_count)
+            SELECT a.id_street, 1 FROM Address a WHERE a.id = new.id_address AND a.id_street IS NOT NULL
+            ON CONFLICT(id_street) DO UPDATE SET resident_count = resident_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_street_ad AFTER DELETE ON Subscriber
+        WHEN old.id_address IS NOT NULL BEGIN
+            UPDATE ReportStreetResidents SET resident_count = resident_count - 1
+            WHERE id_street = (SELECT id_street FROM Address WHERE id = old.id_address);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_street_au AFTER UPDATE OF id_address ON Subscriber BEGIN
+            UPDATE ReportStreetResidents SET resident_count = resident_count - 1
+            WHERE id_street = (SELECT id_street FROM Address WHERE id = old.id_address);
+            INSERT INTO ReportStreetResidents (id_street, resident_count)
+            SELECT a.id_street, 1 FROM Address a WHERE a.id = new.id_address AND a.id_street IS NOT NULL
+            ON CONFLICT(id_street) DO UPDATE SET resident_count = resident_count + 1;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_street_address_au AFTER UPDATE OF id_street ON Address
+        WHEN new.id_street IS NOT old.id_street BEGIN
+            UPDATE ReportStreetResidents
+            SET resident_count = resident_count - (SELECT COUNT(*) FROM Subscriber WHERE id_address = new.id)
+            WHERE id_street = old.id_street;
+            INSERT INTO ReportStreetResidents (id_street, resident_count)
+            SELECT new.id_street, COUNT(*) FROM Subscriber WHERE id_address = new.id AND new.id_street IS NOT NULL
+            ON CONFLICT(id_street) DO UPDATE SET resident_count = resident_count + excluded.resident_count;
+        END
+        """,
+        # мешканці видаленої адреси віднімаються до того, як FK обнулить Subscriber.id_address
+        """
+        CREATE TRIGGER IF NOT EXISTS report_street_address_bd BEFORE DELETE ON Address BEGIN
+            UPDATE ReportStreetResidents
+            SET resident_count = resident_count - (SELECT COUNT(*) FROM Subscriber WHERE id_address = old.id)
+            WHERE id_street = old.id_street;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS report_street_del AFTER DELETE ON Street BEGIN
+            DELETE FROM ReportStreetResidents WHERE id_street = old.id;
+        END
+        """,
+        derived.rebuild_report_tables,
+    ],
+
+    # 7: фонові завдання (jobs.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS Job (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            checkpoint TEXT,
+            result TEXT,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            pid INTEGER,
+            created_by TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_job_status ON Job(status)",
+    ],
+
+    # 8: серверні сесії входу (session_store.py); id — sha256 від id у cookie
+    [
+        """
+        CREATE TABLE IF NOT EXISTS Session (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            ip TEXT,
+            user_agent TEXT,
+            FOREIGN KEY(user_id) REFERENCES User(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_session_user ON Session(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_expires ON Session(expires_at)",
+    ],
+
+    # 9: журнал боргів і баланс абонента (замінює ReportSubscriberDebt).
+    # DebtLedger лише доповнюється, без зовнішніх ключів, щоб історія
+    # залишалась після видалення боргу чи абонента.
+    [
+        "DROP TRIGGER IF EXISTS report_debt_ai",
+        "DROP TRIGGER IF EXISTS report_debt_ad",
+        "DROP TRIGGER IF EXISTS report_debt_au",
+        "DROP TRIGGER IF EXISTS report_debt_subscriber_ad",
+        "DROP TABLE IF EXISTS ReportSubscriberDebt",
+        """
+        CREATE TABLE IF NOT EXISTS DebtLedger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id_debt INTEGER,
+            id_subscriber INTEGER,
+            kind TEXT NOT NULL,
+            amount REAL NOT NULL,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            note TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_debt_ledger_subscriber ON DebtLedger(id_subscriber, id)",
+        "CREATE INDEX IF NOT EXISTS idx_debt_ledger_debt ON DebtLedger(id_debt)",
+        """
+        CREATE TABLE IF NOT EXISTS SubscriberBalance (
+            id_subscriber INTEGER PRIMARY KEY,
+            balance REAL NOT NULL DEFAULT 0,
+            debt_count INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_balance ON SubscriberBalance(balance, id_subscriber)",
+
+        # зміни активних боргів -> записи журналу
+        """
+        CREATE TRIGGER IF NOT EXISTS debt_ledger_ai AFTER INSERT ON Debt
+        WHEN new.status = 'active' AND new.id_subscriber IS NOT NULL BEGIN
+            INSERT INTO DebtLedger (id_debt, id_subscriber, kind, amount)
+            VALUES (new.id, new.id_subscriber, 'charge', IFNULL(new.amount, 0));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS debt_ledger_ad AFTER DELETE ON Debt
+        WHEN old.status = 'active' AND old.id_subscriber IS NOT NULL BEGIN
+            INSERT INTO DebtLedger (id_debt, id_subscriber, kind, amount)
+            VALUES (old.id, old.id_subscriber, 'cancel', -IFNULL(old.amount, 0));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS debt_ledger_au AFTER UPDATE OF amount, status, id_subscriber ON Debt BEGIN
+            -- борг лишається активним у того самого абонента: коригування суми
+            INSERT INTO DebtLedger (id_debt, id_subscriber, kind, amount)
+            SELECT new.id, new.id_subscriber, 'adjustment', IFNULL(new.amount, 0) - IFNULL(old.amount, 0)
+            WHERE old.status = 'active' AND new.status = 'active'
+              AND new.id_subscriber IS old.id_subscriber AND new.id_subscriber IS NOT NULL
+              AND IFNULL(new.amount, 0) <> IFNULL(old.amount, 0);
+            -- закриття: оплата, списання або перенесення на іншого абонента
+            INSERT INTO DebtLedger (id_debt, id_subscriber, kind, amount)
+            SELECT old.id, old.id_subscriber,
+                   CASE WHEN new.id_subscriber IS NOT old.id_subscriber THEN 'transfer_out'
+                        WHEN new.status = 'paid' THEN 'payment'
+                        ELSE 'writeoff' END,
+                   -IFNULL(old.amount, 0)
+            WHERE old.status = 'active' AND old.id_subscriber IS NOT NULL
+              AND (new.status IS NOT 'active' OR new.id_subscriber IS NOT old.id_subscriber);
+            -- відкриття: повторна активація або перенесення від іншого абонента
+            INSERT INTO DebtLedger (id_debt, id_subscriber, kind, amount)
+            SELECT new.id, new.id_subscriber,
+                   CASE WHEN old.id_subscriber IS NOT new.id_subscriber THEN 'transfer_in' ELSE 'reopen' END,
+                   IFNULL(new.amount, 0)
+            WHERE new.status = 'active' AND new.id_subscriber IS NOT NULL
+              AND (old.status IS NOT 'active' OR old.id_subscriber IS NOT new.id_subscriber);
+        END
+        """,
+
+        # запис журналу -> баланс абонента
+        f"""
+        CREATE TRIGGER IF NOT EXISTS debt_ledger_balance_ai AFTER INSERT ON DebtLedger
+        WHEN new.id_subscriber IS NOT NULL BEGIN
+            INSERT INTO SubscriberBalance (id_subscriber, balance, debt_count, updated_at)
+            SELECT new.id_subscriber, ROUND(new.amount, 2), {derived.DEBT_COUNT_DELTA_SQL.format(kind="new.kind")},
+                   new.created_at
+            WHERE EXISTS (SELECT 1 FROM Subscriber WHERE id = new.id_subscriber)
+            ON CONFLICT(id_subscriber) DO UPDATE SET
+                balance = CASE WHEN debt_count + excluded.debt_count = 0 THEN 0
+                               ELSE ROUND(balance + excluded.balance, 2) END,
+                debt_count = debt_count + excluded.debt_count,
+                updated_at = excluded.updated_at;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS debt_ledger_no_update BEFORE UPDATE ON DebtLedger BEGIN
+            SELECT RAISE(ABORT, 'DebtLedger: записи журналу не змінюються');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS debt_ledger_no_delete BEFORE DELETE ON DebtLedger BEGIN
+            SELECT RAISE(ABORT, 'DebtLedger: записи журналу не видаляються');
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS balance_subscriber_ad AFTER DELETE ON Subscriber BEGIN
+            DELETE FROM SubscriberBalance WHERE id_subscriber = old.id;
+        END
+        """,
+        derived.seed_debt_ledger,
+        derived.rebuild_debt_balances,
+    ],
+
+    # 10: мітка процесу, що виконує завдання (jobs.RUNNER_TOKEN), поруч із pid
+    [
+        "ALTER TABLE Job ADD COLUMN runner_token TEXT",
+    ],
+
+    # 11: індекси NOCASE для пошуку за префіксом: LIKE нечутливий до регістру
+    # і не використовує індекси з BINARY (звіти 5 і 9, search_debtors)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_name_nocase"
+        " ON Subscriber(lastname COLLATE NOCASE, firstname COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_firstname_nocase ON Subscriber(firstname COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriber_middlename_nocase ON Subscriber(middlename COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_street_name_nocase ON Street(name COLLATE NOCASE)",
+    ],
+
+    # 12: пошук ремонтів за будинком і квартирою (search_repairs)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_address_building_nocase ON Address(building COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_address_apartment_nocase ON Address(apartment COLLATE NOCASE)",
+    ],
+
+    # 13: оренда виконавця завдання (jobs.LEASE_TIMEOUT) замість перевірки PID
+    [
+        "ALTER TABLE Job ADD COLUMN lease_until REAL",
+    ],
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate():
+    with get_db() as conn:
+        version = get_schema_version(conn)
+
+        for number, steps in enumerate(MIGRATIONS, start=1):
+            if number <= version:
+                continue
+
+            conn.execute("BEGIN IMMEDIATE")
+            # інший процес (воркер gunicorn) міг застосувати міграцію, поки ми чекали блокування
+            if get_schema_version(conn) >= number:
+                conn.rollback()
+                continue
+            try:
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+            print(f"[OK] Схему БД оновлено до версії {number}")
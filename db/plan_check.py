@@ -0,0 +1,142 @@
+import argparse
+import re
+import sys
+
+import service
+from db.utils import get_db, unit_of_work, end_unit_of_work
+
+# Перевірка планів виконання: викликає функції service.py на реальній БД,
+# перехоплює виконані SQL-запити і шукає в EXPLAIN QUERY PLAN повні
+# сканування таблиць (без індексу) або автоматичні тимчасові індекси.
+#
+#   python -m db.plan_check --threshold 1000
+#
+# Зміни, зроблені функціями запису, відкочуються наприкінці.
+
+DEFAULT_THRESHOLD = 1000
+
+# повне сканування таблиці або всього індексу (SCAN x USING [COVERING] INDEX ...)
+_SCAN_RE = re.compile(r"^SCAN (\w+)(?: USING (?:COVERING )?INDEX \w+)?(?: LEFT-JOIN)?$")
+_INDEX_SCAN_RE = re.compile(r"^SCAN \w+ USING (?:COVERING )?INDEX")
+# обхід індексу в порядку сортування нормальний, якщо запит повертає всі рядки
+# (без WHERE) або зупиняється на LIMIT (сторінка keyset-пагінації)
+_WHERE_RE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+_AUTO_INDEX_RE = re.compile(r"^SEARCH (\w+) USING AUTOMATIC")
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIAS = {"on", "where", "left", "join", "inner", "order", "group", "set", "values", "limit", "using"}
+
+
+def _sample_calls(conn):
+    sub = conn.execute("SELECT id FROM Subscriber LIMIT 1").fetchone()
+    sub_id = sub["id"] if sub else 0
+    phone = conn.execute("SELECT number FROM PhoneNumber WHERE id_subscriber IS NOT NULL LIMIT 1").fetchone()
+    number = phone["number"] if phone else "0"
+
+    calls = [
+        ("get_user_by_login", ("admin",)),
+        ("get_all_users", ()),
+        ("get_registration_requests", ()),
+        ("get_registration_request", (1,)),
+        ("get_address", (1,)),
+        ("get_all_post_offices", ()),
+        ("get_all_subscribers", ()),
+        ("get_subscriber", (sub_id,)),
+        ("search_subscribers", ("Ков*",)),
+        ("search_subscribers", ("*" + number[-4:],)),
+        ("get_all_operators", ()),
+        ("get_phones_by_subscriber", (sub_id,)),
+        ("get_all_number_change_requests", ()),
+        ("get_request", (1,)),
+        ("get_debts_by_subscriber", (sub_id,)),
+        ("get_subscribers_with_debts", ()),
+        ("search_debtors", ("Ков*",)),
+        ("get_all_repairs", ()),
+        ("get_repair", (1,)),
+        ("search_repairs", ("Шевч*",)),
+        ("get_all_special_services", ()),
+        ("get_or_create_street", ("Шевченка", "вул.")),
+        ("update_subscriber", (sub_id, "Тест", "Тест", "Тест")),
+        ("create_phone", ("0000000000", "mobile", sub_id, None)),
+        ("create_debt", (sub_id, 1.0, "2025-01-01", None)),
+        ("delete_subscriber", (sub_id,)),
+    ]
+    params = {"lastname": "Ков", "firstname": "", "street_name": "Шевч"}
+    for query_id in range(1, 11):
+        calls.append(("run_builtin_query", (str(query_id), params)))
+    return calls
+
+
+def _table_names(sql):
+    names = {}
+    for table, alias in _TABLE_RE.findall(sql):
+        names[table] = table
+        if alias and alias.lower() not in _NOT_ALIAS:
+            names[alias] = table
+    return names
+
+
+def _row_count(conn, table, cache):
+    if table not in cache:
+        try:
+            cache[table] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        except Exception:
+            cache[table] = 0
+    return cache[table]
+
+
+def check_query_plans(threshold=DEFAULT_THRESHOLD):
+    problems = []
+    counts = {}
+
+    with unit_of_work():
+        with get_db() as conn:
+            statements = []
+            conn.set_trace_callback(statements.append)
+            try:
+                for name, args in _sample_calls(conn):
+                    del statements[:]
+                    getattr(service, name)(*args)
+                    for sql in list(statements):
+                        if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+                            continue
+                        tables = _table_names(sql)
+                        plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+                        for row in plan:
+                            detail = row[3]
+                            m = _SCAN_RE.match(detail) or _AUTO_INDEX_RE.match(detail)
+                            if not m:
+                                continue
+                            if _INDEX_SCAN_RE.match(detail) and (_LIMIT_RE.search(sql)
+                                                                 or not _WHERE_RE.search(sql)):
+                                continue
+                            table = tables.get(m.group(1), m.group(1))
+                            rows = _row_count(conn, table, counts)
+                            if rows > threshold:
+                                problems.append((name, table, rows, detail, " ".join(sql.split())))
+            finally:
+                conn.set_trace_callback(None)
+        end_unit_of_work(commit=False)
+
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пошук повних сканувань таблиць у запитах service.py")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD,
+                        help="мінімальний розмір таблиці (рядків), для якого сканування вважається проблемою")
+    args = parser.parse_args(argv)
+
+    problems = check_query_plans(args.threshold)
+    for name, table, rows, detail, sql in problems:
+        print(f"[!] {name}: {detail} ({table}, {rows} рядків)\n    {sql[:200]}")
+
+    if problems:
+        print(f"Знайдено повних сканувань: {len(problems)}")
+        return 1
+    print("[OK] Повних сканувань великих таблиць не знайдено")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
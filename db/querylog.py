@@ -0,0 +1,258 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from functools import lru_cache
+
+# Облік часу SQL-запитів: з'єднання з db/utils.connect() створюють курсори
+# InstrumentedCursor, які міряють execute і подальші fetch*. Час агрегується за
+# «відбитком» запиту (літерали замінено на ?, пробіли стиснуто), запити,
+# повільніші за SLOW_QUERY_THRESHOLD, потрапляють у журнал разом з параметрами.
+
+logger = logging.getLogger("db.slow")
+
+SLOW_QUERY_THRESHOLD = 0.1      # секунд
+SAMPLES_PER_QUERY = 1000        # останні виміри для перцентилів
+MAX_FINGERPRINTS = 1000
+SLOW_LOG_SIZE = 200
+OTHER_QUERIES = "(інші запити)"
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+# текст запитів у service.py сталий (параметри передаються окремо), тож кеш
+# прибирає нормалізацію регулярними виразами з гарячого шляху
+@lru_cache(maxsize=4096)
+def fingerprint(sql):
+    sql = _COMMENT_RE.sub(" ", sql)
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _SPACE_RE.sub(" ", sql).strip()
+    return _LIST_RE.sub("(?+)", sql)
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+
+class QueryStats:
+    __slots__ = ("count", "total", "max", "rows", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=SAMPLES_PER_QUERY)
+
+
+class RequestStats:
+    # Активність БД у межах одного HTTP-запиту (потоку): запити, їх час і
+    # кількість з'єднань, взятих з пулу
+
+    __slots__ = ("queries", "query_time", "connections", "fingerprints")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.connections = 0
+        self.fingerprints = Counter()
+
+    def repeated(self, threshold):
+        # [(відбиток, кількість)] для запитів, виконаних не менше threshold разів (ознака N+1)
+        return [(key, n) for key, n in self.fingerprints.most_common() if n >= threshold]
+
+
+_local = threading.local()
+
+
+def begin_request_stats():
+    _local.request = RequestStats()
+    return _local.request
+
+
+def end_request_stats():
+    stats = getattr(_local, "request", None)
+    _local.request = None
+    return stats
+
+
+def note_connection():
+    stats = getattr(_local, "request", None)
+    if stats is not None:
+        stats.connections += 1
+
+
+class QueryLog:
+
+    def __init__(self):
+        self._stats = {}
+        self._slow = deque(maxlen=SLOW_LOG_SIZE)
+        self._lock = threading.Lock()
+
+    def record(self, sql, params, elapsed, rows=0):
+        key = fingerprint(sql)
+        current = getattr(_local, "request", None)
+        if current is not None:
+            current.queries += 1
+            current.query_time += elapsed
+            current.fingerprints[key] += 1
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= MAX_FINGERPRINTS:
+                    key = OTHER_QUERIES
+                stats = self._stats.setdefault(key, QueryStats())
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.rows += rows
+            stats.samples.append(elapsed)
+
+            if elapsed < SLOW_QUERY_THRESHOLD:
+                return
+            entry = {
+                "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "ms": elapsed * 1000,
+                "rows": rows,
+                "fingerprint": key,
+                "sql": _SPACE_RE.sub(" ", sql).strip(),
+                "params": repr(params)[:500],
+            }
+            self._slow.append(entry)
+        logger.warning("Повільний запит %.1f мс: %s %s", entry["ms"], entry["sql"], entry["params"])
+
+    def top(self, limit=50, sort="total"):
+        # [{fingerprint, count, total_ms, mean_ms, p50_ms, p95_ms, p99_ms, max_ms, rows}]
+        with self._lock:
+            items = [(key, s.count, s.total, s.max, s.rows, sorted(s.samples)) for key, s in self._stats.items()]
+        result = []
+        for key, count, total, longest, rows, ordered in items:
+            result.append({
+                "fingerprint": key,
+                "count": count,
+                "total_ms": total * 1000,
+                "mean_ms": total / count * 1000,
+                "p50_ms": _percentile(ordered, 50) * 1000,
+                "p95_ms": _percentile(ordered, 95) * 1000,
+                "p99_ms": _percentile(ordered, 99) * 1000,
+                "max_ms": longest * 1000,
+                "rows": rows,
+            })
+        result.sort(key=lambda r: r[f"{sort}_ms"] if sort != "count" else r["count"], reverse=True)
+        return result[:limit]
+
+    def slow(self):
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def totals(self):
+        with self._lock:
+            return (sum(s.count for s in self._stats.values()),
+                    sum(s.total for s in self._stats.values()))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+
+query_log = QueryLog()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Виконання запиту в SQLite продовжується під час fetch*, тому час
+    # накопичується до вичерпання результату, наступного execute або закриття.
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._pending = [sql, parameters, time.perf_counter() - started, 0]
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            rows = len(seq_of_parameters) if isinstance(seq_of_parameters, (list, tuple)) else "?"
+            query_log.record(sql, f"<executemany: {rows} наборів>", time.perf_counter() - started)
+
+    def _timed(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._pending is not None:
+                self._pending[2] += time.perf_counter() - started
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._pending is not None:
+            self._pending[3] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        if self._pending is not None:
+            self._pending[3] += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            query_log.record(*pending)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute у C не викликає перевизначений cursor(), тому
+    # скорочені методи теж перевизначено
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,78 @@
+from functools import lru_cache
+from operator import itemgetter
+
+# Компактні рядки результату для великих вибірок (списки абонентів, пошук).
+#
+# sqlite3.Row — окремий об'єкт, що тримає кортеж значень і опис курсора, тому
+# кожен рядок коштує два об'єкти. Record — це сам кортеж значень (підклас tuple
+# з __slots__ = ()), а імена колонок зберігаються один раз у класі, створеному
+# для конкретного набору колонок. Доступ як у sqlite3.Row: row["name"], row[0],
+# row.keys(), dict(row), а також атрибутом row.name (так звертаються шаблони).
+
+
+class Record(tuple):
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                key = self._index[key]
+            except KeyError:
+                # як і sqlite3.Row, імена колонок не чутливі до регістру
+                key = self._index[key.lower()]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._fields)
+
+    def __repr__(self):
+        pairs = ", ".join(f"{name}={value!r}" for name, value in zip(self._fields, self))
+        return f"Record({pairs})"
+
+
+@lru_cache(maxsize=256)
+def record_type(columns):
+    # columns — кортеж імен колонок; однаковий набір колонок дає той самий клас
+    index = {}
+    for i, name in enumerate(columns):
+        # при дублікатах імен, як у sqlite3.Row, перемагає перша колонка
+        index.setdefault(name, i)
+        index.setdefault(name.lower(), i)
+
+    namespace = {"__slots__": (), "_fields": columns, "_index": index}
+    for name, i in index.items():
+        if name.isidentifier() and not hasattr(Record, name):
+            namespace.setdefault(name, property(itemgetter(i)))
+    return type("Record", (Record,), namespace)
+
+
+class RecordFactory:
+    # row_factory для курсора: клас запису визначається один раз на запит
+    # (description змінюється лише після нового execute). Однакові рядкові
+    # значення (вулиці, імена) в межах курсора зберігаються одним об'єктом —
+    # на великих вибірках це основна економія, бо значень значно більше, ніж рядків.
+
+    __slots__ = ("_description", "_type", "_values")
+
+    def __init__(self):
+        self._description = None
+        self._type = None
+        self._values = {}
+
+    def __call__(self, cursor, row):
+        description = cursor.description
+        if description is not self._description:
+            self._description = description
+            self._type = record_type(tuple(d[0] for d in description))
+        # лише рядки: словник порівнює за ==, а 1 == 1.0 має той самий хеш, тож
+        # REAL-колонка могла б отримати int з іншого рядка (і навпаки)
+        intern = self._values.setdefault
+        return self._type([intern(v, v) if type(v) is str else v for v in row])
+
+
+def record_cursor(conn):
+    cur = conn.cursor()
+    cur.row_factory = RecordFactory()
+    return cur
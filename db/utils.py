@@ -1,15 +1,228 @@
+import atexit
+import pathlib
+import queue
 import sqlite3
+import threading
 from contextlib import contextmanager
 
+from db.querylog import InstrumentedConnection, note_connection
+
 DB_PATH = "db/db.sqlite"
+POOL_SIZE = 8
+# облік часу кожного запиту (db/querylog.py); False — звичайні з'єднання sqlite3
+INSTRUMENT_QUERIES = True
+
+
+def connect(readonly=False):
+    factory = InstrumentedConnection if INSTRUMENT_QUERIES else sqlite3.Connection
+    if readonly:
+        # mode=ro: з'єднання ніколи не бере блокування на запис
+        uri = pathlib.Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False, factory=factory)
+        conn.execute("PRAGMA query_only = ON;")
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, factory=factory)
+        conn.execute("PRAGMA foreign_keys = ON;")
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.execute("PRAGMA journal_mode = WAL;")
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class ConnectionPool:
+    # Пул відкритих з'єднань: connect + PRAGMA виконуються один раз на з'єднання,
+    # а не на кожен виклик get_db(). Зберігаємо не більше size простоюючих з'єднань.
+
+    def __init__(self, path, size=POOL_SIZE, readonly=False):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self):
+        note_connection()
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return connect(self.readonly)
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+            conn.set_progress_handler(None, 0)
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if not self._closed:
+                try:
+                    self._idle.put_nowait(conn)
+                    return
+                except queue.Full:
+                    pass
+        self._discard(conn)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            # напряму через sqlite3.Connection, щоб перевірка не потрапляла в облік запитів
+            sqlite3.Connection.execute(conn, "SELECT 1").fetchone()
+            return not conn.in_transaction
+        except sqlite3.Error:
+            return False
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+_pool = None
+_readonly_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DB_PATH:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_PATH, POOL_SIZE)
+        return _pool
+
+
+def get_readonly_pool():
+    global _readonly_pool
+    with _pool_lock:
+        if _readonly_pool is None or _readonly_pool.path != DB_PATH:
+            if _readonly_pool is not None:
+                _readonly_pool.close()
+            _readonly_pool = ConnectionPool(DB_PATH, POOL_SIZE, readonly=True)
+        return _readonly_pool
+
+
+def init_pool(size=POOL_SIZE):
+    global POOL_SIZE
+    POOL_SIZE = size
+    close_pool()
+    return get_pool()
+
+
+def close_pool():
+    global _pool, _readonly_pool
+    with _pool_lock:
+        for pool in (_pool, _readonly_pool):
+            if pool is not None:
+                pool.close()
+        _pool = _readonly_pool = None
+
+
+atexit.register(close_pool)
+
+
+_local = threading.local()
+
+
+def begin_unit_of_work():
+    # Усі get_db() до end_unit_of_work() (у тому ж потоці) працюють з одним
+    # з'єднанням і однією транзакцією. Повертає False, якщо unit of work уже
+    # відкритий — тоді виклик приєднується до нього.
+    if getattr(_local, "uow", None) is not None:
+        return False
+    _local.uow = {"conn": None, "pool": None, "after_commit": []}
+    return True
+
+
+def end_unit_of_work(commit=True):
+    uow = getattr(_local, "uow", None)
+    if uow is None:
+        return
+    _local.uow = None
+    conn = uow["conn"]
+    if conn is not None:
+        try:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            uow["pool"].release(conn)
+    if commit:
+        _run_callbacks(uow["after_commit"])
+
+
+@contextmanager
+def unit_of_work():
+    started = begin_unit_of_work()
+    try:
+        yield
+    except BaseException:
+        if started:
+            end_unit_of_work(commit=False)
+        raise
+    if started:
+        end_unit_of_work(commit=True)
+
+
+def in_unit_of_work():
+    return getattr(_local, "uow", None) is not None
+
+
+def after_commit(callback):
+    # Виконати callback після фіксації поточної транзакції (unit of work або
+    # блоку get_db()); поза транзакцією — одразу. Після відкату не виконується.
+    uow = getattr(_local, "uow", None)
+    if uow is not None:
+        uow["after_commit"].append(callback)
+        return
+    pending = getattr(_local, "after_commit", None)
+    if pending is not None:
+        pending.append(callback)
+        return
+    callback()
+
+
+def _run_callbacks(callbacks):
+    for callback in callbacks:
+        callback()
+
 
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
-    conn.execute("PRAGMA foreign_keys = ON;")
-    conn.execute("PRAGMA synchronous = NORMAL;")
-    conn.execute("PRAGMA journal_mode = WAL;")
-    conn.row_factory = sqlite3.Row
+    uow = getattr(_local, "uow", None)
+    if uow is not None:
+        if uow["conn"] is None:
+            uow["pool"] = get_pool()
+            uow["conn"] = uow["pool"].acquire()
+        yield uow["conn"]
+        return
+
+    pool = get_pool()
+    conn = pool.acquire()
+    outer_pending = getattr(_local, "after_commit", None)
+    pending = _local.after_commit = []
     try:
         yield conn
         conn.commit()
@@ -17,7 +230,20 @@ def get_db():
         conn.rollback()
         raise
     finally:
-        conn.close()
+        _local.after_commit = outer_pending
+        pool.release(conn)
+    _run_callbacks(pending)
+
+@contextmanager
+def get_readonly_db():
+    # Окреме з'єднання лише для читання: не приєднується до unit of work,
+    # тож його можна тримати довше за запит (потоковий експорт, SQL-консоль).
+    pool = get_readonly_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
 
 def execute_query(query, params=()):
     with get_db() as conn:
@@ -35,4 +261,4 @@ def fetch_one(query, params=()):
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute(query, params)
-        return cur.fetchone()
\ No newline at end of file
+        return cur.fetchone()
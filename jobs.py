@@ -0,0 +1,421 @@
+import io
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import db.utils
+import service
+from db.importer import import_subscribers
+from db.utils import after_commit, get_db, get_pool
+
+# Фонові завдання для довгих адміністративних операцій (імпорт, перебудова
+# зведених таблиць, VACUUM/ANALYZE, пакетне прийняття заявок).
+#
+# Стан завдань зберігається в таблиці Job (міграція 7), виконує їх пул потоків
+# на JOB_WORKERS потоків. Обробник отримує JobContext: ctx.progress() пише
+# прогрес і контрольну точку (checkpoint) у БД і перериває роботу, якщо
+# завдання скасовано. Після перезапуску JobRunner.start() повертає в чергу
+# незавершені завдання: обробник з контрольною точкою продовжує з неї.
+#
+# Живість виконавця визначається орендою (lease_until), а не PID: процес
+# продовжує оренду своїх завдань кожні HEARTBEAT_INTERVAL секунд. Завдання з
+# простроченою орендою (процес завершився, завис або працював на іншому хості)
+# будь-який runner повертає в чергу.
+
+logger = logging.getLogger("jobs")
+
+JOB_WORKERS = 2
+PROGRESS_INTERVAL = 0.5         # секунд між записами прогресу без контрольної точки
+ACTIVE_STATUSES = ("queued", "running")
+MAX_RESULT_DETAILS = 200
+HEARTBEAT_INTERVAL = 15        # секунд між продовженнями оренди
+LEASE_TIMEOUT = 60              # оренда без продовження вважається втраченою
+# Мітка цього процесу у Job.runner_token: рядок змінює лише власник оренди
+RUNNER_TOKEN = uuid.uuid4().hex
+
+
+class JobCancelled(Exception):
+    pass
+
+
+_handlers = {}
+
+
+def handler(kind, title, resumable=True):
+    # Реєстрація обробника fn(ctx, params) -> dict (результат, серіалізується в JSON).
+    # resumable=False — завдання, перерване перезапуском, позначається помилкою.
+    def decorator(fn):
+        _handlers[kind] = (fn, title, resumable)
+        return fn
+    return decorator
+
+
+def job_title(kind):
+    entry = _handlers.get(kind)
+    return entry[1] if entry else kind
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class JobContext:
+
+    def __init__(self, job_id, checkpoint=None):
+        self.job_id = job_id
+        self.checkpoint = checkpoint
+        self._cancel = threading.Event()
+        self._last_write = 0.0
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def save_checkpoint(self, conn, checkpoint):
+        # контрольна точка в транзакції обробника (conn): фіксується разом з
+        # результатом кроку, тож після збою крок не повториться і не загубиться
+        # оренду втрачено — крок відкочується, завдання вже виконує інший runner
+        self.checkpoint = checkpoint
+        cur = conn.execute("UPDATE Job SET checkpoint = ? WHERE id = ? AND runner_token = ?",
+                           (json.dumps(checkpoint), self.job_id, RUNNER_TOKEN))
+        if not cur.rowcount:
+            self._cancel.set()
+            raise JobCancelled()
+
+    def progress(self, fraction=None, message=None, checkpoint=None):
+        # fraction 0..1 або None (невідомо); checkpoint пишеться завжди, решта —
+        # не частіше ніж раз на PROGRESS_INTERVAL
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+        now = time.monotonic()
+        if checkpoint is not None or now - self._last_write >= PROGRESS_INTERVAL:
+            self._last_write = now
+            with get_db() as conn:
+                row = conn.execute("""
+                    UPDATE Job SET
+                        progress = IFNULL(?, progress),
+                        message = IFNULL(?, message),
+                        checkpoint = IFNULL(?, checkpoint),
+                        lease_until = ?
+                    WHERE id = ? AND runner_token = ?
+                    RETURNING cancel_requested
+                """, (fraction, message, json.dumps(checkpoint) if checkpoint is not None else None,
+                      time.time() + LEASE_TIMEOUT, self.job_id, RUNNER_TOKEN)).fetchall()
+            # скасування могло прийти з іншого процесу; без рядка — оренду
+            # втрачено і завдання вже виконує інший runner
+            if not row or row[0]["cancel_requested"]:
+                self._cancel.set()
+        self.check_cancelled()
+
+
+class JobRunner:
+
+    def __init__(self, workers=JOB_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._contexts = {}
+        self._pending = set()           # id завдань у черзі пулу цього процесу
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def start(self):
+        # ідемпотентно: перший виклик створює пул, потік оренди і відновлює
+        # незавершені завдання
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+            self._heartbeat.start()
+        self.resume()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            heartbeat, self._heartbeat = self._heartbeat, None
+            contexts = list(self._contexts.values())
+        self._stop.set()
+        for ctx in contexts:
+            ctx.cancel()
+        if executor is not None:
+            executor.shutdown(wait=wait)
+        if heartbeat is not None and wait:
+            heartbeat.join()
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.renew_leases()
+                self.resume()
+            except Exception:
+                logger.exception("Не вдалося продовжити оренду завдань")
+
+    def renew_leases(self):
+        with get_db() as conn:
+            conn.execute("""
+                UPDATE Job SET lease_until = ?
+                WHERE status = 'running' AND runner_token = ?
+            """, (time.time() + LEASE_TIMEOUT, RUNNER_TOKEN))
+
+    def submit(self, kind, params=None, user=None):
+        if kind not in _handlers:
+            raise ValueError(f"Невідомий тип завдання: {kind}")
+        with get_db() as conn:
+            job_id = conn.execute("""
+                INSERT INTO Job (kind, params, status, created_by, created_at)
+                VALUES (?, ?, 'queued', ?, ?)
+            """, (kind, json.dumps(params or {}, ensure_ascii=False), user, _now())).lastrowid
+        # потік завдання має бачити вже зафіксований рядок Job
+        after_commit(lambda: self._enqueue(job_id))
+        return job_id
+
+    def cancel(self, job_id):
+        # True, якщо завдання ще не завершене; виконуване зупиниться на найближчому progress()
+        with get_db() as conn:
+            cur = conn.execute("""
+                UPDATE Job SET status = 'cancelled', cancel_requested = 1, finished_at = ?
+                WHERE id = ? AND status = 'queued'
+            """, (_now(), job_id))
+            if cur.rowcount:
+                return True
+            cur = conn.execute("UPDATE Job SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                               (job_id,))
+            running = cur.rowcount > 0
+        with self._lock:
+            ctx = self._contexts.get(job_id)
+        if ctx is not None:
+            ctx.cancel()
+        return running
+
+    def resume(self):
+        # Завдання зі статусом running і простроченою орендою перервано
+        # (перезапуск, збій, зависання виконавця): повертаємо їх у чергу (з
+        # контрольною точкою) або позначаємо помилкою, якщо обробник не
+        # підтримує продовження. Умова на оренду повторюється в UPDATE, тож
+        # кілька runner'ів не заберуть одне завдання двічі.
+        now = time.time()
+        with get_db() as conn:
+            rows = conn.execute("""
+                SELECT id, kind, status, cancel_requested FROM Job
+                WHERE status = 'queued'
+                   OR (status = 'running' AND IFNULL(lease_until, 0) < ?)
+                ORDER BY id
+            """, (now,)).fetchall()
+            queued = []
+            for r in rows:
+                if r["status"] == "running":
+                    entry = _handlers.get(r["kind"])
+                    if r["cancel_requested"]:
+                        status, error = "cancelled", None
+                    elif entry is None or not entry[2]:
+                        status, error = "failed", "Виконавець завдання зупинився"
+                    else:
+                        status, error = "queued", None
+                    cur = conn.execute("""
+                        UPDATE Job SET status = ?, error = ?, pid = NULL, runner_token = NULL,
+                                       finished_at = CASE WHEN ? = 'queued' THEN NULL ELSE ? END
+                        WHERE id = ? AND status = 'running' AND IFNULL(lease_until, 0) < ?
+                    """, (status, error, status, _now(), r["id"], now))
+                    if not cur.rowcount or status != "queued":
+                        continue
+                    logger.info("Завдання %s (%s) відновлено: оренду втрачено", r["id"], r["kind"])
+                queued.append(r["id"])
+        for job_id in queued:
+            self._enqueue(job_id)
+
+    def _enqueue(self, job_id):
+        self.start()
+        with self._lock:
+            if job_id in self._pending:
+                return
+            self._pending.add(job_id)
+        self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        # рядок захоплюється умовним UPDATE, тож повторне потрапляння в чергу
+        # (resume + submit) або інший процес не виконають завдання двічі
+        with self._lock:
+            self._pending.discard(job_id)
+        with get_db() as conn:
+            rows = conn.execute("""
+                UPDATE Job SET status = 'running', pid = ?, runner_token = ?, lease_until = ?,
+                               started_at = IFNULL(started_at, ?)
+                WHERE id = ? AND status = 'queued'
+                RETURNING kind, params, checkpoint
+            """, (os.getpid(), RUNNER_TOKEN, time.time() + LEASE_TIMEOUT, _now(), job_id)).fetchall()
+        if not rows:
+            return
+        row = rows[0]
+        ctx = JobContext(job_id, json.loads(row["checkpoint"]) if row["checkpoint"] else None)
+        with self._lock:
+            self._contexts[job_id] = ctx
+
+        status, result, error = "done", None, None
+        try:
+            entry = _handlers.get(row["kind"])
+            if entry is None:
+                raise ValueError(f"Невідомий тип завдання: {row['kind']}")
+            result = entry[0](ctx, json.loads(row["params"] or "{}"))
+        except JobCancelled:
+            status = "cancelled"
+        except Exception as e:
+            logger.exception("Завдання %s (%s) завершилось помилкою", job_id, row["kind"])
+            status, error = "failed", str(e) or e.__class__.__name__
+        finally:
+            with self._lock:
+                self._contexts.pop(job_id, None)
+
+        with get_db() as conn:
+            conn.execute("""
+                UPDATE Job SET
+                    status = ?,
+                    progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END,
+                    result = ?, error = ?, finished_at = ?, lease_until = NULL
+                WHERE id = ? AND runner_token = ?
+            """, (status, status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                  error, _now(), job_id, RUNNER_TOKEN))
+
+
+runner = JobRunner()
+
+
+def get_job(job_id):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM Job WHERE id = ?", (job_id,)).fetchone()
+
+
+def get_jobs(limit=50):
+    with get_db() as conn:
+        return conn.execute("SELECT * FROM Job ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+
+def job_to_dict(row):
+    job = dict(row)
+    for key in ("params", "checkpoint", "result"):
+        job[key] = json.loads(job[key]) if job[key] else None
+    job["title"] = job_title(job["kind"])
+    return job
+
+
+def upload_dir():
+    # файли для імпорту лежать поруч з БД, щоб пережити перезапуск
+    path = pathlib.Path(db.utils.DB_PATH).resolve().parent / "uploads"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+# --- обробники ---
+
+@handler("import", "Імпорт абонентів")
+def run_import(ctx, params):
+    # params: path, format, filename; контрольна точка — лічильники після
+    # останньої зафіксованої пачки, з неї імпорт продовжується після перезапуску
+    done = ctx.checkpoint or {"rows": 0, "subscribers": 0, "phones": 0, "skipped": 0}
+    path = params["path"]
+    size = os.path.getsize(path)
+
+    with open(path, "rb") as raw:
+        stream = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+
+        def checkpoint(conn, stats):
+            ctx.save_checkpoint(conn, {
+                "rows": done["rows"] + stats.rows,
+                "subscribers": done["subscribers"] + stats.subscribers,
+                "phones": done["phones"] + stats.phones,
+                "skipped": done["skipped"] + stats.skipped,
+            })
+
+        def progress(stats):
+            ctx.progress(raw.tell() / size if size else None,
+                         f"Оброблено рядків: {done['rows'] + stats.rows}")
+
+        ctx.check_cancelled()
+        stats = import_subscribers(stream, params["format"], progress=progress, start_row=done["rows"],
+                                   checkpoint=checkpoint)
+
+    os.remove(path)
+    return {
+        "rows": done["rows"] + stats.rows,
+        "subscribers": done["subscribers"] + stats.subscribers,
+        "phones": done["phones"] + stats.phones,
+        "skipped": done["skipped"] + stats.skipped,
+        "rows_per_minute": round(stats.rows_per_minute),
+        "errors": stats.errors,
+    }
+
+
+@handler("rebuild_reports", "Перебудова зведених таблиць звітів")
+def run_rebuild_reports(ctx, params):
+    ctx.progress(0, "Перебудова зведених таблиць")
+    service.rebuild_report_tables()
+    return {}
+
+
+MAINTENANCE_OPERATIONS = {
+    "analyze": "ANALYZE",
+    "optimize": "PRAGMA optimize",
+    "vacuum": "VACUUM",
+}
+
+
+@handler("maintenance", "Обслуговування БД")
+def run_maintenance(ctx, params):
+    # VACUUM не можна виконувати в транзакції, тому окреме з'єднання поза unit of work
+    operation = params.get("operation", "analyze")
+    if operation not in MAINTENANCE_OPERATIONS:
+        raise ValueError(f"Невідома операція: {operation}")
+    ctx.progress(0, MAINTENANCE_OPERATIONS[operation])
+    size_before = os.path.getsize(db.utils.DB_PATH)
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        conn.execute(MAINTENANCE_OPERATIONS[operation])
+    finally:
+        pool.release(conn)
+    return {"operation": operation, "size_before": size_before,
+            "size_after": os.path.getsize(db.utils.DB_PATH)}
+
+
+@handler("approve_number_changes", "Пакетне прийняття заявок на зміну номера")
+def run_approve_number_changes(ctx, params):
+    # одна транзакція: перерване завдання відкотилось, тож повтор безпечний
+    ctx.progress(0, "Перевірка заявок")
+    outcomes = service.approve_number_changes(**params)
+    counts = {}
+    for o in outcomes:
+        counts[o.outcome] = counts.get(o.outcome, 0) + 1
+    return {
+        "total": len(outcomes),
+        "approved": counts.get("approved", 0),
+        "outcomes": {service.NUMBER_CHANGE_OUTCOMES[k]: n for k, n in counts.items()},
+        "conflicts": [[o.request_id, o.message] for o in outcomes if not o.ok][:MAX_RESULT_DETAILS],
+    }
+
+
+@handler("reconcile_debts", "Звірка балансів з журналом боргів")
+def run_reconcile_debts(ctx, params):
+    # params: repair — перерахувати баланси з журналу, якщо знайдено розбіжності
+    ctx.progress(0, "Звірка балансів")
+    before = service.check_debt_ledger()
+    result = {"mismatches": before, "repaired": False}
+    if params.get("repair") and any(before.values()):
+        ctx.progress(0.5, "Перерахунок балансів")
+        service.rebuild_debt_balances()
+        result["repaired"] = True
+        result["after"] = service.check_debt_ledger()
+    return result
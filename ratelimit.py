@@ -0,0 +1,51 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Обмеження частоти подій за ключем (логін, IP) алгоритмом token bucket:
+# у «відрі» до capacity жетонів, вони поповнюються зі швидкістю rate за
+# секунду, кожна подія забирає один жетон. Відра зберігаються в LRU на
+# max_keys ключів, тож перебір випадкових логінів не роздуває пам'ять.
+
+
+class TokenBucketLimiter:
+
+    def __init__(self, capacity, rate, max_keys=10000):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # ключ -> [жетони, час останнього поповнення]
+        self._lock = threading.Lock()
+
+    def allow(self, key, cost=1):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+    def retry_after(self, key, cost=1):
+        # секунд до появи cost жетонів (0 — можна вже зараз)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                return 0.0
+            tokens = min(self.capacity, bucket[0] + (time.monotonic() - bucket[1]) * self.rate)
+        return max(0.0, (cost - tokens) / self.rate)
+
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._buckets.clear()
+            else:
+                self._buckets.pop(key, None)
@@ -1,36 +1,201 @@
+import base64
+import binascii
+import json
 import random
-from db.utils import get_db
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
+from db import derived
+from db.records import record_cursor
+from db.utils import get_db, get_readonly_db, after_commit
+from session_store import store as session_store
 from werkzeug.security import generate_password_hash, check_password_hash
 
+
+class TTLCache:
+    # Потокобезпечний LRU-кеш із часом життя записів та лічильниками влучань
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, item[1]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            if not keys:
+                self._data.clear()
+            for key in keys:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Довідкові дані (оператори, спецслужби, відділення, вулиці) змінюються рідко.
+reference_cache = TTLCache(maxsize=4096, ttl=300)
+
+def _cached_reference(key, load):
+    found, value = reference_cache.get(key)
+    if found:
+        return value
+    with get_db() as conn:
+        value = load(conn.cursor())
+        # незафіксовані зміни поточної транзакції не кешуємо
+        if not conn.in_transaction:
+            reference_cache.set(key, value)
+    return value
+
+def invalidate_reference(*keys):
+    # скидаємо одразу і ще раз після фіксації, щоб паралельний запит
+    # не закешував старе значення між записом і commit. Викликати всередині
+    # блоку get_db() із записом: поза транзакцією after_commit спрацює одразу.
+    reference_cache.invalidate(*keys)
+    after_commit(lambda: reference_cache.invalidate(*keys))
+
+def cache_stats():
+    return {"reference": reference_cache.stats(), "users": user_cache.stats()}
+
+
+# Користувачі за логіном (і відсутні логіни — None) для входу: при масовому
+# вході на зміні та переборі паролів запит до User не повторюється щоразу.
+# Будь-який запис у User скидає кеш повністю — записів мало, а частина з них
+# знає лише id.
+user_cache = TTLCache(maxsize=2048, ttl=60)
+
+def invalidate_users():
+    user_cache.invalidate()
+    after_commit(user_cache.invalidate)
+
 def get_user_by_login(login):
+    found, user = user_cache.get(login)
+    if found:
+        return user
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT * FROM User WHERE login = ?", (login,))
-        return cur.fetchone()
+        cur.execute("SELECT id, login, password, role FROM User WHERE login = ?", (login,))
+        user = cur.fetchone()
+        if not conn.in_transaction:
+            user_cache.set(login, user)
+    return user
+
+# Параметри хешу нових паролів; хеші зі слабшими (старішими) параметрами
+# перераховуються при успішному вході.
+PASSWORD_METHOD = "scrypt:32768:8:1"
+
+# Перевірка пароля навмисно важка для CPU, тому виконується в обмеженому пулі:
+# не більше PASSWORD_WORKERS одночасно і PASSWORD_QUEUE в черзі. Коли черга
+# заповнена, вхід одразу відхиляється (PasswordCheckBusy), а не займає потік сервера.
+PASSWORD_WORKERS = 4
+PASSWORD_QUEUE = 32
+PASSWORD_TIMEOUT = 10       # секунд очікування результату
+
+class PasswordCheckBusy(Exception):
+    pass
+
+_password_pool = ThreadPoolExecutor(PASSWORD_WORKERS, thread_name_prefix="password")
+_password_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + PASSWORD_QUEUE)
+
+def _run_password_task(fn, *args):
+    if not _password_slots.acquire(blocking=False):
+        raise PasswordCheckBusy()
+    try:
+        future = _password_pool.submit(fn, *args)
+    except BaseException:
+        _password_slots.release()
+        raise
+    # місце звільняється, коли хеш пораховано, навіть якщо ми не дочекались
+    future.add_done_callback(lambda f: _password_slots.release())
+    try:
+        return future.result(PASSWORD_TIMEOUT)
+    except FutureTimeoutError:
+        raise PasswordCheckBusy() from None
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_METHOD)
+
+def password_needs_rehash(password_hash):
+    return password_hash.split("$", 1)[0] != PASSWORD_METHOD
 
 def create_user(login: str, password: str, role: str):
-    hashed = generate_password_hash(password)
+    hashed = hash_password(password)
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO User (login, password, role)
             VALUES (?, ?, ?)
         """, (login, hashed, role))
+        invalidate_users()
 
 def delete_user(user_id: int):
+    session_store.revoke_user(user_id)
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("DELETE FROM User WHERE id = ?", (user_id,))
+        invalidate_users()
 
 def update_user_role(user_id: int, new_role: str):
+    # відкриті сесії відкликаються: нова роль діє з наступного входу
+    session_store.revoke_user(user_id)
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("UPDATE User SET role = ? WHERE id = ?", (new_role, user_id))
+        invalidate_users()
 
 def verify_password(user_row, password):
-    if user_row is None:
+    # True/False; PasswordCheckBusy — пул перевірок перевантажений.
+    # Після успішної перевірки хеш зі старими параметрами перераховується;
+    # якщо пул зайнятий, оновлення відкладається до наступного входу.
+    if user_row is None or password is None:
+        return False
+    if not _run_password_task(check_password_hash, user_row["password"], password):
         return False
-    return check_password_hash(user_row["password"], password)
+    if password_needs_rehash(user_row["password"]):
+        try:
+            rehash_password(user_row, password)
+        except PasswordCheckBusy:
+            pass
+    return True
+
+def rehash_password(user_row, password):
+    hashed = _run_password_task(hash_password, password)
+    with get_db() as conn:
+        # лише якщо пароль не змінили паралельно
+        conn.execute("UPDATE User SET password = ? WHERE id = ? AND password = ?",
+                     (hashed, user_row["id"], user_row["password"]))
+        invalidate_users()
 
 def get_all_users():
     with get_db() as conn:
@@ -41,7 +206,7 @@ def get_all_users():
 
 
 def create_registration_request(login: str, password: str):
-    hashed = generate_password_hash(password)
+    hashed = hash_password(password)
     with get_db() as conn:
         cur = conn.cursor()
         cur.execute("""
@@ -80,6 +245,7 @@ def approve_request(req_id: int):
         login = row["login"]
         password_hash = row["password"]
 
+        invalidate_users()
         cur.execute("""
             INSERT INTO User (login, password, role)
             VALUES (?, ?, 'user')
@@ -103,15 +269,29 @@ def reject_request(req_id: int):
 
 
 
+def _street_id(cur, name, st_type):
+    key = ("street", name, st_type)
+    found, street_id = reference_cache.get(key)
+    if found:
+        return street_id
+
+    cur.execute("SELECT id FROM Street WHERE name = ? AND type = ?", (name, st_type))
+    row = cur.fetchone()
+    if row:
+        street_id = row["id"]
+        if not cur.connection.in_transaction:
+            reference_cache.set(key, street_id)
+        return street_id
+
+    cur.execute("INSERT INTO Street (name, type) VALUES (?, ?)", (name, st_type))
+    street_id = cur.lastrowid
+    after_commit(lambda: reference_cache.set(key, street_id))
+    return street_id
+
 def get_or_create_street(name, st_type="вул."):
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("SELECT id FROM Street WHERE name = ? AND type = ?", (name, st_type))
-        row = cur.fetchone()
-        if row:
-            return row["id"]
-        cur.execute("INSERT INTO Street (name, type) VALUES (?, ?)", (name, st_type))
-        return cur.lastrowid
+        return _street_id(cur, name, st_type)
 
 def create_address(street_name, street_type, building, apartment):
     street_id = get_or_create_street(street_name, street_type)
@@ -127,33 +307,21 @@ def update_address(address_id, street_name, street_type, building, apartment):
     with get_db() as conn:
         cur = conn.cursor()
 
-        cur.execute("SELECT id FROM Street WHERE name=? AND type=?", (street_name, street_type))
-        row = cur.fetchone()
-
-        if row:
-            street_id = row["id"]
-        else:
-            cur.execute("INSERT INTO Street (name, type) VALUES (?, ?)", (street_name, street_type))
-            street_id = cur.lastrowid
+        street_id = _street_id(cur, street_name, street_type)
 
         cur.execute("""
             UPDATE Address
             SET id_street=?, building=?, apartment=?
             WHERE id=?
         """, (street_id, building, apartment, address_id))
+        invalidate_reference("post_offices")
 
 def update_or_create_address(address_id, street_name, street_type, building, apartment):
     with get_db() as conn:
         cur = conn.cursor()
 
         # шукаємо або створюємо вулицю
-        cur.execute("SELECT id FROM Street WHERE name=? AND type=?", (street_name, street_type))
-        row = cur.fetchone()
-        if row:
-            street_id = row["id"]
-        else:
-            cur.execute("INSERT INTO Street (name, type) VALUES (?, ?)", (street_name, street_type))
-            street_id = cur.lastrowid
+        street_id = _street_id(cur, street_name, street_type)
 
         # якщо адреса існує — оновити
         if address_id:
@@ -162,6 +330,7 @@ def update_or_create_address(address_id, street_name, street_type, building, apa
                 SET id_street = ?, building = ?, apartment = ?
                 WHERE id = ?
             """, (street_id, building, apartment, address_id))
+            invalidate_reference("post_offices")
             return address_id
 
         # інакше створити нову
@@ -184,8 +353,7 @@ def get_address(address_id):
 
 
 def get_all_post_offices():
-    with get_db() as conn:
-        cur = conn.cursor()
+    def load(cur):
         cur.execute("""
             SELECT PostOffice.*, Street.name AS street_name, Street.type AS street_type,
                    Address.building, Address.apartment
@@ -195,6 +363,7 @@ def get_all_post_offices():
             ORDER BY office_number
         """)
         return cur.fetchall()
+    return _cached_reference("post_offices", load)
 
 def create_post_office_for_address(conn, address_id):
     cur = conn.cursor()
@@ -205,11 +374,13 @@ def create_post_office_for_address(conn, address_id):
         INSERT INTO PostOffice (office_number, id_address)
         VALUES (?, ?)
     """, (office_number, address_id))
+    invalidate_reference("post_offices")
 
     return cur.lastrowid
 
 def update_or_create_post_office(post_office_id, office_number, address_id):
     with get_db() as conn:
+        invalidate_reference("post_offices")
         cur = conn.cursor()
 
         if post_office_id:
@@ -238,29 +409,90 @@ def update_subscriber_address_and_postoffice(sub_id, address_id, post_id):
 
 
 
-def get_all_subscribers():
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+Page = namedtuple("Page", "rows next_cursor prev_cursor")
+
+# Великі списки (абоненти, пошук) повертають компактні db.records.Record замість
+# sqlite3.Row: доступ той самий, а пам'яті на рядок менше (див. benchmark.py --memory)
+COMPACT_ROWS = True
+
+def _listing_cursor(conn):
+    return record_cursor(conn) if COMPACT_ROWS else conn.cursor()
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw.decode("utf-8"))
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+    return values if isinstance(values, list) else None
+
+def _fetch_page(cur, select_sql, params, sort, key_columns, descending=False,
+                after=None, before=None, limit=PAGE_SIZE, where=None):
+    # Keyset-пагінація: замість OFFSET продовжуємо від ключа сортування
+    # останнього (after) або першого (before) рядка попередньої сторінки,
+    # тому будь-яка сторінка коштує стільки ж, скільки перша.
+    # sort — вирази ORDER BY, key_columns — імена тих самих значень у рядку.
+    # where — додаткова умова (її параметри — в кінці params).
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    backward = decode_cursor(before) is not None
+    cursor = decode_cursor(before) if backward else decode_cursor(after)
+    if cursor is not None and len(cursor) != len(sort):
+        cursor = None
+        backward = False
+
+    sql = select_sql
+    params = tuple(params)
+    conditions = [f"({where})"] if where else []
+    if cursor is not None:
+        op = ">" if descending == backward else "<"
+        # окрема умова на перший ключ дає SQLite змогу почати пошук в індексі,
+        # порівняння кортежів (row values) з індексами-виразами не працює
+        conditions.append(f"{sort[0]} {op}= ? AND"
+                          f" ({', '.join(sort)}) {op} ({', '.join('?' * len(sort))})")
+        params += (cursor[0],) + tuple(cursor)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    direction = "DESC" if descending != backward else "ASC"
+    sql += " ORDER BY " + ", ".join(f"{expr} {direction}" for expr in sort) + " LIMIT ?"
+
+    cur.execute(sql, params + (limit + 1,))
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+
+    def key(row):
+        return encode_cursor(row[c] for c in key_columns)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if backward or has_more:
+            next_cursor = key(rows[-1])
+        if (backward and has_more) or (not backward and cursor is not None):
+            prev_cursor = key(rows[0])
+    return Page(rows, next_cursor, prev_cursor)
+
+def get_all_subscribers(after=None, before=None, limit=PAGE_SIZE):
     with get_db() as conn:
-        cur = conn.cursor()
-        cur.execute("""
+        cur = _listing_cursor(conn)
+        return _fetch_page(cur, """
             SELECT
                 s.id,
                 s.lastname,
                 s.firstname,
                 s.middlename,
 
-                (
-                    SELECT pn.number
-                    FROM PhoneNumber pn
-                    WHERE pn.id_subscriber = s.id AND pn.active = 1
-                    ORDER BY 
-                        (CASE pn.type 
-                            WHEN 'mobile' THEN 0
-                            WHEN 'home' THEN 1
-                            WHEN 'service' THEN 2
-                            ELSE 3 END),
-                        pn.id ASC
-                    LIMIT 1
-                ) AS main_phone,
+                mp.number AS main_phone,
 
                 st.type AS street_type,
                 st.name AS street_name,
@@ -271,16 +503,20 @@ def get_all_subscribers():
                     CASE WHEN a.apartment IS NOT NULL THEN ', кв. ' || a.apartment ELSE '' END
                 ) AS full_address,
                 
-                po.office_number
+                po.office_number,
+
+                IFNULL(s.lastname, '') AS sort_lastname,
+                IFNULL(s.firstname, '') AS sort_firstname
                 
             FROM Subscriber s
             LEFT JOIN Address a ON a.id = s.id_address
             LEFT JOIN Street st ON st.id = a.id_street
             LEFT JOIN PostOffice po ON po.id = s.id_post_office
-            
-            ORDER BY s.lastname, s.firstname
-        """)
-        return cur.fetchall()
+            LEFT JOIN PhoneNumber mp ON mp.id = s.main_phone_id
+        """, (),
+            sort=("IFNULL(s.lastname, '')", "IFNULL(s.firstname, '')", "s.id"),
+            key_columns=("sort_lastname", "sort_firstname", "id"),
+            after=after, before=before, limit=limit)
 
 def get_subscriber(sub_id):
     with get_db() as conn:
@@ -303,6 +539,91 @@ def get_subscriber(sub_id):
         """, (sub_id,))
         return cur.fetchone()
 
+PENDING_REQUEST_STATUSES = ("new", "processing")
+LEDGER_PREVIEW = 20             # останніх записів журналу боргів у картці абонента
+
+@dataclass
+class SubscriberProfile:
+    subscriber: sqlite3.Row      # ті самі поля, що й у get_subscriber
+    phones: list = field(default_factory=list)
+    debts: list = field(default_factory=list)
+    active_debt_total: float = 0.0
+    pending_requests: list = field(default_factory=list)
+    ledger: list = field(default_factory=list)
+
+def get_subscriber_profile(sub_id):
+    # Картка абонента одним запитом: телефони, борги й незавершені заявки
+    # збираються підзапитами в JSON-масиви, тож дані узгоджені між собою і
+    # не потребують окремих звернень до БД.
+    with get_db() as conn:
+        row = conn.execute("""
+            SELECT
+                s.*,
+                a.id AS address_id,
+                a.building,
+                a.apartment,
+                st.name AS street_name,
+                st.type AS street_type,
+                po.id AS post_office_id,
+                po.office_number,
+
+                (SELECT json_group_array(json_object(
+                            'id', p.id, 'number', p.number, 'type', p.type,
+                            'active', p.active, 'id_operator', p.id_operator,
+                            'operator_name', p.operator_name))
+                 FROM (SELECT pn.*, mo.name AS operator_name
+                       FROM PhoneNumber pn
+                       LEFT JOIN MobileOperator mo ON mo.id = pn.id_operator
+                       WHERE pn.id_subscriber = s.id
+                       ORDER BY pn.number) p
+                ) AS phones_json,
+
+                (SELECT json_group_array(json_object(
+                            'id', d.id, 'amount', d.amount, 'date_start', d.date_start,
+                            'deadline', d.deadline, 'status', d.status))
+                 FROM (SELECT * FROM Debt
+                       WHERE id_subscriber = s.id
+                       ORDER BY date_start DESC) d
+                ) AS debts_json,
+
+                (SELECT IFNULL(SUM(balance), 0) FROM SubscriberBalance
+                 WHERE id_subscriber = s.id
+                ) AS active_debt_total,
+
+                (SELECT json_group_array(json_object(
+                            'id', l.id, 'id_debt', l.id_debt, 'kind', l.kind,
+                            'amount', l.amount, 'created_at', l.created_at, 'note', l.note))
+                 FROM (SELECT * FROM DebtLedger
+                       WHERE id_subscriber = s.id
+                       ORDER BY id DESC LIMIT ?) l
+                ) AS ledger_json,
+
+                (SELECT json_group_array(json_object(
+                            'id', r.id, 'old_number', r.old_number, 'new_number', r.new_number,
+                            'date_request', r.date_request, 'status', r.status))
+                 FROM (SELECT * FROM NumberChangeRequest
+                       WHERE id_subscriber = s.id AND status IN (?, ?)
+                       ORDER BY date_request DESC) r
+                ) AS requests_json
+
+            FROM Subscriber s
+            LEFT JOIN Address a ON a.id = s.id_address
+            LEFT JOIN Street st ON st.id = a.id_street
+            LEFT JOIN PostOffice po ON po.id = s.id_post_office
+            WHERE s.id = ?
+        """, (LEDGER_PREVIEW,) + PENDING_REQUEST_STATUSES + (sub_id,)).fetchone()
+
+    if row is None:
+        return None
+    return SubscriberProfile(
+        subscriber=row,
+        phones=json.loads(row["phones_json"]),
+        debts=json.loads(row["debts_json"]),
+        active_debt_total=row["active_debt_total"],
+        pending_requests=json.loads(row["requests_json"]),
+        ledger=json.loads(row["ledger_json"]),
+    )
+
 def create_subscriber(lastname, firstname, middlename, address_id, post_office_id):
     with get_db() as conn:
         cur = conn.cursor()
@@ -326,12 +647,33 @@ def delete_subscriber(sub_id):
         cur = conn.cursor()
         cur.execute("DELETE FROM Subscriber WHERE id = ?", (sub_id,))
 
+def _search_index_usable(like):
+    # trigram-індекс допомагає лише коли в масці є фрагмент з 3+ символів;
+    # коротші маски виконуються звичайним LIKE (індекс їм однаково не допоможе)
+    return any(len(part) >= 3 for part in re.split(r"[%_]", like))
+
 def search_subscribers(pattern):
     like = pattern.replace("*", "%").replace("?", "_")
 
+    # Кандидатів шукаємо через FTS5 (trigram) індекс SubscriberSearch, а потім
+    # застосовуємо ту саму умову LIKE, тож результат збігається з повним перебором.
+    # FTS-підзапит через IN, а не JOIN: інакше за статистикою ANALYZE планувальник
+    # може обрати перебір SubscriberSearchTerm з пошуком у FTS на кожен рядок.
+    candidates = ""
+    params = (like, like, like, like, like)
+    if _search_index_usable(like):
+        candidates = """
+            s.id IN (
+                SELECT t.id_subscriber
+                FROM SubscriberSearchTerm t
+                WHERE t.id IN (SELECT rowid FROM SubscriberSearch WHERE term LIKE ?)
+            ) AND
+        """
+        params = (like,) + params
+
     with get_db() as conn:
-        cur = conn.cursor()
-        cur.execute("""
+        cur = _listing_cursor(conn)
+        cur.execute(f"""
             SELECT DISTINCT
                 s.id,
                 s.lastname,
@@ -357,12 +699,13 @@ def search_subscribers(pattern):
             LEFT JOIN Street st ON st.id = a.id_street
             LEFT JOIN PostOffice po ON po.id = s.id_post_office
 
-            WHERE s.lastname LIKE ?
+            WHERE {candidates}
+              (s.lastname LIKE ?
                OR s.firstname LIKE ?
                OR s.middlename LIKE ?
                OR pn.number LIKE ?
-               OR po.office_number LIKE ?
-        """, (like, like, like, like, like))
+               OR po.office_number LIKE ?)
+        """, params)
 
         return cur.fetchall()
 
@@ -370,13 +713,14 @@ def search_subscribers(pattern):
 
 
 def get_all_operators():
-    with get_db() as conn:
-        cur = conn.cursor()
+    def load(cur):
         cur.execute("SELECT * FROM MobileOperator ORDER BY name")
         return cur.fetchall()
+    return _cached_reference("operators", load)
 
 def create_operator(name, prefix):
     with get_db() as conn:
+        invalidate_reference("operators")
         cur = conn.cursor()
         cur.execute("INSERT INTO MobileOperator (name, prefix) VALUES (?, ?)", (name, prefix))
         return cur.lastrowid
@@ -406,22 +750,102 @@ def create_phone(number, ptype, sub_id, operator_id, active=1):
 
 def delete_phone(phone_id):
     with get_db() as conn:
+        invalidate_reference("special_services")
         cur = conn.cursor()
         cur.execute("DELETE FROM PhoneNumber WHERE id = ?", (phone_id,))
 
+def check_main_phones(fix=False):
+    # Перевірка денормалізованого Subscriber.main_phone_id; з fix=True — перебудова
+    with get_db() as conn:
+        broken = derived.check_main_phones(conn)
+        fixed = derived.rebuild_main_phones(conn) if fix and broken else 0
+        return broken, fixed
+
+PHONE_LOOKUP_MODES = ("prefix", "suffix", "contains", "local")
+PHONE_LOOKUP_LIMIT = 200
+
+def lookup_phones(digits, mode="suffix", limit=PHONE_LOOKUP_LIMIT):
+    # Зворотний пошук за фрагментом номера:
+    #   prefix   — номер починається з цифр (індекс idx_phone_number);
+    #   suffix   — номер закінчується цифрами (trigram-індекс PhoneNumberSearch);
+    #   contains — цифри в будь-якому місці номера (PhoneNumberSearch);
+    #   local    — номер без префікса оператора: префікс будь-якого оператора + цифри.
+    # Для suffix/contains потрібно щонайменше 3 цифри.
+    digits = re.sub(r"\D", "", digits or "")
+    if not digits or mode not in PHONE_LOOKUP_MODES:
+        return []
+    if mode in ("suffix", "contains") and len(digits) < 3:
+        return []
+
+    if mode == "prefix":
+        condition = "pn.number GLOB ?"
+        params = (digits + "*",)
+    elif mode == "local":
+        condition = "pn.number IN (SELECT mo2.prefix || ? FROM MobileOperator mo2)"
+        params = (digits,)
+    else:
+        like = "%" + digits if mode == "suffix" else "%" + digits + "%"
+        condition = "pn.id IN (SELECT rowid FROM PhoneNumberSearch WHERE number LIKE ?)"
+        params = (like,)
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT
+                pn.id,
+                pn.number,
+                pn.type,
+                pn.active,
+                mo.name AS operator_name,
+                s.id AS subscriber_id,
+                s.lastname,
+                s.firstname,
+                s.middlename,
+                ss.name AS service_name
+            FROM PhoneNumber pn
+            LEFT JOIN MobileOperator mo ON mo.id = pn.id_operator
+            LEFT JOIN Subscriber s ON s.id = pn.id_subscriber
+            LEFT JOIN SpecialService ss ON ss.id_number = pn.id
+            WHERE {condition}
+            ORDER BY pn.number
+            LIMIT ?
+        """, params + (limit,))
+        return cur.fetchall()
+
 
 
-def get_all_number_change_requests():
+def _number_change_filter(status=None, date_from=None, date_to=None):
+    # умова WHERE для NumberChangeRequest r; status="pending" — new або processing
+    conditions, params = [], []
+    if status == "pending":
+        conditions.append(f"r.status IN ({', '.join('?' * len(PENDING_REQUEST_STATUSES))})")
+        params.extend(PENDING_REQUEST_STATUSES)
+    elif status:
+        conditions.append("r.status = ?")
+        params.append(status)
+    if date_from:
+        conditions.append("r.date_request >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("r.date_request <= ?")
+        params.append(date_to)
+    return " AND ".join(conditions), tuple(params)
+
+def get_all_number_change_requests(after=None, before=None, limit=PAGE_SIZE,
+                                   status=None, date_from=None, date_to=None):
+    where, params = _number_change_filter(status, date_from, date_to)
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("""
+        return _fetch_page(cur, """
             SELECT r.*, 
-                   s.lastname, s.firstname, s.middlename
+                   s.lastname, s.firstname, s.middlename,
+                   IFNULL(r.date_request, '') AS sort_date
             FROM NumberChangeRequest r
             LEFT JOIN Subscriber s ON s.id = r.id_subscriber
-            ORDER BY r.date_request DESC
-        """)
-        return cur.fetchall()
+        """, params,
+            sort=("IFNULL(r.date_request, '')", "r.id"),
+            key_columns=("sort_date", "id"),
+            descending=True, after=after, before=before, limit=limit, where=where)
 
 def get_request(req_id):
     with get_db() as conn:
@@ -444,22 +868,106 @@ def delete_request(request_id):
         cur.execute("DELETE FROM NumberChangeRequest WHERE id=?", (request_id,))
 
 def apply_number_change(request_row):
+    # номер змінюється на місці: тип, оператор і активність телефону зберігаються
     with get_db() as conn:
+        invalidate_reference("special_services")
         cur = conn.cursor()
-
-        sub_id = request_row["id_subscriber"]
-        old_number = request_row["old_number"]
-        new_number = request_row["new_number"]
-
         cur.execute("""
-            DELETE FROM PhoneNumber
-            WHERE number=? AND id_subscriber=?
-        """, (old_number, sub_id))
+            UPDATE PhoneNumber
+            SET number = ?
+            WHERE number = ? AND id_subscriber = ?
+        """, (request_row["new_number"], request_row["old_number"], request_row["id_subscriber"]))
+        return cur.rowcount
+
+NUMBER_CHANGE_OUTCOMES = {
+    "approved": "Номер змінено",
+    "not_found": "Заявку не знайдено",
+    "not_pending": "Заявку вже оброблено",
+    "invalid": "Новий номер не вказано або він збігається зі старим",
+    "old_missing": "У абонента немає старого номера",
+    "new_taken": "Новий номер уже використовується",
+    "duplicate": "Номер або телефон уже змінюється іншою заявкою в цій пачці",
+}
+
+@dataclass
+class NumberChangeOutcome:
+    request_id: int
+    outcome: str                 # ключ NUMBER_CHANGE_OUTCOMES
+    old_number: str = None
+    new_number: str = None
+
+    @property
+    def ok(self):
+        return self.outcome == "approved"
+
+    @property
+    def message(self):
+        return NUMBER_CHANGE_OUTCOMES[self.outcome]
+
+def approve_number_changes(request_ids=None, status="pending", date_from=None, date_to=None):
+    # Пакетне прийняття заявок: вибрані request_ids або всі, що відповідають
+    # фільтру. Одна транзакція: один запит перевіряє всі заявки, далі
+    # змінюються номери і один DELETE прибирає прийняті заявки.
+    # Заявки з конфліктами не змінюються; повертає [NumberChangeOutcome] за id.
+    if request_ids is not None:
+        request_ids = sorted({int(i) for i in request_ids})
+        if not request_ids:
+            return []
+        where, params = "r.id IN (SELECT value FROM json_each(?))", (json.dumps(request_ids),)
+    else:
+        where, params = _number_change_filter(status, date_from, date_to)
 
-        cur.execute("""
-            INSERT INTO PhoneNumber (number, type, id_subscriber, id_operator)
-            VALUES (?, 'mobile', ?, NULL)
-        """, (new_number, sub_id))
+    with get_db() as conn:
+        if not conn.in_transaction:
+            # перевірки і запис мають бачити ті самі дані
+            conn.execute("BEGIN IMMEDIATE")
+        invalidate_reference("special_services")
+        rows = conn.execute(f"""
+            SELECT r.id, r.status, r.old_number, r.new_number,
+                   (SELECT p.id FROM PhoneNumber p
+                    WHERE p.number = r.old_number AND p.id_subscriber = r.id_subscriber
+                    ORDER BY p.id LIMIT 1) AS phone_id,
+                   EXISTS (SELECT 1 FROM PhoneNumber p WHERE p.number = r.new_number) AS new_taken
+            FROM NumberChangeRequest r
+            {"WHERE " + where if where else ""}
+            ORDER BY r.id
+        """, params).fetchall()
+
+        outcomes = {}
+        changes = []
+        new_numbers, phones = set(), set()
+        for r in rows:
+            if r["status"] not in PENDING_REQUEST_STATUSES:
+                outcome = "not_pending"
+            elif not r["new_number"] or r["new_number"] == r["old_number"]:
+                outcome = "invalid"
+            elif r["phone_id"] is None:
+                outcome = "old_missing"
+            elif r["new_taken"]:
+                outcome = "new_taken"
+            elif r["new_number"] in new_numbers or r["phone_id"] in phones:
+                # раніша заявка (менший id) має перевагу
+                outcome = "duplicate"
+            else:
+                outcome = "approved"
+                new_numbers.add(r["new_number"])
+                phones.add(r["phone_id"])
+                changes.append((r["phone_id"], r["new_number"], r["id"]))
+            outcomes[r["id"]] = NumberChangeOutcome(r["id"], outcome, r["old_number"], r["new_number"])
+
+        if changes:
+            # без UPDATE ... FROM (SQLite 3.33) і ->> (3.38): один підготовлений
+            # UPDATE за первинним ключем на кожну зміну
+            conn.executemany("UPDATE PhoneNumber SET number = ? WHERE id = ?",
+                             [(new_number, phone_id) for phone_id, new_number, _ in changes])
+            conn.execute("""
+                DELETE FROM NumberChangeRequest
+                WHERE id IN (SELECT value FROM json_each(?))
+            """, (json.dumps([req_id for _, _, req_id in changes]),))
+
+    if request_ids is None:
+        return list(outcomes.values())
+    return [outcomes.get(i) or NumberChangeOutcome(i, "not_found") for i in request_ids]
 
 
 
@@ -517,51 +1025,59 @@ def update_debt(debt_id, amount, status):
             WHERE id = ?
         """, (amount, status, debt_id))
 
-def get_subscribers_with_debts():
+def get_subscribers_with_debts(after=None, before=None, limit=PAGE_SIZE):
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("""
-            SELECT s.*, SUM(d.amount) AS total_debt
-            FROM Subscriber s
-            JOIN Debt d ON d.id_subscriber = s.id
-            WHERE d.status = 'active'
-            GROUP BY s.id
-            HAVING total_debt > 0
-            ORDER BY total_debt DESC
-        """)
-        return cur.fetchall()
+        # баланс підтримується тригерами журналу боргів (міграція 9),
+        # сторінка читається по індексу idx_subscriber_balance
+        return _fetch_page(cur, """
+            SELECT s.*, b.balance AS total_debt
+            FROM SubscriberBalance b
+            JOIN Subscriber s ON s.id = b.id_subscriber
+        """, (),
+            sort=("b.balance", "b.id_subscriber"),
+            key_columns=("total_debt", "id"),
+            descending=True, after=after, before=before, limit=limit,
+            where="b.balance > 0")
 
 def search_debtors(query: str):
     wild = query.replace("*", "%").replace("?", "_")
     with get_db() as conn:
         cur = conn.cursor()
+        # абоненти знаходяться окремо по кожному індексу NOCASE (міграція 11), і
+        # лише їхні борги — по idx_debt_subscriber; з OR у WHERE SQLite обирав
+        # повне сканування Debt
         cur.execute("""
             SELECT s.lastname, s.firstname, s.middlename,
                    d.amount, d.date_start, d.deadline, d.status
-            FROM Debt d
-            JOIN Subscriber s ON s.id = d.id_subscriber
-            WHERE s.lastname LIKE ?
-               OR s.firstname LIKE ?
-               OR s.middlename LIKE ?
+            FROM Subscriber s
+            JOIN Debt d ON d.id_subscriber = s.id
+            WHERE s.id IN (
+                SELECT id FROM Subscriber WHERE lastname LIKE ?
+                UNION SELECT id FROM Subscriber WHERE firstname LIKE ?
+                UNION SELECT id FROM Subscriber WHERE middlename LIKE ?
+            )
             ORDER BY s.lastname
         """, (wild, wild, wild))
         return cur.fetchall()
 
 
 
-def get_all_repairs():
+def get_all_repairs(after=None, before=None, limit=PAGE_SIZE):
     with get_db() as conn:
         cur = conn.cursor()
-        cur.execute("""
+        return _fetch_page(cur, """
             SELECT rw.*, 
                    st.name AS street_name, st.type AS street_type,
-                   a.building, a.apartment
+                   a.building, a.apartment,
+                   IFNULL(rw.date_start, '') AS sort_date
             FROM RepairWork rw
             LEFT JOIN Address a ON a.id = rw.id_address
             LEFT JOIN Street st ON st.id = a.id_street
-            ORDER BY date_start DESC
-        """)
-        return cur.fetchall()
+        """, (),
+            sort=("IFNULL(rw.date_start, '')", "rw.id"),
+            key_columns=("sort_date", "id"),
+            descending=True, after=after, before=before, limit=limit)
 
 def get_repair(repair_id):
     with get_db() as conn:
@@ -611,17 +1127,20 @@ def search_repairs(query: str):
             FROM RepairWork r
             JOIN Address a ON a.id = r.id_address
             JOIN Street st ON st.id = a.id_street
-            WHERE st.name LIKE ?
-               OR a.building LIKE ?
-               OR a.apartment LIKE ?
+            WHERE r.id_address IN (
+                SELECT a.id FROM Street st
+                JOIN Address a ON a.id_street = st.id
+                WHERE st.name LIKE ?
+                UNION SELECT id FROM Address WHERE building LIKE ?
+                UNION SELECT id FROM Address WHERE apartment LIKE ?
+            )
         """, (wild, wild, wild))
         return cur.fetchall()
 
 
 
 def get_all_special_services():
-    with get_db() as conn:
-        cur = conn.cursor()
+    def load(cur):
         cur.execute("""
             SELECT ss.*, pn.number
             FROM SpecialService ss
@@ -629,184 +1148,359 @@ def get_all_special_services():
             ORDER BY ss.name
         """)
         return cur.fetchall()
+    return _cached_reference("special_services", load)
+
+
+
+CUSTOM_SQL_MAX_ROWS = 1000
+CUSTOM_SQL_TIME_LIMIT = 10.0
+# експорт повертає всі рядки, тому ліміт більший; рахується лише час роботи
+# SQLite, а не очікування, поки клієнт прочитає чергову пачку
+CUSTOM_SQL_EXPORT_TIME_LIMIT = 120.0
+# як часто (у інструкціях віртуальної машини SQLite) викликається progress handler;
+# кількість викликів × крок — оцінка обсягу виконаної роботи (VM-кроків)
+CUSTOM_SQL_PROGRESS_STEP = 1000
+# з увімкненим explain крок дрібніший — точніша оцінка ціною невеликих накладних витрат
+CUSTOM_SQL_EXPLAIN_STEP = 100
+
+class QueryAborted(Exception):
+    pass
+
+@dataclass
+class SqlResult:
+    cols: list = field(default_factory=list)
+    rows: list = field(default_factory=list)
+    truncated: bool = False
+    plan: list = field(default_factory=list)   # [(глибина, опис кроку)]
+    elapsed_ms: float = 0.0
+    vm_steps: int = 0
+
+def explain_query_plan(conn, sql_text):
+    # Дерево EXPLAIN QUERY PLAN як плоский список (глибина, опис) у порядку обходу
+    try:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql_text).fetchall()
+    except sqlite3.Error:
+        return []
+    depth = {0: -1}
+    result = []
+    for node_id, parent, _, detail in plan:
+        depth[node_id] = depth.get(parent, -1) + 1
+        result.append((depth[node_id], detail))
+    return result
+
+# token -> (власник, Event) для запитів SQL-консолі, що виконуються зараз
+_running_queries = {}
+_running_lock = threading.Lock()
+
+def cancel_custom_sql(token, owner=None):
+    with _running_lock:
+        entry = _running_queries.get(token)
+    if entry is None or (owner is not None and entry[0] != owner):
+        return False
+    entry[1].set()
+    return True
+
+class _QueryBudget:
+    # Progress handler для запитів SQL-консолі: перериває виконання після
+    # time_limit секунд роботи SQLite (лише всередині with) або за скасуванням.
+    def __init__(self, cancelled, time_limit):
+        self.cancelled = cancelled
+        self.time_limit = time_limit
+        self.spent = 0.0
+        self.started = None
+        self.calls = 0
+        self.reason = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.spent += time.monotonic() - self.started
+        self.started = None
+        if exc_type is sqlite3.OperationalError:
+            if self.reason == "cancelled":
+                raise QueryAborted("Запит скасовано")
+            if self.reason == "timeout":
+                raise QueryAborted(f"Перевищено ліміт часу виконання ({self.time_limit:g} с)")
+        return False
 
+    def __call__(self):
+        self.calls += 1
+        if self.cancelled.is_set():
+            self.reason = "cancelled"
+            return 1
+        if self.spent + time.monotonic() - self.started > self.time_limit:
+            self.reason = "timeout"
+            return 1
+        return 0
+
+def _register_query(token, owner):
+    cancelled = threading.Event()
+    if token:
+        with _running_lock:
+            _running_queries[token] = (owner, cancelled)
+    return cancelled
+
+def _unregister_query(token):
+    if token:
+        with _running_lock:
+            _running_queries.pop(token, None)
+
+def run_custom_sql(sql_text: str, token=None, owner=None, explain=False,
+                   max_rows=CUSTOM_SQL_MAX_ROWS, time_limit=CUSTOM_SQL_TIME_LIMIT):
+    # Запит виконується на read-only з'єднанні з обмеженням часу (progress handler
+    # перериває виконання), кількості рядків і можливістю скасування за token.
+    # explain=True додає до результату план виконання запиту.
+    budget = _QueryBudget(_register_query(token, owner), time_limit)
+    try:
+        with get_readonly_db() as conn:
+            plan = explain_query_plan(conn, sql_text) if explain else []
+            step = CUSTOM_SQL_EXPLAIN_STEP if explain else CUSTOM_SQL_PROGRESS_STEP
+            conn.set_progress_handler(budget, step)
+            started = time.perf_counter()
+            try:
+                with budget:
+                    cur = conn.cursor()
+                    cur.execute(sql_text)
+                    cols = [d[0] for d in cur.description] if cur.description else []
+                    rows = cur.fetchmany(max_rows + 1) if cols else []
+            finally:
+                conn.set_progress_handler(None, 0)
+    finally:
+        _unregister_query(token)
+
+    return SqlResult(
+        cols, rows[:max_rows], len(rows) > max_rows,
+        plan=plan,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+        vm_steps=budget.calls * step,
+    )
+
+
+def check_report_tables():
+    # {таблиця: кількість розбіжних рядків} для зведених таблиць звітів 6 і 10
+    with get_db() as conn:
+        return derived.check_report_tables(conn)
 
+def rebuild_report_tables():
+    with get_db() as conn:
+        derived.rebuild_report_tables(conn)
+
+# Журнал боргів: назви видів записів і звірка балансів з журналом і боргами
+DEBT_LEDGER_KINDS = {
+    "opening": "Початковий залишок",
+    "charge": "Нарахування",
+    "adjustment": "Коригування",
+    "payment": "Оплата",
+    "writeoff": "Списання",
+    "cancel": "Видалення боргу",
+    "reopen": "Повторне відкриття",
+    "transfer_in": "Перенесення від іншого абонента",
+    "transfer_out": "Перенесення іншому абоненту",
+}
+
+def check_debt_ledger():
+    # {"balances": ..., "debts": ...} — кількість абонентів з розбіжностями
+    with get_db() as conn:
+        return derived.check_debt_ledger(conn)
 
-def run_custom_sql(sql_text: str):
+def rebuild_debt_balances():
+    # баланси перераховуються з журналу; сам журнал не змінюється
     with get_db() as conn:
-        cur = conn.cursor()
-        cur.execute(sql_text)
-        try:
-            rows = cur.fetchall()
-            cols = [d[0] for d in cur.description] if cur.description else []
-            return cols, rows
-        except Exception:
-            return [], []
+        derived.seed_debt_ledger(conn)
+        derived.rebuild_debt_balances(conn)
 
 
-def run_builtin_query(query_id, params):
-    with get_db() as conn:
-        cur = conn.cursor()
+# Вбудовані звіти: id -> SQL. Звіти 5 і 9 мають параметри та лічильник рядків.
+BUILTIN_QUERIES = {
+    "1": """
+            SELECT 
+                name AS "Назва служби",
+                weekday AS "Дні роботи",
+                time_start AS "Початок прийому",
+                time_end AS "Кінець прийому"
+            FROM SpecialService
+            ORDER BY name
+        """,
+
+    "2": """
+            SELECT 
+                s.lastname AS "Прізвище",
+                s.firstname AS "Ім’я",
+                s.middlename AS "По батькові",
+                r.old_number AS "Старий номер",
+                r.new_number AS "Новий номер",
+                r.date_request AS "Дата заявки"
+            FROM NumberChangeRequest r
+            JOIN Subscriber s ON s.id = r.id_subscriber
+            ORDER BY r.date_request DESC
+        """,
 
-        if query_id == "1":
-            cur.execute("""
-                SELECT 
-                    name AS "Назва служби",
-                    weekday AS "Дні роботи",
-                    time_start AS "Початок прийому",
-                    time_end AS "Кінець прийому"
-                FROM SpecialService
-                ORDER BY name
-            """)
-            return cur.fetchall()
-
-        if query_id == "2":
-            cur.execute("""
-                SELECT 
-                    s.lastname AS "Прізвище",
-                    s.firstname AS "Ім’я",
-                    s.middlename AS "По батькові",
-                    r.old_number AS "Старий номер",
-                    r.new_number AS "Новий номер",
-                    r.date_request AS "Дата заявки"
-                FROM NumberChangeRequest r
-                JOIN Subscriber s ON s.id = r.id_subscriber
-                ORDER BY r.date_request DESC
-            """)
-            return cur.fetchall()
-
-
-        if query_id == "3":
-            cur.execute("""
-                SELECT 
-                    st.type || '. ' || st.name AS "Вулиця",
-                    a.building AS "Будинок",
-                    a.apartment AS "Квартира",
-                    rw.date_start AS "Початок ремонту",
-                    rw.date_end AS "Кінець ремонту",
-                    rw.description AS "Опис робіт"
-                FROM RepairWork rw
-                JOIN Address a ON a.id = rw.id_address
-                JOIN Street st ON st.id = a.id_street
-                ORDER BY rw.date_start
-            """)
-            return cur.fetchall()
-
-
-        if query_id == "4":
-            cur.execute("""
-                SELECT 
-                    ss.name AS "Назва служби",
-                    pn.number AS "Телефон"
-                FROM SpecialService ss
-                JOIN PhoneNumber pn ON pn.id = ss.id_number
-                ORDER BY ss.name
-            """)
-            return cur.fetchall()
+    "3": """
+            SELECT 
+                st.type || '. ' || st.name AS "Вулиця",
+                a.building AS "Будинок",
+                a.apartment AS "Квартира",
+                rw.date_start AS "Початок ремонту",
+                rw.date_end AS "Кінець ремонту",
+                rw.description AS "Опис робіт"
+            FROM RepairWork rw
+            JOIN Address a ON a.id = rw.id_address
+            JOIN Street st ON st.id = a.id_street
+            ORDER BY rw.date_start
+        """,
 
+    "4": """
+            SELECT 
+                ss.name AS "Назва служби",
+                pn.number AS "Телефон"
+            FROM SpecialService ss
+            JOIN PhoneNumber pn ON pn.id = ss.id_number
+            ORDER BY ss.name
+        """,
+
+    "5": """
+            SELECT 
+                s.lastname AS "Прізвище",
+                s.firstname AS "Ім’я",
+                s.middlename AS "По батькові"
+            FROM Subscriber s
+            WHERE s.lastname LIKE ? AND s.firstname LIKE ?
+        """,
 
-        if query_id == "5":
-            lastname = params.get("lastname", "")
-            firstname = params.get("firstname", "")
+    "6": """
+            SELECT 
+                mo.name AS "Оператор",
+                r.phone_count AS "Кількість абонентів"
+            FROM ReportOperatorPhones r
+            JOIN MobileOperator mo ON mo.id = r.id_operator
+            WHERE r.phone_count > 0
+            ORDER BY r.phone_count DESC
+        """,
+
+    "7": """
+            SELECT 
+                s.lastname AS "Прізвище",
+                s.firstname AS "Ім’я",
+                s.middlename AS "По батькові",
+                ROUND(b.balance, 2) AS "Загальна заборгованість"
+            FROM SubscriberBalance b
+            JOIN Subscriber s ON s.id = b.id_subscriber
+            WHERE b.balance > 0
+            ORDER BY b.balance DESC
+        """,
+
+    "8": """
+            SELECT 
+                s.lastname AS "Прізвище",
+                s.firstname AS "Ім’я",
+                s.middlename AS "По батькові",
+                r.old_number AS "Старий номер",
+                r.new_number AS "Новий номер",
+                st.type || '. ' || st.name || ' ' || a.building ||
+                    CASE WHEN a.apartment IS NOT NULL 
+                         THEN ', кв. ' || a.apartment 
+                         ELSE '' END AS "Поточна адреса"
+            FROM NumberChangeRequest r
+            JOIN Subscriber s ON s.id = r.id_subscriber
+            JOIN Address a ON a.id = s.id_address
+            JOIN Street st ON st.id = a.id_street
+            ORDER BY r.date_request DESC
+        """,
 
-            cur.execute("""
-                SELECT 
-                    s.lastname AS "Прізвище",
-                    s.firstname AS "Ім’я",
-                    s.middlename AS "По батькові"
-                FROM Subscriber s
-                WHERE s.lastname LIKE ? AND s.firstname LIKE ?
-            """, (lastname + "%", firstname + "%"))
-
-            rows = cur.fetchall()
-            return rows, len(rows)
+    "9": """
+            SELECT 
+                s.lastname AS "Прізвище",
+                s.firstname AS "Ім’я",
+                s.middlename AS "По батькові",
+                st.type AS "Тип вулиці",
+                st.name AS "Назва вулиці",
+                a.building AS "Будинок",
+                a.apartment AS "Квартира"
+            FROM Subscriber s
+            JOIN Address a ON a.id = s.id_address
+            JOIN Street st ON st.id = a.id_street
+            WHERE st.name LIKE ?
+            ORDER BY s.lastname, s.firstname
+        """,
 
+    "10": """
+            SELECT 
+                st.type || '. ' || st.name AS "Вулиця",
+                r.resident_count AS "Кількість мешканців"
+            FROM ReportStreetResidents r
+            JOIN Street st ON st.id = r.id_street
+            WHERE r.resident_count > 0
+            ORDER BY r.resident_count DESC
+        """,
+}
+
+COUNTED_QUERIES = ("5", "9")
+
+def _builtin_query_args(query_id, params):
+    if query_id == "5":
+        return (params.get("lastname", "") + "%", params.get("firstname", "") + "%")
+    if query_id == "9":
+        return (params.get("street_name", "") + "%",)
+    return ()
 
-        if query_id == "6":
-            cur.execute("""
-                SELECT 
-                    mo.name AS "Оператор",
-                    COUNT(pn.id) AS "Кількість абонентів"
-                FROM PhoneNumber pn
-                JOIN MobileOperator mo ON mo.id = pn.id_operator
-                WHERE pn.active = 1
-                GROUP BY mo.id
-                ORDER BY COUNT(pn.id) DESC
-            """)
-            return cur.fetchall()
-
-
-        if query_id == "7":
-            cur.execute("""
-                SELECT 
-                    s.lastname AS "Прізвище",
-                    s.firstname AS "Ім’я",
-                    s.middlename AS "По батькові",
-                    SUM(d.amount) AS "Загальна заборгованість"
-                FROM Debt d
-                JOIN Subscriber s ON s.id = d.id_subscriber
-                WHERE d.status = 'active'
-                GROUP BY s.id
-                ORDER BY SUM(d.amount) DESC
-            """)
-            return cur.fetchall()
-
-
-        if query_id == "8":
-            cur.execute("""
-                SELECT 
-                    s.lastname AS "Прізвище",
-                    s.firstname AS "Ім’я",
-                    s.middlename AS "По батькові",
-                    r.old_number AS "Старий номер",
-                    r.new_number AS "Новий номер",
-                    st.type || '. ' || st.name || ' ' || a.building ||
-                        CASE WHEN a.apartment IS NOT NULL 
-                             THEN ', кв. ' || a.apartment 
-                             ELSE '' END AS "Поточна адреса"
-                FROM NumberChangeRequest r
-                JOIN Subscriber s ON s.id = r.id_subscriber
-                JOIN Address a ON a.id = s.id_address
-                JOIN Street st ON st.id = a.id_street
-                ORDER BY r.date_request DESC
-            """)
-            return cur.fetchall()
-
-
-        if query_id == "9":
-            street = params.get("street_name", "")
+def run_builtin_query(query_id, params):
+    sql = BUILTIN_QUERIES.get(query_id)
+    if sql is None:
+        return []
 
-            cur.execute("""
-                SELECT 
-                    s.lastname AS "Прізвище",
-                    s.firstname AS "Ім’я",
-                    s.middlename AS "По батькові",
-                    st.type AS "Тип вулиці",
-                    st.name AS "Назва вулиці",
-                    a.building AS "Будинок",
-                    a.apartment AS "Квартира"
-                FROM Subscriber s
-                JOIN Address a ON a.id = s.id_address
-                JOIN Street st ON st.id = a.id_street
-                WHERE st.name LIKE ?
-                ORDER BY s.lastname, s.firstname
-            """, (street + "%",))
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, _builtin_query_args(query_id, params))
+        rows = cur.fetchall()
 
-            rows = cur.fetchall()
+        if query_id in COUNTED_QUERIES:
             return rows, len(rows)
+        return rows
 
 
-        if query_id == "10":
-            cur.execute("""
-                SELECT 
-                    st.type || '. ' || st.name AS "Вулиця",
-                    COUNT(s.id) AS "Кількість мешканців"
-                FROM Subscriber s
-                JOIN Address a ON a.id = s.id_address
-                JOIN Street st ON st.id = a.id_street
-                GROUP BY st.id
-                ORDER BY COUNT(s.id) DESC
-            """)
-            return cur.fetchall()
+EXPORT_BATCH_SIZE = 500
 
-        return []
+def _stream_query(sql, args=(), batch_size=EXPORT_BATCH_SIZE):
+    # Генератор для потокового експорту: спершу список колонок, далі пачки
+    # рядків з fetchmany — у пам'яті ніколи не більше batch_size рядків.
+    # Окреме read-only з'єднання, бо генератор живе довше за запит.
+    with get_readonly_db() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, args)
+        yield [d[0] for d in cur.description] if cur.description else []
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+def stream_builtin_query(query_id, params, batch_size=EXPORT_BATCH_SIZE):
+    sql = BUILTIN_QUERIES.get(query_id)
+    if sql is None:
+        return None
+    return _stream_query(sql, _builtin_query_args(query_id, params), batch_size)
+
+def stream_custom_sql(sql_text: str, token=None, owner=None, batch_size=EXPORT_BATCH_SIZE,
+                      time_limit=CUSTOM_SQL_EXPORT_TIME_LIMIT):
+    # Як _stream_query, але з обмеженнями SQL-консолі: ліміт часу і скасування за token
+    budget = _QueryBudget(_register_query(token, owner), time_limit)
+    try:
+        with get_readonly_db() as conn:
+            conn.set_progress_handler(budget, CUSTOM_SQL_PROGRESS_STEP)
+            try:
+                with budget:
+                    cur = conn.cursor()
+                    cur.execute(sql_text)
+                yield [d[0] for d in cur.description] if cur.description else []
+                while True:
+                    with budget:
+                        rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+            finally:
+                conn.set_progress_handler(None, 0)
+    finally:
+        _unregister_query(token)
@@ -0,0 +1,153 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from db.utils import after_commit, get_db
+
+# Серверні сесії входу: cookie містить лише випадковий id сесії, а користувач
+# і роль читаються з таблиці Session (міграція 8) через LRU-кеш у пам'яті.
+#
+# У БД зберігається sha256 від id, тож витік БД не дає готових cookie.
+# Відкликання (logout, видалення користувача, зміна ролі) видаляє рядки і
+# записи кешу одразу; інші процеси побачать його не пізніше ніж за CACHE_TTL.
+# Час останньої активності пишеться не частіше ніж раз на TOUCH_INTERVAL,
+# прострочені сесії видаляються раз на SWEEP_INTERVAL.
+
+SESSION_COOKIE = "sid"
+IDLE_TIMEOUT = 8 * 3600         # секунд без активності до завершення сесії
+TOUCH_INTERVAL = 300
+CACHE_SIZE = 10000
+CACHE_TTL = 30
+SWEEP_INTERVAL = 3600
+
+
+def _key(sid):
+    return hashlib.sha256(sid.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("user", "expires_at", "checked_at", "touched_at")
+
+    def __init__(self, user, expires_at, checked_at, touched_at):
+        self.user = user
+        self.expires_at = expires_at
+        self.checked_at = checked_at
+        self.touched_at = touched_at
+
+
+class SessionStore:
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()     # sid -> _Entry
+        self._by_user = {}              # id користувача -> {sid}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def create(self, user_id, ip=None, user_agent=None):
+        sid = secrets.token_urlsafe(32)
+        now = time.time()
+        with get_db() as conn:
+            conn.execute("""
+                INSERT INTO Session (id, user_id, created_at, last_seen, expires_at, ip, user_agent)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (_key(sid), user_id, now, now, now + IDLE_TIMEOUT, ip, user_agent))
+        return sid
+
+    def get(self, sid):
+        # {"id", "login", "role"} або None, якщо сесії немає чи вона прострочена
+        if not sid:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is not None and entry.checked_at + CACHE_TTL > now and entry.expires_at > now:
+                self._cache.move_to_end(sid)
+                if now - entry.touched_at < TOUCH_INTERVAL:
+                    return entry.user
+
+        with get_db() as conn:
+            row = conn.execute("""
+                SELECT s.user_id, s.last_seen, s.expires_at, u.login, u.role
+                FROM Session s
+                JOIN User u ON u.id = s.user_id
+                WHERE s.id = ?
+            """, (_key(sid),)).fetchone()
+            if row is None or row["expires_at"] <= now:
+                self._forget(sid)
+                return None
+            touched_at = row["last_seen"]
+            expires_at = row["expires_at"]
+            if now - touched_at >= TOUCH_INTERVAL:
+                touched_at, expires_at = now, now + IDLE_TIMEOUT
+                conn.execute("UPDATE Session SET last_seen = ?, expires_at = ? WHERE id = ?",
+                             (touched_at, expires_at, _key(sid)))
+
+        user = {"id": row["user_id"], "login": row["login"], "role": row["role"]}
+        with self._lock:
+            self._cache[sid] = _Entry(user, expires_at, now, touched_at)
+            self._cache.move_to_end(sid)
+            self._by_user.setdefault(user["id"], set()).add(sid)
+            while len(self._cache) > self.cache_size:
+                old_sid, old = self._cache.popitem(last=False)
+                self._drop_index(old_sid, old.user["id"])
+        return user
+
+    def revoke(self, sid):
+        if not sid:
+            return
+        self._forget(sid)
+        with get_db() as conn:
+            conn.execute("DELETE FROM Session WHERE id = ?", (_key(sid),))
+        after_commit(lambda: self._forget(sid))
+
+    def revoke_user(self, user_id):
+        # усі сесії користувача; кеш чиститься ще раз після фіксації, щоб
+        # паралельний запит не повернув у кеш щойно відкликану сесію
+        self._forget_user(user_id)
+        with get_db() as conn:
+            conn.execute("DELETE FROM Session WHERE user_id = ?", (user_id,))
+        after_commit(lambda: self._forget_user(user_id))
+
+    def sweep(self):
+        now = time.time()
+        self._last_sweep = now
+        with get_db() as conn:
+            deleted = conn.execute("DELETE FROM Session WHERE expires_at <= ?", (now,)).rowcount
+        with self._lock:
+            for sid in [sid for sid, entry in self._cache.items() if entry.expires_at <= now]:
+                self._drop_index(sid, self._cache.pop(sid).user["id"])
+        return deleted
+
+    def maybe_sweep(self):
+        if time.time() - self._last_sweep >= SWEEP_INTERVAL:
+            return self.sweep()
+        return 0
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._by_user.clear()
+
+    def _forget(self, sid):
+        with self._lock:
+            entry = self._cache.pop(sid, None)
+            if entry is not None:
+                self._drop_index(sid, entry.user["id"])
+
+    def _forget_user(self, user_id):
+        with self._lock:
+            for sid in self._by_user.pop(user_id, ()):
+                self._cache.pop(sid, None)
+
+    def _drop_index(self, sid, user_id):
+        sids = self._by_user.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._by_user[user_id]
+
+
+store = SessionStore()
@@ -6,6 +6,22 @@ document.addEventListener("DOMContentLoaded", () => {
         searchInput.focus();
     }
 
+    // SQL-консоль: під час виконання запиту показуємо кнопку скасування
+    const sqlForm = document.getElementById("sql-form");
+    const sqlCancel = document.getElementById("sql-cancel");
+    if (sqlForm && sqlCancel) {
+        sqlForm.addEventListener("submit", (e) => {
+            if (e.submitter && e.submitter.getAttribute("formaction")) {
+                return;
+            }
+            sqlCancel.classList.remove("d-none");
+        });
+        sqlCancel.addEventListener("click", () => {
+            fetch(sqlForm.dataset.cancelUrl, {method: "POST"});
+            sqlCancel.disabled = true;
+        });
+    }
+
     document.querySelectorAll("[data-confirm]").forEach(el => {
         el.addEventListener("click", (e) => {
             const msg = el.getAttribute("data-confirm") || "Ви впевнені?";
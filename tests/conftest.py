@@ -0,0 +1,17 @@
+import pathlib
+import sys
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+import db.utils
+
+
+@pytest.fixture(scope="session")
+def database(tmp_path_factory):
+    # окрема тимчасова БД з демонстраційними даними на весь прогін тестів
+    from db.init import init_db
+    db.utils.DB_PATH = str(tmp_path_factory.mktemp("db") / "test.sqlite")
+    init_db()
+    return db.utils.DB_PATH
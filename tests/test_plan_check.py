@@ -0,0 +1,37 @@
+import pytest
+
+import db.utils
+import service
+from db.generate import generate
+from db.init import create_admin, create_mobile_operators, create_special_services, create_tables
+from db.migrations import migrate
+from db.plan_check import DEFAULT_THRESHOLD, check_query_plans
+
+# масштаб бенчмарку: на менших БД планувальник ще обирає індекси там, де на
+# реальних обсягах переходить до повного сканування
+SUBSCRIBERS = 100000
+
+
+@pytest.fixture(scope="module")
+def generated_db(tmp_path_factory):
+    previous = db.utils.DB_PATH
+    db.utils.DB_PATH = str(tmp_path_factory.mktemp("plan") / "generated.sqlite")
+    service.reference_cache.invalidate()
+    service.user_cache.invalidate()
+    # як python -m db.generate
+    create_tables()
+    migrate()
+    create_admin()
+    create_mobile_operators()
+    create_special_services()
+    generate(SUBSCRIBERS)
+    yield db.utils.DB_PATH
+    db.utils.DB_PATH = previous
+    service.reference_cache.invalidate()
+    service.user_cache.invalidate()
+
+
+def test_no_full_scans(generated_db):
+    problems = check_query_plans(DEFAULT_THRESHOLD)
+    assert not problems, "\n".join(f"{name}: {detail} ({table}, {rows})"
+                                   for name, table, rows, detail, sql in problems)
@@ -0,0 +1,28 @@
+import pytest
+
+import service
+from app import BUDGET_CHECK_ENDPOINTS, app
+
+
+@pytest.fixture
+def runner(database, monkeypatch):
+    # check-query-budget вмикає testing і може змінити QUERY_BUDGET — повертаємо після тесту
+    monkeypatch.setattr(app, "testing", app.testing)
+    monkeypatch.setitem(app.config, "QUERY_BUDGET", app.config["QUERY_BUDGET"])
+    # холодні кеші довідників, як після старту процесу
+    service.reference_cache.invalidate()
+    service.user_cache.invalidate()
+    return app.test_cli_runner()
+
+
+def test_routes_within_query_budget(runner):
+    result = runner.invoke(args=["check-query-budget"])
+    assert result.exit_code == 0, result.output
+    # кожен маршрут справді перевірено, а не пропущено через порожню таблицю
+    assert result.output.count("[OK]") == len(BUDGET_CHECK_ENDPOINTS), result.output
+
+
+def test_route_over_budget_fails(runner):
+    result = runner.invoke(args=["check-query-budget", "--budget", "0"])
+    assert result.exit_code == 1
+    assert "понад бюджет" in result.output
@@ -0,0 +1,49 @@
+import pytest
+
+import service
+from app import app
+
+
+def _partial_write_then_fail():
+    sub = service.get_all_subscribers(limit=1).rows[0]
+    service.update_subscriber(sub["id"], "PARTIAL", sub["firstname"], sub["middlename"])
+    raise RuntimeError("збій після запису")
+
+
+def _partial_write_then_500():
+    sub = service.get_all_subscribers(limit=1).rows[0]
+    service.update_subscriber(sub["id"], "PARTIAL", sub["firstname"], sub["middlename"])
+    return "помилка", 500
+
+
+app.add_url_rule("/_test/fail", view_func=_partial_write_then_fail)
+app.add_url_rule("/_test/error", view_func=_partial_write_then_500)
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    # як у продакшені: без testing/debug Flask сам обробляє виняток і віддає 500
+    monkeypatch.setattr(app, "testing", False)
+    monkeypatch.setattr(app, "debug", False)
+    return app.test_client()
+
+
+def _partial_count():
+    with service.get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM Subscriber WHERE lastname = 'PARTIAL'").fetchone()[0]
+
+
+@pytest.mark.parametrize("url", ["/_test/fail", "/_test/error"])
+def test_failed_request_rolls_back(client, url):
+    response = client.get(url)
+    assert response.status_code == 500
+    assert _partial_count() == 0
+
+
+def test_successful_request_commits(client):
+    sub = service.get_all_subscribers(limit=1).rows[0]
+    with app.test_request_context():
+        app.preprocess_request()
+        service.update_subscriber(sub["id"], sub["lastname"] + "-ok", sub["firstname"], sub["middlename"])
+        app.process_response(app.response_class("ok"))
+    assert service.get_subscriber(sub["id"])["lastname"] == sub["lastname"] + "-ok"